@@ -274,6 +274,9 @@ class DataMeshAdmin:
         # setup the account to allow glue:ShareResource through RAM
         self._allow_glue_ram_integration()
 
+        # deleted and denied subscriptions are removed once their retention period has passed
+        self._subscription_tracker.enable_expiry()
+
         return {
             "Manager": self._api_tuple(mgr_tuple),
             "ReadOnly": self._api_tuple(ro_tuple),
@@ -461,3 +464,47 @@ class DataMeshAdmin:
         :return:
         '''
         return self._initialize_account_as(type=CONSUMER, crawler_role_arn=None)
+
+    def export_subscriptions(self, output_path: str, total_segments: int = 4, workers: int = None) -> int:
+        '''
+        Exports every Subscription in the Data Mesh to a newline delimited JSON file, for audit, chargeback or migration.
+        The Subscriptions table is read with a parallel scan of total_segments, using up to workers threads.
+        :param output_path:
+        :param total_segments:
+        :param workers:
+        :return: The number of Subscriptions exported
+        '''
+        if self._subscription_tracker is None:
+            self._subscription_tracker = SubscriberTracker(data_mesh_account_id=self._data_mesh_account_id,
+                                                           credentials=self._session.get_credentials(),
+                                                           region_name=self._region,
+                                                           log_level=self._log_level)
+
+        exported = 0
+        for _ in self._subscription_tracker.export_all(total_segments=int(total_segments),
+                                                       workers=None if workers is None else int(workers),
+                                                       output_path=output_path):
+            exported += 1
+
+        self._logger.info(f"Exported {exported} Subscriptions to {output_path}")
+
+        return exported
+
+    def archive_subscriptions(self, output_path: str, total_segments: int = 4, workers: int = None) -> dict:
+        '''
+        Moves deleted and denied Subscriptions whose retention period has passed into a gzip compressed, newline
+        delimited JSON archive, so that reads of the Subscriptions table only pay for live Subscriptions
+        :param output_path:
+        :param total_segments:
+        :param workers:
+        :return: dict of the number of Subscriptions archived, and skipped because they were reactivated
+        '''
+        if self._subscription_tracker is None:
+            self._subscription_tracker = SubscriberTracker(data_mesh_account_id=self._data_mesh_account_id,
+                                                           credentials=self._session.get_credentials(),
+                                                           region_name=self._region,
+                                                           log_level=self._log_level)
+
+        return self._subscription_tracker.archive_expired(output_path=output_path,
+                                                          total_segments=int(total_segments),
+                                                          workers=None if workers is None else int(workers))
@@ -73,7 +73,10 @@ class DataMeshConsumer:
         self._subscription_tracker = SubscriberTracker(credentials=_data_mesh_credentials,
                                                        data_mesh_account_id=data_mesh_account_id,
                                                        region_name=self._current_region,
-                                                       log_level=self._log_level)
+                                                       log_level=self._log_level,
+                                                       cache_size=SUBSCRIPTION_CACHE_SIZE,
+                                                       cache_ttl_seconds=SUBSCRIPTION_CACHE_TTL_SECONDS,
+                                                       lazy_init=True)
 
         # finally, generate a read-only set of credentials in the mesh
         self._ro_session, _ro_creds, _ro_arn = utils.assume_iam_role(
@@ -122,6 +125,48 @@ class DataMeshConsumer:
             suppress_object_validation=True
         )
 
+    def request_access_to_products(self, manifest) -> list:
+        '''
+        Requests access to many data products in a single call, such as when onboarding a new consumer. Requests
+        which duplicate each other or an existing subscription are not created again, and the tables in each database
+        are validated with a single lookup.
+        :param manifest: list of dicts containing owner_account_id, database_name, tables and request_permissions. May
+        also be supplied as a JSON string, or the path to a JSON file
+        :return:
+        '''
+        if isinstance(manifest, str):
+            if os.path.isfile(manifest):
+                with open(manifest, 'r') as f:
+                    manifest = json.load(f)
+            else:
+                manifest = json.loads(manifest)
+
+        requests = []
+        for entry in manifest:
+            requests.append({
+                'owner_account_id': entry.get('owner_account_id'),
+                'database_name': entry.get('database_name'),
+                'tables': utils.ensure_list(entry.get('tables')),
+                'request_grants': utils.ensure_list(entry.get('request_permissions'))
+            })
+
+        # validate that the objects are visible to the consumer, one database at a time
+        tables_by_database = {}
+        for r in requests:
+            tables_by_database.setdefault(r.get('database_name'), set()).update(r.get('tables'))
+
+        for database_name, tables in tables_by_database.items():
+            missing = tables - self._mesh_automator.get_table_names(database_name=database_name)
+
+            if len(missing) > 0:
+                raise Exception(f"Tables {sorted(missing)} Not Found in Database {database_name}")
+
+        return self._subscription_tracker.create_subscription_requests(
+            principal=self._current_account.get('Account'),
+            requests=requests,
+            suppress_object_validation=True
+        )
+
     def finalize_subscription(self, subscription_id: str) -> None:
         '''
         Finalizes the process of requesting access to a data product. This imports the granted subscription into the consumer's account
@@ -167,16 +212,50 @@ class DataMeshConsumer:
     def get_subscription(self, request_id: str) -> dict:
         return self._subscription_tracker.get_subscription(subscription_id=request_id)
 
+    def get_subscription_history(self, request_id: str, start_token: dict = None, page_size: int = None) -> dict:
+        '''
+        Returns the history of a subscription, including every status change and the notes recorded with it
+        :param request_id:
+        :param start_token: LastEvaluatedKey returned by a previous call, from which to continue
+        :param page_size:
+        :return:
+        '''
+        return self._subscription_tracker.get_subscription_history(subscription_id=request_id,
+                                                                   start_token=start_token, page_size=page_size)
+
     def get_table_info(self, database_name: str, table_name: str):
         return self._consumer_automator.describe_table(database_name, table_name)
 
-    def list_product_access(self) -> dict:
+    def list_product_access(self, limit: int = None) -> dict:
         '''
         Lists active and pending product access grants.
+        :param limit: Maximum number of subscriptions to return. All subscriptions are returned if not supplied
+        :return:
+        '''
+        me = self._sts_client.get_caller_identity().get('Account')
+        subscriptions = self._subscription_tracker.iter_subscriptions(principal_id=me,
+                                                                      limit=None if limit is None else int(limit))
+        return {'Subscriptions': list(subscriptions)}
+
+    def list_product_access_changed_since(self, since: int, limit: int = None) -> dict:
+        '''
+        Lists product access grants of any status which have been created or updated since a watermark. Pass the
+        Watermark returned by one call as the since value of the next to only receive new changes
+        :param since: Watermark returned by the previous call, or UTC epoch milliseconds for the first call
+        :param limit: Maximum number of subscriptions to return
         :return:
         '''
         me = self._sts_client.get_caller_identity().get('Account')
-        return self._subscription_tracker.list_subscriptions(principal_id=me, request_status=STATUS_ACTIVE)
+        return self._subscription_tracker.list_subscriptions_changed_since(
+            watermark=since, principal_id=me, limit=None if limit is None else int(limit))
+
+    def get_product_access_counts(self) -> dict:
+        '''
+        Returns the number of subscriptions made by this consumer in each Status
+        :return: dict of Status to count
+        '''
+        me = self._sts_client.get_caller_identity().get('Account')
+        return self._subscription_tracker.get_subscription_counts(principal_id=me)
 
     def delete_subscription(self, subscription_id: str, reason: str):
         '''
@@ -195,4 +274,5 @@ class DataMeshConsumer:
             self._consumer_automator.leave_ram_shares(principal=subscription.get(SUBSCRIBER_PRINCIPAL),
                                                       ram_shares=subscription.get(RAM_SHARES))
 
-            return self._subscription_tracker.delete_subscription(subscription_id=subscription_id, reason=reason)
+            return self._subscription_tracker.delete_subscription(subscription_id=subscription_id, reason=reason,
+                                                                  subscription=subscription)
@@ -85,7 +85,10 @@ class DataMeshProducer:
         self._subscription_tracker = SubscriberTracker(credentials=self._data_mesh_credentials,
                                                        data_mesh_account_id=data_mesh_account_id,
                                                        region_name=self._current_region,
-                                                       log_level=log_level)
+                                                       log_level=log_level,
+                                                       cache_size=SUBSCRIPTION_CACHE_SIZE,
+                                                       cache_ttl_seconds=SUBSCRIPTION_CACHE_TTL_SECONDS,
+                                                       lazy_init=True)
 
         if self._log_level == 'DEBUG':
             utils.log_instance_signature(self, self._logger)
@@ -95,7 +98,11 @@ class DataMeshProducer:
                            producer_account_id: str,
                            data_mesh_account_id: str, create_public_metadata: bool = True,
                            expose_table_references_with_suffix: str = "_link",
-                           use_original_table_name: bool = False) -> tuple:
+                           use_original_table_name: bool = False,
+                           incremental_partition_sync: bool = False,
+                           delete_missing_partitions: bool = False,
+                           partition_projection=None,
+                           time_ordered_partitions: bool = False) -> tuple:
         '''
         API to create a table as a data product in the data mesh
         :param table_def:
@@ -106,6 +113,12 @@ class DataMeshProducer:
         :param data_mesh_database_name:
         :param producer_account_id:
         :param data_mesh_account_id:
+        :param incremental_partition_sync: Only create new partitions and update moved ones
+        :param delete_missing_partitions: When synchronising incrementally, delete partitions no longer in the source
+        :param partition_projection: 'auto' to detect Athena partition projection settings for the table, or a dict of
+        partition projection table parameters. Projected tables have no partitions copied to the mesh
+        :param time_ordered_partitions: The first partition key of the table only ever increases, so an incremental
+        sync need only read partitions at or after the high-water mark recorded by the previous sync
         :return:
         '''
         # cleanup the TableInfo object to be usable as a TableInput
@@ -122,6 +135,22 @@ class DataMeshProducer:
 
         table_name = t.get('Name')
 
+        projection = None
+        if partition_projection == 'auto':
+            projection = self._producer_automator.detect_partition_projection(database_name=source_database_name,
+                                                                              table_def=table_def)
+            if projection is None:
+                self._logger.info(f"Copying Partitions of Glue Table {table_name}, as they can't be projected")
+        elif isinstance(partition_projection, dict):
+            projection = dict(partition_projection)
+            projection.setdefault('projection.enabled', 'true')
+
+        if projection is not None:
+            parameters = dict(t.get('Parameters') or {})
+            parameters.update(projection)
+            t['Parameters'] = parameters
+            self._logger.debug(projection)
+
         # create the glue catalog entry
         try:
             data_mesh_glue_client.create_table(
@@ -132,18 +161,40 @@ class DataMeshProducer:
         except data_mesh_glue_client.exceptions.from_code('AlreadyExistsException'):
             self._logger.info(f"Glue Table {table_name} Already Exists")
 
-        table_partitions = self._producer_automator.get_table_partitions(
-            database_name=source_database_name,
-            table_name=table_name
-        )
-
-        if table_partitions is not None and len(table_partitions) > 0:
-            self._mesh_automator.create_table_partition_metadata(
+            # projection settings are table parameters, so are written to an existing table
+            if projection is not None:
+                data_mesh_glue_client.update_table(
+                    DatabaseName=data_mesh_database_name,
+                    TableInput=t
+                )
+                self._logger.info(f"Updated Partition Projection of Glue Table {table_name}")
+
+        if projection is not None:
+            # athena projects partitions from the table parameters, so none need to be copied
+            pass
+        elif incremental_partition_sync is True:
+            self._sync_mesh_table_partitions(table_def=table_def, source_database_name=source_database_name,
+                                             data_mesh_database_name=data_mesh_database_name,
+                                             delete_missing_partitions=delete_missing_partitions,
+                                             time_ordered=time_ordered_partitions)
+        elif len(table_def.get('PartitionKeys') or []) > 0:
+            # partitions are written in batches as they are read, rather than loaded into memory first
+            partitions = self._mesh_automator.create_table_partition_metadata(
                 database_name=data_mesh_database_name,
                 table_name=table_name,
-                partition_input_list=table_partitions
+                partition_input_list=self._producer_automator.iter_table_partitions(
+                    database_name=source_database_name,
+                    table_name=table_name,
+                    total_segments=PARTITION_LIST_SEGMENTS,
+                    table_columns=table_def.get('StorageDescriptor', {}).get('Columns')
+                )
             )
 
+            if len(partitions.get('Failed')) > 0:
+                self._logger.error(partitions.get('Failed'))
+                raise Exception(
+                    f"Unable to create {len(partitions.get('Failed'))} Partitions of Table {table_name}")
+
         # grant full access to the producer account
         perms = ['INSERT', 'SELECT', 'ALTER', 'DELETE', 'DESCRIBE', 'DROP']
         permissions_granted = self._mesh_automator.lf_grant_permissions(
@@ -191,6 +242,110 @@ class DataMeshProducer:
 
         return table_name, link_table_name
 
+    def reset_partition_high_water_mark(self, source_database_name: str, table_name: str,
+                                        expose_data_mesh_db_name: str = None) -> None:
+        '''
+        Forgets the partition high-water mark of a mesh table, so that its next time ordered incremental sync reads
+        every partition of the source table, such as after backfilling partitions below the high-water mark
+        :param source_database_name:
+        :param table_name:
+        :param expose_data_mesh_db_name: The mesh database name the table was published with, if not the default
+        :return:
+        '''
+        data_mesh_database_name = self._make_database_name(source_database_name)
+        if expose_data_mesh_db_name is not None:
+            data_mesh_database_name = expose_data_mesh_db_name
+
+        def _reset(parameters):
+            parameters.pop(PARTITION_HIGH_WATER_MARK_PARAMETER, None)
+            return parameters
+
+        self._mesh_automator.update_table_parameters(database_name=data_mesh_database_name, table_name=table_name,
+                                                     update=_reset)
+
+    def _sync_mesh_table_partitions(self, table_def: dict, source_database_name: str, data_mesh_database_name: str,
+                                    delete_missing_partitions: bool = False, time_ordered: bool = False) -> dict:
+        '''
+        Incrementally synchronises the partitions of a mesh table with its source table, only creating new partitions
+        and updating moved ones. When the first partition key is declared time ordered, the highest value of it seen by
+        each sync is stored as a parameter of the mesh table, and the next sync from any host only reads partitions from
+        that value onwards, so that scheduled syncs of date partitioned tables only touch recent partitions. Otherwise
+        every partition is read
+        :param table_def:
+        :param source_database_name:
+        :param data_mesh_database_name:
+        :param delete_missing_partitions: Delete mesh partitions missing from the source. With a high-water mark, only
+        partitions from the high-water mark onwards are compared
+        :param time_ordered: Partitions are never added below the highest value of the first partition key
+        :return:
+        '''
+        table_name = table_def.get('Name')
+        partition_keys = table_def.get('PartitionKeys') or []
+        if len(partition_keys) == 0:
+            return None
+
+        first_key = partition_keys[0]
+        numeric = first_key.get('Type', 'string').lower() in NUMERIC_PARTITION_KEY_TYPES
+
+        def _literal(value):
+            return str(value) if numeric else "'%s'" % str(value).replace("'", "''")
+
+        def _comparable(value):
+            return float(value) if numeric else str(value)
+
+        # a high-water mark would skip partitions added below it for good, so is only used for time ordered keys
+        high_water_mark = None
+        if time_ordered is True:
+            high_water_mark = (self._mesh_automator.describe_table(database_name=data_mesh_database_name,
+                                                                   table_name=table_name).get('Parameters') or {}
+                               ).get(PARTITION_HIGH_WATER_MARK_PARAMETER)
+        expression = None
+        if high_water_mark is not None:
+            expression = f"{first_key.get('Name')} >= {_literal(high_water_mark)}"
+
+        # the highest value of the first partition key is tracked as partitions stream past to the batch writer
+        mark = {'Value': high_water_mark}
+
+        def _track(source_partitions):
+            for p in source_partitions:
+                value = p.get('Values')[0]
+                if mark.get('Value') is None or _comparable(value) > _comparable(mark.get('Value')):
+                    mark['Value'] = value
+                yield p
+
+        partitions = self._mesh_automator.sync_table_partitions(
+            database_name=data_mesh_database_name,
+            table_name=table_name,
+            source_partitions=_track(self._producer_automator.iter_table_partitions(
+                database_name=source_database_name,
+                table_name=table_name,
+                expression=expression,
+                total_segments=PARTITION_LIST_SEGMENTS,
+                table_columns=table_def.get('StorageDescriptor', {}).get('Columns')
+            )),
+            expression=expression,
+            delete_missing=delete_missing_partitions
+        )
+
+        if len(partitions.get('Failed')) > 0:
+            self._logger.error(partitions.get('Failed'))
+            raise Exception(f"Unable to synchronise {len(partitions.get('Failed'))} Partitions of Table {table_name}")
+
+        # the high-water mark is only moved on once every partition up to it has been synchronised, and never moved
+        # back by a concurrent sync which saw fewer partitions
+        def _advance(parameters):
+            current = parameters.get(PARTITION_HIGH_WATER_MARK_PARAMETER)
+            if current is not None and _comparable(current) >= _comparable(mark.get('Value')):
+                return None
+            parameters[PARTITION_HIGH_WATER_MARK_PARAMETER] = str(mark.get('Value'))
+            return parameters
+
+        if time_ordered is True and mark.get('Value') is not None:
+            self._mesh_automator.update_table_parameters(database_name=data_mesh_database_name, table_name=table_name,
+                                                         update=_advance)
+
+        return partitions
+
     def _make_database_name(self, database_name: str):
         return "%s-%s" % (database_name, self._data_producer_identity.get('Account'))
 
@@ -232,7 +387,21 @@ class DataMeshProducer:
                              sync_mesh_crawler_role_arn: str = None,
                              expose_data_mesh_db_name: str = None,
                              expose_table_references_with_suffix: str = "_link",
-                             use_original_table_name: bool = False):
+                             use_original_table_name: bool = False,
+                             incremental_partition_sync: bool = False,
+                             delete_missing_partitions: bool = False,
+                             partition_projection=None,
+                             time_ordered_partitions: bool = False):
+        '''
+        Creates data products in the mesh from the tables of a source database
+        :param partition_projection: 'auto' to detect Athena partition projection settings for each table, or a dict of
+        table name to its partition projection table parameters. Projected tables are published without copying their
+        partitions, and stay current without a partition sync. Tables which can't be projected have their partitions
+        copied
+        :param time_ordered_partitions: The first partition key of every table only ever increases, such as a date, so
+        that incremental_partition_sync need only read partitions from the last value seen by the previous sync. Use
+        reset_partition_high_water_mark after backfilling older partitions
+        '''
         if self._log_level == 'DEBUG':
             self._logger.debug(locals())
 
@@ -339,7 +508,12 @@ class DataMeshProducer:
                 data_mesh_account_id=self._data_mesh_account_id,
                 create_public_metadata=create_public_metadata,
                 expose_table_references_with_suffix=expose_table_references_with_suffix,
-                use_original_table_name=use_original_table_name
+                use_original_table_name=use_original_table_name,
+                incremental_partition_sync=incremental_partition_sync,
+                delete_missing_partitions=delete_missing_partitions,
+                time_ordered_partitions=time_ordered_partitions,
+                partition_projection=partition_projection.get(table.get('Name')) if isinstance(
+                    partition_projection, dict) else partition_projection
             )
 
             # grant the mesh permissions to describe and select from the table
@@ -404,31 +578,51 @@ class DataMeshProducer:
         return shared_objects
 
     def get_data_product(self, database_name: str, table_name_regex: str):
-        # generate a new glue client for the data mesh account
-        data_mesh_glue_client = utils.generate_client('glue', region=self._current_region,
-                                                      credentials=self._data_mesh_credentials)
-        # grab the tables that match the regex
-        all_tables = self._load_glue_tables(
-            glue_client=data_mesh_glue_client,
+        # grab the names and locations of the tables that match the regex from the data mesh account
+        all_tables = self._mesh_automator.iter_glue_tables(
             catalog_id=self._data_mesh_account_id,
             source_db_name=self._make_database_name(database_name),
-            table_name_regex=table_name_regex
+            table_name_regex=table_name_regex,
+            fields=['DatabaseName', 'Name', 'StorageDescriptor.Location']
         )
         response = []
         for t in all_tables:
             response.append({"Database": t.get('DatabaseName'), "TableName": t.get('Name'),
-                             "Location": t.get('StorageDescriptor').get("Location")})
+                             "Location": t.get('StorageDescriptor', {}).get("Location")})
 
         return response
 
-    def list_pending_access_requests(self):
+    def list_pending_access_requests(self, limit: int = None):
         '''
         Lists all access requests that have been made by potential consumers. Pending requests can be approved or denied
         with close_access_request()
+        :param limit: Maximum number of requests to return. All pending requests are returned if not supplied
         :return:
         '''
         me = self._sts_client.get_caller_identity().get('Account')
-        return self._subscription_tracker.list_subscriptions(owner_id=me, request_status=STATUS_PENDING)
+        pending = self._subscription_tracker.iter_subscriptions(owner_id=me, request_status=STATUS_PENDING,
+                                                                limit=None if limit is None else int(limit))
+        return {'Subscriptions': list(pending)}
+
+    def list_access_requests_changed_since(self, since: int, limit: int = None) -> dict:
+        '''
+        Lists access requests of any status which have been created or updated since a watermark. Pass the Watermark
+        returned by one call as the since value of the next to only receive new changes
+        :param since: Watermark returned by the previous call, or UTC epoch milliseconds for the first call
+        :param limit: Maximum number of requests to return
+        :return:
+        '''
+        me = self._sts_client.get_caller_identity().get('Account')
+        return self._subscription_tracker.list_subscriptions_changed_since(
+            watermark=since, owner_id=me, limit=None if limit is None else int(limit))
+
+    def get_access_request_counts(self) -> dict:
+        '''
+        Returns the number of access requests made to this producer in each Status
+        :return: dict of Status to count
+        '''
+        me = self._sts_client.get_caller_identity().get('Account')
+        return self._subscription_tracker.get_subscription_counts(owner_id=me)
 
     def approve_access_request(self, request_id: str,
                                grant_permissions: list = None,
@@ -493,11 +687,11 @@ class DataMeshProducer:
             original_db = subscription.get(DATABASE_NAME).replace(f"-{self._data_producer_account_id}", "")
 
             # get the catalog definition of this table including if its a regex subscription
-            all_tables = self._producer_automator.load_glue_tables(
+            all_tables = self._producer_automator.iter_glue_tables(
                 catalog_id=self._data_producer_account_id,
                 source_db_name=original_db,
                 table_name_regex=t,
-                load_lf_tags=False
+                fields=['Name', 'StorageDescriptor.Location']
             )
 
             for resolved_table in all_tables:
@@ -548,7 +742,7 @@ class DataMeshProducer:
         self._subscription_tracker.update_status(
             subscription_id=request_id, status=STATUS_ACTIVE,
             permitted_grants=grant_perms, grantable_grants=grantable_perms, notes=decision_notes,
-            ram_shares=ram_shares, table_arns=table_arns
+            ram_shares=ram_shares, table_arns=table_arns, subscription=subscription
         )
 
     def _add_principal_to_glue_resource_policy(self, database_name: str, tables: list, add_principal: str):
@@ -568,9 +762,14 @@ class DataMeshProducer:
         :param decision_notes:
         :return:
         '''
+        # any copy of the subscription identifies its counters, so a cached one saves a consistent read
+        subscription = self._subscription_tracker.get_subscription(subscription_id=request_id, consistent_read=False)
+        if subscription is None:
+            raise Exception(f"Unable to resolve Subscription {request_id}")
+
         return self._subscription_tracker.update_status(
             subscription_id=request_id, status=STATUS_DENIED,
-            notes=decision_notes
+            notes=decision_notes, subscription=subscription
         )
 
     def update_subscription_permissions(self, subscription_id: str, grant_permissions: list, notes: str,
@@ -612,7 +811,7 @@ class DataMeshProducer:
                 table_list=subscription.get(TABLE_NAME),
                 permissions=perms_to_add,
                 grantable_permissions=grantable_perms_to_add
-            )
+            ).get('Succeeded')
 
         # modify the current permissions to reflect the state of the addition
         current_permissions.extend(perms_to_add)
@@ -632,7 +831,7 @@ class DataMeshProducer:
                 table_list=subscription.get(TABLE_NAME),
                 permissions=perms_to_remove,
                 grantable_permissions=grantable_perms_to_remove
-            )
+            ).get('Succeeded')
 
         self._subscription_tracker.update_grants(
             subscription_id=subscription_id,
@@ -646,6 +845,17 @@ class DataMeshProducer:
     def get_subscription(self, request_id: str) -> dict:
         return self._subscription_tracker.get_subscription(subscription_id=request_id)
 
+    def get_subscription_history(self, request_id: str, start_token: dict = None, page_size: int = None) -> dict:
+        '''
+        Returns the history of a subscription, including every status change and the notes recorded with it
+        :param request_id:
+        :param start_token: LastEvaluatedKey returned by a previous call, from which to continue
+        :param page_size:
+        :return:
+        '''
+        return self._subscription_tracker.get_subscription_history(subscription_id=request_id,
+                                                                   start_token=start_token, page_size=page_size)
+
     def delete_subscription(self, subscription_id: str, reason: str):
         '''
         Soft delete a subscription
@@ -687,4 +897,5 @@ class DataMeshProducer:
                 Entries=entries
             )
 
-            return self._subscription_tracker.delete_subscription(subscription_id=subscription_id, reason=reason)
+            return self._subscription_tracker.delete_subscription(subscription_id=subscription_id, reason=reason,
+                                                                  subscription=subscription)
@@ -1,6 +1,10 @@
 import sys
+import datetime
 import logging
+import queue
+import threading
 import time
+import itertools
 import boto3
 import botocore.exceptions
 import shortuuid
@@ -8,6 +12,8 @@ import json
 
 from data_mesh_util.lib.constants import *
 import data_mesh_util.lib.utils as utils
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from data_mesh_util.lib.RateLimiter import RateLimiter
 
 
 class ApiAutomator:
@@ -18,12 +24,39 @@ class ApiAutomator:
     # make sure we always log to standard out
     _logger.addHandler(logging.StreamHandler(sys.stdout))
     _clients = None
-
-    def __init__(self, target_account: str, session: boto3.session.Session, log_level: str = "INFO"):
+    _lf_tag_cache = None
+    _lf_tag_cache_ttl_seconds = None
+    _lf_tag_cache_hits = 0
+    _lf_tag_cache_misses = 0
+    _lf_tag_lookups = None
+    _lf_tag_cache_lock = None
+    _rate_limiters = None
+    _lock = None
+
+    def __init__(self, target_account: str, session: boto3.session.Session, log_level: str = "INFO",
+                 lf_tag_cache_ttl_seconds: int = None, requests_per_second: dict = None):
+        '''
+        :param target_account:
+        :param session:
+        :param log_level:
+        :param lf_tag_cache_ttl_seconds: How long Lake Formation tag definitions are cached across calls to
+        load_glue_tables. If not supplied, tag definitions are only cached for the duration of each call
+        :param requests_per_second: dict of service name to the sustained request rate allowed when making requests
+        concurrently, overriding SERVICE_REQUESTS_PER_SECOND
+        '''
         self._target_account = target_account
         self._session = session
         self._logger.setLevel(log_level)
         self._clients = {}
+        self._lf_tag_cache = {}
+        self._lf_tag_cache_ttl_seconds = lf_tag_cache_ttl_seconds
+        self._lf_tag_lookups = {}
+        self._lf_tag_cache_lock = threading.Lock()
+        self._lock = threading.RLock()
+
+        rates = dict(SERVICE_REQUESTS_PER_SECOND)
+        rates.update(requests_per_second or {})
+        self._rate_limiters = {k: RateLimiter(rate_per_second=v) for k, v in rates.items()}
 
         if log_level == 'DEBUG':
             utils.log_instance_signature(self, self._logger)
@@ -32,11 +65,24 @@ class ApiAutomator:
         client = self._clients.get(client_name)
 
         if client is None:
-            client = self._session.client(client_name)
-            self._clients[client_name] = client
+            with self._lock:
+                client = self._clients.get(client_name)
+                if client is None:
+                    client = self._session.client(client_name)
+                    self._clients[client_name] = client
 
         return client
 
+    def _rate_limit(self, service: str) -> None:
+        '''
+        Waits until a request may be made to a service without exceeding its configured request rate
+        :param service:
+        :return:
+        '''
+        limiter = self._rate_limiters.get(service)
+        if limiter is not None:
+            limiter.acquire()
+
     def _get_bucket_name(self, bucket_value):
         if 's3://' in bucket_value:
             return bucket_value.split('/')[2]
@@ -99,6 +145,99 @@ class ApiAutomator:
                 TagValuesToAdd=missing_tag_values
             )
 
+            # the cached valid values of this tag are now out of date, as is any lookup of it in flight
+            with self._lf_tag_cache_lock:
+                for cache_key in [k for k in self._lf_tag_cache.keys() if k[1] == tag_key]:
+                    self._lf_tag_cache.pop(cache_key)
+                for cache_key in [k for k in self._lf_tag_lookups.keys() if k[1] == tag_key]:
+                    self._lf_tag_lookups.pop(cache_key)
+
+    def _get_lf_tag_definition(self, catalog_id: str, tag_key: str) -> dict:
+        '''
+        Returns the definition of a Lake Formation tag, including its valid values. Only a handful of distinct tags are
+        used across a mesh, so definitions are cached by catalog and tag key rather than fetched for every table
+        :param catalog_id: Catalog in which the tag is defined, or None for the caller's catalog
+        :param tag_key:
+        :return:
+        '''
+        cache_key = (catalog_id, tag_key)
+
+        # the cache lock is only held to read and update the cache. Concurrent misses for the same tag wait on the
+        # first lookup's Future rather than making their own request, while lookups of other tags go ahead
+        with self._lf_tag_cache_lock:
+            cached = self._lf_tag_cache.get(cache_key)
+
+            if cached is not None and (self._lf_tag_cache_ttl_seconds is None or
+                                       time.monotonic() - cached[0] < self._lf_tag_cache_ttl_seconds):
+                self._lf_tag_cache_hits += 1
+                return cached[1]
+
+            lookup = self._lf_tag_lookups.get(cache_key)
+            fetch = lookup is None
+            if fetch:
+                self._lf_tag_cache_misses += 1
+                lookup = Future()
+                self._lf_tag_lookups[cache_key] = lookup
+            else:
+                self._lf_tag_cache_hits += 1
+
+        if not fetch:
+            return lookup.result()
+
+        try:
+            args = {'TagKey': tag_key}
+            if catalog_id is not None:
+                args['CatalogId'] = catalog_id
+            self._rate_limit('lakeformation')
+            lf_tag = self._get_client('lakeformation').get_lf_tag(**args)
+        except Exception as e:
+            with self._lf_tag_cache_lock:
+                if self._lf_tag_lookups.get(cache_key) is lookup:
+                    self._lf_tag_lookups.pop(cache_key)
+            lookup.set_exception(e)
+            raise e
+
+        with self._lf_tag_cache_lock:
+            # a lookup which was invalidated while in flight may have read the old definition, so isn't cached
+            if self._lf_tag_lookups.get(cache_key) is lookup:
+                self._lf_tag_lookups.pop(cache_key)
+                self._lf_tag_cache[cache_key] = (time.monotonic(), lf_tag)
+        lookup.set_result(lf_tag)
+
+        return lf_tag
+
+    def _load_table_lf_tags(self, catalog_id: str, table: dict) -> None:
+        '''
+        Adds the Lake Formation tags on a table, with the valid values of each tag, to the table's Tags
+        :param catalog_id:
+        :param table: Table as returned by glue get_tables
+        :return:
+        '''
+        self._rate_limit('lakeformation')
+        tags = self._get_client('lakeformation').get_resource_lf_tags(
+            CatalogId=catalog_id,
+            Resource={
+                'Table': {
+                    'CatalogId': catalog_id,
+                    'DatabaseName': table.get('DatabaseName'),
+                    'Name': table.get('Name')
+                }
+            },
+            ShowAssignedLFTags=True
+        )
+        key = 'LFTagsOnTable'
+        use_tags = {}
+        if tags.get(key) is not None and len(tags.get(key)) > 0:
+            for table_tag in tags.get(key):
+                # get all the valid values for the tag in LF
+                lf_tag = self._get_lf_tag_definition(catalog_id=table_tag.get('CatalogId'),
+                                                     tag_key=table_tag.get('TagKey'))
+                use_tags[table_tag.get('TagKey')] = {
+                    'TagValues': table_tag.get('TagValues'),
+                    'ValidValues': lf_tag.get('TagValues')
+                }
+            table['Tags'] = use_tags
+
     def attach_tag(self, database: str, table: str, tag: tuple):
         # create the tag or make sure it already exists
         tag_key = tag[0]
@@ -372,26 +511,210 @@ class ApiAutomator:
                 else:
                     raise iie
 
-    def get_table_partitions(self, database_name: str, table_name: str) -> list:
-        # load the partitions for the table if there are any
+    def _iter_partition_pages(self, partition_args: dict, stop: threading.Event = None):
+        '''
+        Generator of the pages of partitions returned by get_partitions
+        :param partition_args:
+        :param stop: Event which ends reading early when set
+        :return:
+        '''
         glue_client = self._get_client('glue')
-        all_partitions = []
-        partition_args = {
-            "DatabaseName": database_name,
-            "TableName": table_name,
-            "ExcludeColumnSchema": False
-        }
+        partition_args = dict(partition_args)
+
         has_more_partitions = True
-        while has_more_partitions is True:
+        while has_more_partitions is True and (stop is None or not stop.is_set()):
+            self._rate_limit('glue')
             partitions = glue_client.get_partitions(**partition_args)
-            all_partitions.extend(partitions.get('Partitions'))
+            yield partitions.get('Partitions')
 
             if 'NextToken' in partitions:
                 partition_args['NextToken'] = partitions.get('NextToken')
             else:
                 has_more_partitions = False
 
-        return all_partitions
+    def iter_table_partitions(self, database_name: str, table_name: str, expression: str = None,
+                              total_segments: int = 1, exclude_column_schema: bool = False,
+                              table_columns: list = None):
+        '''
+        Generator of the partitions of a table. With more than one segment, the segments of the table are read
+        concurrently and partitions are yielded as pages arrive, holding at most one page per segment in memory
+        :param database_name:
+        :param table_name:
+        :param expression: Glue partition filter expression limiting the partitions returned
+        :param total_segments: Number of segments read concurrently, between 1 and MAX_PARTITION_SEGMENTS
+        :param exclude_column_schema: Have Glue omit the columns of every partition
+        :param table_columns: Columns of the table. Partitions whose columns are the same as the table's are returned
+        without them, while partitions with a different schema keep theirs
+        :return:
+        '''
+        total_segments = 1 if total_segments is None else int(total_segments)
+        if total_segments < 1 or total_segments > MAX_PARTITION_SEGMENTS:
+            raise Exception(f"Total Segments must be between 1 and {MAX_PARTITION_SEGMENTS}")
+
+        partition_args = {
+            "DatabaseName": database_name,
+            "TableName": table_name,
+            "ExcludeColumnSchema": exclude_column_schema
+        }
+        if expression is not None:
+            partition_args['Expression'] = expression
+
+        def _strip(page):
+            if table_columns is not None:
+                for p in page:
+                    if p.get('StorageDescriptor', {}).get('Columns') == table_columns:
+                        p['StorageDescriptor'] = utils.remove_dict_keys(p.get('StorageDescriptor'), ['Columns'])
+            return page
+
+        if total_segments == 1:
+            for page in self._iter_partition_pages(partition_args):
+                yield from _strip(page)
+            return
+
+        # each segment is read on its own thread, handing pages to this generator through a queue which holds one page
+        # per segment. Segments which finish or fail put a marker of their segment number or error
+        pages = queue.Queue(maxsize=total_segments)
+        stop = threading.Event()
+
+        def _put(value):
+            while not stop.is_set():
+                try:
+                    pages.put(value, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def _read(segment):
+            try:
+                args = dict(partition_args)
+                args['Segment'] = {'SegmentNumber': segment, 'TotalSegments': total_segments}
+                for page in self._iter_partition_pages(args, stop=stop):
+                    _put(page)
+                _put(segment)
+            except Exception as e:
+                _put(e)
+
+        executor = ThreadPoolExecutor(max_workers=total_segments)
+        try:
+            for segment in range(total_segments):
+                executor.submit(_read, segment)
+
+            finished = 0
+            while finished < total_segments:
+                value = pages.get()
+                if isinstance(value, Exception):
+                    raise value
+                elif isinstance(value, int):
+                    finished += 1
+                else:
+                    yield from _strip(value)
+        finally:
+            # stop readers when the caller stops early or a segment fails
+            stop.set()
+            executor.shutdown(wait=True)
+
+    def get_table_partitions(self, database_name: str, table_name: str, expression: str = None,
+                             total_segments: int = 1) -> list:
+        '''
+        Loads the partitions of a table
+        :param database_name:
+        :param table_name:
+        :param expression: Glue partition filter expression limiting the partitions returned
+        :param total_segments: Number of segments of the table read concurrently
+        :return:
+        '''
+        return list(self.iter_table_partitions(database_name=database_name, table_name=table_name,
+                                               expression=expression, total_segments=total_segments))
+
+    def _projection_date_formats(self, value: str, date_formats: list) -> list:
+        '''
+        Returns the entries of date_formats, from PARTITION_PROJECTION_DATE_FORMATS, which a value is written in
+        :param value:
+        :param date_formats:
+        :return:
+        '''
+        def _is_format(strptime_format):
+            try:
+                return datetime.datetime.strptime(value, strptime_format).strftime(strptime_format) == value
+            except ValueError:
+                return False
+
+        return [f for f in date_formats if _is_format(f[1])]
+
+    def detect_partition_projection(self, database_name: str, table_def: dict) -> dict:
+        '''
+        Works out Athena partition projection table parameters for a table from its partitions. Detection succeeds for
+        tables partitioned by dates, optionally followed by an hour, whose partitions are all stored at a location built
+        from their values under the table location. Every partition is checked in a single concurrent read, which stops
+        at the first partition that can't be projected
+        :param database_name:
+        :param table_def: Table as returned by glue get_tables
+        :return: dict of table parameters, or None if the table's partitions can't be projected
+        '''
+        partition_keys = [k.get('Name') for k in table_def.get('PartitionKeys') or []]
+        table_location = table_def.get('StorageDescriptor', {}).get('Location')
+        if len(partition_keys) == 0 or table_location is None:
+            return None
+
+        # partitions must be stored in either hive style key=value, or plain value, folders under the table
+        base = table_location.rstrip('/')
+
+        def _path(values, hive_style: bool) -> str:
+            return '/'.join([f"{k}={v}" if hive_style else v for k, v in zip(partition_keys, values)])
+
+        # what each key could still be projected as, narrowed by every partition read. Dates in these formats sort in
+        # date order, so the earliest date is the smallest value seen
+        date_formats = [list(PARTITION_PROJECTION_DATE_FORMATS) for _ in partition_keys]
+        hour_keys = [k.lower() in PARTITION_PROJECTION_HOUR_KEYS for k in partition_keys]
+        two_digit_hours = [False for _ in partition_keys]
+        earliest = [None for _ in partition_keys]
+        hive_styles = [True, False]
+
+        partition_count = 0
+        for partition in self.iter_table_partitions(database_name=database_name, table_name=table_def.get('Name'),
+                                                    total_segments=PARTITION_LIST_SEGMENTS,
+                                                    exclude_column_schema=True):
+            partition_count += 1
+            values = partition.get('Values')
+
+            for i, (key, value) in enumerate(zip(partition_keys, values)):
+                date_formats[i] = self._projection_date_formats(value, date_formats[i])
+                hour_keys[i] = hour_keys[i] and value.isdigit() and 0 <= int(value) <= 23
+                two_digit_hours[i] = two_digit_hours[i] or (len(value) == 2 and value.startswith('0'))
+                earliest[i] = value if earliest[i] is None else min(earliest[i], value)
+
+                if len(date_formats[i]) == 0 and hour_keys[i] is False:
+                    self._logger.info(f"Unable to project Partition Key {key} of Table {table_def.get('Name')}")
+                    return None
+
+            location = partition.get('StorageDescriptor', {}).get('Location', '').rstrip('/')
+            hive_styles = [h for h in hive_styles if location == f"{base}/{_path(values, h)}"]
+            if len(hive_styles) == 0:
+                self._logger.info(f"Partition locations of Table {table_def.get('Name')} don't follow a template")
+                return None
+
+        if partition_count == 0:
+            return None
+
+        parameters = {'projection.enabled': 'true'}
+        for i, key in enumerate(partition_keys):
+            if len(date_formats[i]) > 0:
+                date_format = date_formats[i][0]
+                parameters[f"projection.{key}.type"] = 'date'
+                parameters[f"projection.{key}.format"] = date_format[0]
+                parameters[f"projection.{key}.range"] = f"{earliest[i]},NOW"
+                parameters[f"projection.{key}.interval"] = '1'
+                parameters[f"projection.{key}.interval.unit"] = date_format[2]
+            else:
+                parameters[f"projection.{key}.type"] = 'integer'
+                parameters[f"projection.{key}.range"] = '0,23'
+                if two_digit_hours[i]:
+                    parameters[f"projection.{key}.digits"] = '2'
+
+        template_values = ['${%s}' % k for k in partition_keys]
+        parameters['storage.location.template'] = f"{base}/{_path(template_values, hive_styles[0])}"
+
+        return parameters
 
     def enable_crawler_role(self, crawler_role_arn: str, grant_to_role_name: str):
         if crawler_role_arn is None or grant_to_role_name is None:
@@ -426,32 +749,290 @@ class ApiAutomator:
 
         self._logger.info(f"Enabled {grant_to_role_name} to pass role {crawler_role_name} to Glue Crawlers")
 
-    def create_table_partition_metadata(self, database_name: str, table_name: str, partition_input_list: list):
+    def _batch_partition_request(self, api: str, args: dict, entries_arg: str, entries: list, values_of,
+                                 errors_values_key: str, skip_error_code: str, max_attempts: int) -> dict:
+        '''
+        Makes one Glue batch partition request, retrying only the entries which failed with a retryable error
+        :param api: Name of the Glue batch API, such as batch_create_partition
+        :param args: Arguments to the API other than the entries
+        :param entries_arg: Name of the argument holding the entries
+        :param entries:
+        :param values_of: Function returning the partition values of an entry
+        :param errors_values_key: Key of the partition values in each of the Errors returned by the API
+        :param skip_error_code: Error code meaning that the entry needs no change, such as AlreadyExistsException
+        :param max_attempts:
+        :return: dict of the number of entries which Succeeded or were Skipped, and the list of Failed partitions with
+        their error
+        '''
         glue_client = self._get_client('glue')
+        succeeded = 0
+        skipped = 0
+        failed = []
+
+        pending = entries
+        attempt = 0
+        while len(pending) > 0:
+            attempt += 1
+            retry = []
+            self._rate_limit('glue')
+            try:
+                response = getattr(glue_client, api)(**args, **{entries_arg: pending})
+                errors = response.get('Errors', [])
+            except botocore.exceptions.ClientError as e:
+                # the whole request failed, so every entry shares the error
+                error = e.response.get('Error', {})
+                errors = [{errors_values_key: values_of(p),
+                           'ErrorDetail': {'ErrorCode': error.get('Code'), 'ErrorMessage': error.get('Message')}}
+                          for p in pending]
+
+            by_values = {tuple(values_of(p)): p for p in pending}
+            for e in errors:
+                code = e.get('ErrorDetail', {}).get('ErrorCode')
+                entry = by_values.pop(tuple(e.get(errors_values_key)), None)
+
+                if code == skip_error_code:
+                    skipped += 1
+                elif code in GLUE_RETRYABLE_ERROR_CODES and attempt < max_attempts and entry is not None:
+                    retry.append(entry)
+                else:
+                    failed.append({'Values': e.get(errors_values_key), 'ErrorCode': code,
+                                   'ErrorMessage': e.get('ErrorDetail', {}).get('ErrorMessage')})
 
-        partitions_created = 0
-        for p in partition_input_list:
-            keys = [
-                'DatabaseName', 'TableName', 'CreationTime', 'LastAnalyzedTime', 'CatalogId'
-            ]
-            p = utils.remove_dict_keys(input_dict=p, remove_keys=keys)
+            # entries without an error were applied
+            succeeded += len(by_values)
 
-            try:
-                glue_client.create_partition(
-                    DatabaseName=database_name,
-                    TableName=table_name,
-                    PartitionInput=p
-                )
-                partitions_created += 1
-            except glue_client.exceptions.AlreadyExistsException:
-                pass
+            if len(retry) > 0:
+                time.sleep(PARTITION_RETRY_BASE_SECONDS * (2 ** (attempt - 1)))
+            pending = retry
 
-        self._logger.info(f"Create {partitions_created} new Table Partitions")
+        return {'Succeeded': succeeded, 'Skipped': skipped, 'Failed': failed}
 
-    def load_glue_tables(self, catalog_id: str, source_db_name: str,
-                         table_name_regex: str, load_lf_tags: bool = True):
+    def _run_partition_batches(self, request, entries, batch_size: int, max_workers: int = None) -> dict:
+        '''
+        Splits entries into batches, and runs a batch request for each of them concurrently. Entries may be a generator,
+        such as iter_table_partitions, and are read one batch at a time, so that no more than max_workers batches are
+        held in memory
+        :param request: Function making the request for a batch, returning the result of _batch_partition_request
+        :param entries: Iterable of entries
+        :param batch_size:
+        :param max_workers: Defaults to PARTITION_REPLICATION_WORKERS
+        :return: The combined results of every batch
+        '''
+        max_workers = PARTITION_REPLICATION_WORKERS if max_workers is None else int(max_workers)
+        entries = iter(entries)
+        batches = iter(lambda: list(itertools.islice(entries, batch_size)), [])
+        summary = {'Succeeded': 0, 'Skipped': 0, 'Failed': []}
+
+        def _add(result: dict):
+            summary['Succeeded'] += result.get('Succeeded')
+            summary['Skipped'] += result.get('Skipped')
+            summary['Failed'].extend(result.get('Failed'))
+
+        if max_workers <= 1:
+            for b in batches:
+                _add(request(b))
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                running = set()
+                for b in batches:
+                    # wait for a batch to finish before reading the next one
+                    if len(running) >= max_workers:
+                        done, running = wait(running, return_when=FIRST_COMPLETED)
+                        for f in done:
+                            _add(f.result())
+                    running.add(executor.submit(request, b))
+
+                for f in wait(running).done:
+                    _add(f.result())
+
+        return summary
+
+    def _partition_input(self, partition: dict) -> dict:
+        # remove properties from a Partition returned from get_partitions to be compatible with a PartitionInput
+        keys = [
+            'DatabaseName', 'TableName', 'CreationTime', 'LastAnalyzedTime', 'CatalogId'
+        ]
+        return utils.remove_dict_keys(input_dict=partition, remove_keys=keys)
+
+    def create_table_partition_metadata(self, database_name: str, table_name: str, partition_input_list,
+                                        max_workers: int = None, max_attempts: int = None) -> dict:
+        '''
+        Creates partitions on a table in batches of PARTITION_BATCH_SIZE, with batches written concurrently within the
+        Glue request rate. Partitions which already exist are skipped, and partitions which fail with a retryable error
+        are retried with exponential backoff
+        :param database_name:
+        :param table_name:
+        :param partition_input_list: Partitions, as returned by get_partitions, or a generator of them such as
+        iter_table_partitions
+        :param max_workers: Number of batches written concurrently. Defaults to PARTITION_REPLICATION_WORKERS
+        :param max_attempts: Number of times a partition is attempted. Defaults to PARTITION_MAX_ATTEMPTS
+        :return: dict of the number of partitions Created and Skipped, and the list of Failed partitions with their
+        error
+        '''
+        max_attempts = PARTITION_MAX_ATTEMPTS if max_attempts is None else int(max_attempts)
+
+        def _create(batch):
+            return self._batch_partition_request(
+                api='batch_create_partition', args={'DatabaseName': database_name, 'TableName': table_name},
+                entries_arg='PartitionInputList', entries=batch, values_of=lambda p: p.get('Values'),
+                errors_values_key='PartitionValues', skip_error_code='AlreadyExistsException',
+                max_attempts=max_attempts
+            )
+
+        result = self._run_partition_batches(request=_create,
+                                             entries=(self._partition_input(p) for p in partition_input_list),
+                                             batch_size=PARTITION_BATCH_SIZE, max_workers=max_workers)
+        summary = {'Created': result.get('Succeeded'), 'Skipped': result.get('Skipped'),
+                   'Failed': result.get('Failed')}
+
+        self._logger.info(f"Create {summary.get('Created')} new Table Partitions ({summary.get('Skipped')} already "
+                          f"existed, {len(summary.get('Failed'))} failed)")
+
+        return summary
+
+    def sync_table_partitions(self, database_name: str, table_name: str, source_partitions,
+                              expression: str = None, compare_last_access_time: bool = False,
+                              delete_missing: bool = False, max_workers: int = None,
+                              max_attempts: int = None) -> dict:
+        '''
+        Brings the partitions of a table in line with source partitions, matched by partition values. Only new
+        partitions are created, and partitions whose location has changed are updated. Source partitions are read and
+        written a window of batches at a time, so only their values are held in memory
+        :param database_name:
+        :param table_name:
+        :param source_partitions: Partitions, as returned by get_partitions on the source table, or a generator of them
+        such as iter_table_partitions
+        :param expression: Glue partition filter expression with which the source partitions were read. Only partitions
+        of this table matching the same expression are compared
+        :param compare_last_access_time: Whether to also update partitions whose LastAccessTime has changed
+        :param delete_missing: Whether to delete partitions which no longer exist in the source
+        :param max_workers:
+        :param max_attempts:
+        :return: dict of the number of partitions Created, Updated, Deleted and Skipped, and the list of Failed
+        partitions with their error
+        '''
+        max_attempts = PARTITION_MAX_ATTEMPTS if max_attempts is None else int(max_attempts)
+        args = {'DatabaseName': database_name, 'TableName': table_name}
+
+        current = {tuple(p.get('Values')): p for p in
+                   self.iter_table_partitions(database_name=database_name, table_name=table_name,
+                                              expression=expression, total_segments=PARTITION_LIST_SEGMENTS)}
+
+        def _changed(source_partition: dict, current_partition: dict) -> bool:
+            if source_partition.get('StorageDescriptor', {}).get('Location') != \
+                    current_partition.get('StorageDescriptor', {}).get('Location'):
+                return True
+            elif compare_last_access_time is True and \
+                    source_partition.get('LastAccessTime') != current_partition.get('LastAccessTime'):
+                return True
+            else:
+                return False
+
+        summary = {'Created': 0, 'Updated': 0, 'Deleted': 0, 'Skipped': 0, 'Failed': []}
+        source_values = set()
+        # source partitions are compared a window of batches at a time, enough to keep every writer busy
+        workers = PARTITION_REPLICATION_WORKERS if max_workers is None else max(int(max_workers), 1)
+        window = PARTITION_BATCH_SIZE * workers
+        source_partitions = iter(source_partitions)
+
+        for chunk in iter(lambda: list(itertools.islice(source_partitions, window)), []):
+            to_create = []
+            to_update = []
+            for p in chunk:
+                v = tuple(p.get('Values'))
+                source_values.add(v)
+                if v not in current:
+                    to_create.append(p)
+                elif _changed(p, current.get(v)):
+                    to_update.append({'PartitionValueList': list(v), 'PartitionInput': self._partition_input(p)})
+                else:
+                    summary['Skipped'] += 1
+
+            if len(to_create) > 0:
+                created = self.create_table_partition_metadata(database_name=database_name, table_name=table_name,
+                                                               partition_input_list=to_create,
+                                                               max_workers=max_workers, max_attempts=max_attempts)
+                summary['Created'] += created.get('Created')
+                summary['Skipped'] += created.get('Skipped')
+                summary['Failed'].extend(created.get('Failed'))
+
+            if len(to_update) > 0:
+                updated = self._run_partition_batches(
+                    request=lambda batch: self._batch_partition_request(
+                        api='batch_update_partition', args=args, entries_arg='Entries', entries=batch,
+                        values_of=lambda e: e.get('PartitionValueList'), errors_values_key='PartitionValueList',
+                        skip_error_code=None, max_attempts=max_attempts),
+                    entries=to_update, batch_size=PARTITION_BATCH_SIZE, max_workers=max_workers)
+                summary['Updated'] += updated.get('Succeeded')
+                summary['Failed'].extend(updated.get('Failed'))
+
+        to_delete = [{'Values': list(v)} for v in current.keys() if v not in source_values] \
+            if delete_missing is True else []
+
+        if len(to_delete) > 0:
+            deleted = self._run_partition_batches(
+                request=lambda batch: self._batch_partition_request(
+                    api='batch_delete_partition', args=args, entries_arg='PartitionsToDelete', entries=batch,
+                    values_of=lambda e: e.get('Values'), errors_values_key='PartitionValues',
+                    skip_error_code='EntityNotFoundException', max_attempts=max_attempts),
+                entries=to_delete, batch_size=PARTITION_DELETE_BATCH_SIZE, max_workers=max_workers)
+            summary['Deleted'] = deleted.get('Succeeded')
+            summary['Skipped'] += deleted.get('Skipped')
+            summary['Failed'].extend(deleted.get('Failed'))
+
+        self._logger.info(f"Synchronised Partitions of {table_name}: {summary.get('Created')} created, "
+                          f"{summary.get('Updated')} updated, {summary.get('Deleted')} deleted, "
+                          f"{len(summary.get('Failed'))} failed")
+
+        return summary
+
+    def _load_lf_tags(self, catalog_id: str, tables: list, max_workers: int = None) -> None:
+        '''
+        Adds the Lake Formation tags of each of a list of tables to the table's Tags, looking up tables concurrently
+        :param catalog_id:
+        :param tables:
+        :param max_workers: Defaults to LF_TAG_LOOKUP_WORKERS
+        :return:
+        '''
+        max_workers = LF_TAG_LOOKUP_WORKERS if max_workers is None else int(max_workers)
+        if max_workers <= 1 or len(tables) <= 1:
+            for t in tables:
+                self._load_table_lf_tags(catalog_id=catalog_id, table=t)
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(tables))) as executor:
+                # consume the results so that any lookup failure is raised here
+                list(executor.map(lambda t: self._load_table_lf_tags(catalog_id=catalog_id, table=t), tables))
+
+    def _start_lf_tag_lookups(self) -> None:
+        # without a TTL, tag definitions are only reused within one load of tables
+        with self._lf_tag_cache_lock:
+            if self._lf_tag_cache_ttl_seconds is None:
+                self._lf_tag_cache.clear()
+            self._lf_tag_cache_hits = 0
+            self._lf_tag_cache_misses = 0
+
+    def _log_lf_tag_lookups(self) -> None:
+        lookups = self._lf_tag_cache_hits + self._lf_tag_cache_misses
+        if lookups > 0:
+            self._logger.debug(
+                f"Resolved {lookups} LF Tag lookups with {self._lf_tag_cache_misses} calls to Lake Formation "
+                f"(cache hit ratio {self._lf_tag_cache_hits / lookups:.2f})")
+
+    def iter_glue_tables(self, catalog_id: str, source_db_name: str, table_name_regex: str, fields: list = None,
+                         load_lf_tags: bool = False, max_workers: int = None):
+        '''
+        Generator of the tables of a database matching a regex, yielded a page at a time as they are read from Glue, so
+        that only one page of tables is held in memory
+        :param catalog_id:
+        :param source_db_name:
+        :param table_name_regex:
+        :param fields: Attributes of each table to keep, where nested attributes are given as a dotted path such as
+        StorageDescriptor.Location. Tables are returned in full if not supplied
+        :param load_lf_tags: Whether to add the Lake Formation tags of each table to its Tags
+        :param max_workers: Number of tables in a page whose tags are looked up concurrently
+        :return:
+        '''
         glue_client = self._get_client('glue')
-        lf_client = self._get_client('lakeformation')
 
         # get the tables which are included in the set provided through args
         get_tables_args = {
@@ -463,18 +1044,16 @@ class ApiAutomator:
         if table_name_regex is not None:
             get_tables_args['Expression'] = table_name_regex
 
-        finished_reading = False
-        last_token = None
-        all_tables = []
-
         def _no_data():
             raise Exception("Unable to find any Tables matching %s in Database %s" % (table_name_regex,
                                                                                       source_db_name))
 
-        while finished_reading is False:
-            if last_token is not None:
-                get_tables_args['NextToken'] = last_token
+        if load_lf_tags is True:
+            self._start_lf_tag_lookups()
 
+        finished_reading = False
+        table_count = 0
+        while finished_reading is False:
             try:
                 get_table_response = glue_client.get_tables(
                     **get_tables_args
@@ -483,43 +1062,47 @@ class ApiAutomator:
                 _no_data()
 
             if 'NextToken' in get_table_response:
-                last_token = get_table_response.get('NextToken')
+                get_tables_args['NextToken'] = get_table_response.get('NextToken')
             else:
                 finished_reading = True
 
-            # add the tables returned from this instance of the request
-            if not get_table_response.get('TableList'):
-                _no_data()
-            else:
-                all_tables.extend(get_table_response.get('TableList'))
+            page = get_table_response.get('TableList') or []
+            table_count += len(page)
+
+            if load_lf_tags is True:
+                self._load_lf_tags(catalog_id=catalog_id, tables=page, max_workers=max_workers)
+
+            for t in page:
+                yield t if fields is None else utils.project(t, fields)
+
+        if table_count == 0:
+            _no_data()
+
+        if load_lf_tags is True:
+            self._log_lf_tag_lookups()
+
+    def load_glue_tables(self, catalog_id: str, source_db_name: str,
+                         table_name_regex: str, load_lf_tags: bool = True, max_workers: int = None):
+        '''
+        Loads the tables of a database matching a regex, along with the Lake Formation tags on each table
+        :param catalog_id:
+        :param source_db_name:
+        :param table_name_regex:
+        :param load_lf_tags:
+        :param max_workers: Number of tables whose tags are looked up concurrently, within the Lake Formation request
+        rate. Defaults to LF_TAG_LOOKUP_WORKERS
+        :return:
+        '''
+        all_tables = list(self.iter_glue_tables(catalog_id=catalog_id, source_db_name=source_db_name,
+                                                table_name_regex=table_name_regex))
 
         self._logger.info(f"Loaded {len(all_tables)} tables matching {table_name_regex} from Glue")
 
         # now load all lakeformation tags for the supplied objects
         if load_lf_tags is True:
-            for t in all_tables:
-                tags = lf_client.get_resource_lf_tags(
-                    CatalogId=catalog_id,
-                    Resource={
-                        'Table': {
-                            'CatalogId': catalog_id,
-                            'DatabaseName': t.get('DatabaseName'),
-                            'Name': t.get('Name')
-                        }
-                    },
-                    ShowAssignedLFTags=True
-                )
-                key = 'LFTagsOnTable'
-                use_tags = {}
-                if tags.get(key) is not None and len(tags.get(key)) > 0:
-                    for table_tag in tags.get(key):
-                        # get all the valid values for the tag in LF
-                        lf_tag = lf_client.get_lf_tag(TagKey=table_tag.get('TagKey'))
-                        use_tags[table_tag.get('TagKey')] = {
-                            'TagValues': table_tag.get('TagValues'),
-                            'ValidValues': lf_tag.get('TagValues')
-                        }
-                    t['Tags'] = use_tags
+            self._start_lf_tag_lookups()
+            self._load_lf_tags(catalog_id=catalog_id, tables=all_tables, max_workers=max_workers)
+            self._log_lf_tag_lookups()
 
         return all_tables
 
@@ -761,18 +1344,162 @@ class ApiAutomator:
         except glue_client.exceptions.EntityNotFoundException:
             raise Exception(f"Table {database_name}.{table_name} Not Found")
 
+    def update_table_parameters(self, database_name: str, table_name: str, update) -> dict:
+        '''
+        Changes the parameters of a table. The update is made against the version of the table it was computed from,
+        and is recomputed from the current parameters if the table was changed by another writer in between
+        :param database_name:
+        :param table_name:
+        :param update: Function given the current parameters of the table, returning the new parameters, or None to
+        leave the table unchanged
+        :return: The parameters of the table
+        '''
+        glue_client = self._get_client('glue')
+        keys = [
+            'DatabaseName', 'CreateTime', 'UpdateTime', 'CreatedBy', 'IsRegisteredWithLakeFormation', 'CatalogId',
+            'Tags', 'VersionId'
+        ]
+
+        while True:
+            table = self.describe_table(database_name=database_name, table_name=table_name)
+            current = table.get('Parameters') or {}
+            parameters = update(dict(current))
+            if parameters is None or parameters == current:
+                return current
+
+            table_input = utils.remove_dict_keys(input_dict=table, remove_keys=keys)
+            table_input['Parameters'] = parameters
+            try:
+                self._rate_limit('glue')
+                glue_client.update_table(DatabaseName=database_name, TableInput=table_input,
+                                         VersionId=table.get('VersionId'))
+                return parameters
+            except glue_client.exceptions.ConcurrentModificationException:
+                self._logger.debug(f"Table {database_name}.{table_name} changed while updating its parameters")
+
+    def get_table_names(self, database_name: str, catalog_id: str = None) -> set:
+        '''
+        Returns the names of all tables in a database visible to the caller, using a single paginated get_tables call
+        :param database_name:
+        :param catalog_id:
+        :return:
+        '''
+        glue_client = self._get_client('glue')
+
+        args = {
+            'DatabaseName': database_name
+        }
+        if catalog_id is not None:
+            args['CatalogId'] = catalog_id
+
+        names = set()
+        try:
+            for page in glue_client.get_paginator('get_tables').paginate(**args):
+                names.update([t.get('Name') for t in page.get('TableList')])
+        except glue_client.exceptions.EntityNotFoundException:
+            raise Exception(f"Database {database_name} Not Found")
+
+        return names
+
+    def _lf_batch_permissions_request(self, api: str, catalog_id: str, entries: list, max_attempts: int) -> list:
+        '''
+        Makes one Lake Formation batch permissions request, retrying only the entries which failed with a transient error
+        :param api: Either batch_grant_permissions or batch_revoke_permissions
+        :param catalog_id:
+        :param entries: Up to LF_BATCH_SIZE permissions entries
+        :param max_attempts:
+        :return: list of the result of each entry
+        '''
+        lf_client = self._get_client('lakeformation')
+        results = []
+
+        pending = entries
+        attempt = 0
+        while len(pending) > 0:
+            attempt += 1
+            retry = []
+            self._rate_limit('lakeformation')
+            try:
+                response = getattr(lf_client, api)(CatalogId=catalog_id, Entries=pending)
+                failures = response.get('Failures', [])
+            except botocore.exceptions.ClientError as e:
+                # the whole request failed, so every entry shares the error
+                failures = [{'RequestEntry': p, 'Error': {'ErrorCode': e.response.get('Error', {}).get('Code'),
+                                                          'ErrorMessage': e.response.get('Error', {}).get('Message')}}
+                            for p in pending]
+
+            by_id = {p.get('Id'): p for p in pending}
+            for f in failures:
+                entry = by_id.pop(f.get('RequestEntry', {}).get('Id'), None)
+                code = f.get('Error', {}).get('ErrorCode')
+
+                if code in LF_RETRYABLE_ERROR_CODES and attempt < max_attempts and entry is not None:
+                    retry.append(entry)
+                else:
+                    results.append({'Id': f.get('RequestEntry', {}).get('Id'),
+                                    'Resource': f.get('RequestEntry', {}).get('Resource'),
+                                    'Permissions': f.get('RequestEntry', {}).get('Permissions'),
+                                    'Status': 'Failed', 'Attempts': attempt, 'ErrorCode': code,
+                                    'ErrorMessage': f.get('Error', {}).get('ErrorMessage')})
+
+            # entries without a failure were applied
+            for entry in by_id.values():
+                results.append({'Id': entry.get('Id'), 'Resource': entry.get('Resource'),
+                                'Permissions': entry.get('Permissions'), 'Status': 'Succeeded', 'Attempts': attempt})
+
+            if len(retry) > 0:
+                time.sleep(LF_RETRY_BASE_SECONDS * (2 ** (attempt - 1)))
+            pending = retry
+
+        return results
+
+    def _lf_batch_permissions(self, api: str, catalog_id: str, entries: list, max_workers: int = None,
+                              max_attempts: int = None) -> dict:
+        '''
+        Applies any number of Lake Formation permissions entries, split into requests of LF_BATCH_SIZE entries which are
+        made concurrently within the Lake Formation request rate
+        :param api: Either batch_grant_permissions or batch_revoke_permissions
+        :param catalog_id:
+        :param entries:
+        :param max_workers: Defaults to LF_BATCH_WORKERS
+        :param max_attempts: Defaults to LF_MAX_ATTEMPTS
+        :return: dict of the number of entries which Succeeded and Failed, and the result of each of the Entries
+        '''
+        max_workers = LF_BATCH_WORKERS if max_workers is None else int(max_workers)
+        max_attempts = LF_MAX_ATTEMPTS if max_attempts is None else int(max_attempts)
+        batches = [entries[i:i + LF_BATCH_SIZE] for i in range(0, len(entries), LF_BATCH_SIZE)]
+
+        def _request(batch):
+            return self._lf_batch_permissions_request(api=api, catalog_id=catalog_id, entries=batch,
+                                                      max_attempts=max_attempts)
+
+        if max_workers <= 1 or len(batches) <= 1:
+            results = [_request(b) for b in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as executor:
+                results = list(executor.map(_request, batches))
+
+        entry_results = [r for batch in results for r in batch]
+        return {
+            'Succeeded': len([r for r in entry_results if r.get('Status') == 'Succeeded']),
+            'Failed': len([r for r in entry_results if r.get('Status') == 'Failed']),
+            'Entries': entry_results
+        }
+
     def lf_batch_revoke_permissions(self,
                                     data_mesh_account_id: str,
                                     consumer_account_id: str,
                                     permissions: list,
                                     database_name: str,
                                     grantable_permissions: list = None,
-                                    table_list: list = None) -> int:
-        lf_client = self._get_client('lakeformation')
-
+                                    table_list: list = None) -> dict:
+        '''
+        Revokes permissions on a list of tables
+        :return: dict of the number of entries which Succeeded and Failed, and the result of each of the Entries
+        '''
         entries = []
 
-        for t in table_list:
+        for t in utils.ensure_list(table_list):
             entries.extend(self.create_lf_permissions_entry(
                 data_mesh_account_id=data_mesh_account_id,
                 target_account_id=consumer_account_id,
@@ -783,15 +1510,15 @@ class ApiAutomator:
                 target_batch=True
             ))
 
-        response = lf_client.batch_revoke_permissions(
-            CatalogId=data_mesh_account_id,
-            Entries=entries
-        )
-        perms_revoked = len(entries)
-        if 'Failures' in response:
-            perms_revoked -= len(response.get('Failures'))
+        response = self._lf_batch_permissions(api='batch_revoke_permissions', catalog_id=data_mesh_account_id,
+                                              entries=entries)
+
+        if response.get('Failed') > 0:
+            self._logger.error(
+                f"Exceptions raised while revoking Batch Permissions from {consumer_account_id} on {data_mesh_account_id}")
+            self._logger.error([e for e in response.get('Entries') if e.get('Status') == 'Failed'])
 
-        return perms_revoked
+        return response
 
     def create_lf_permissions_entry(self,
                                     data_mesh_account_id: str,
@@ -909,14 +1636,18 @@ class ApiAutomator:
                                    permissions: list,
                                    database_name: str,
                                    grantable_permissions: list = None,
-                                   table_list: list = None) -> int:
+                                   table_list: list = None) -> dict:
+        '''
+        Grants permissions on a list of tables. DESCRIBE is always granted
+        :return: dict of the number of entries which Succeeded and Failed, and the result of each of the Entries
+        '''
         entries = []
 
         # always grant describe
         if 'DESCRIBE' not in permissions:
             permissions.append('DESCRIBE')
 
-        for t in table_list:
+        for t in utils.ensure_list(table_list):
             entries.extend(self.create_lf_permissions_entry(
                 data_mesh_account_id=data_mesh_account_id,
                 target_account_id=target_account_id,
@@ -927,29 +1658,23 @@ class ApiAutomator:
                 target_batch=True)
             )
 
-        lf_client = self._get_client('lakeformation')
-
-        response = lf_client.batch_grant_permissions(
-            CatalogId=data_mesh_account_id,
-            Entries=entries
-        )
+        response = self._lf_batch_permissions(api='batch_grant_permissions', catalog_id=data_mesh_account_id,
+                                              entries=entries)
 
-        perms_added = len(entries)
-        if 'Failures' in response:
-            perms_added -= len(response.get('Failures'))
-
-        if perms_added == 0:
+        if response.get('Failed') > 0:
             self._logger.error(
                 f"Exceptions raised while granting Batch Permissions from {data_mesh_account_id} to {target_account_id}")
-            self._logger.error(response.get('Failures'))
+            self._logger.error([e for e in response.get('Entries') if e.get('Status') == 'Failed'])
+
+        if response.get('Succeeded') == 0:
             raise Exception(f"Failed to grant permissions on Account {data_mesh_account_id}")
         else:
-            return perms_added
+            return response
 
     def lf_grant_permissions(self, data_mesh_account_id: str, principal: str, database_name: str,
                              table_name: str = None,
                              permissions: list = ['ALL'],
-                             grantable_permissions: list = None) -> int:
+                             grantable_permissions: list = None) -> dict:
         table_list = table_name if isinstance(table_name, list) else [table_name]
         return self.lf_batch_grant_permissions(
             data_mesh_account_id=data_mesh_account_id,
@@ -0,0 +1,1150 @@
+import logging
+import math
+import threading
+import time
+import botocore.exceptions
+from concurrent.futures import ThreadPoolExecutor
+from boto3.dynamodb.conditions import Attr, And, ConditionExpressionBuilder, Key
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from data_mesh_util.lib.constants import *
+from data_mesh_util.lib.SubscriptionStore import *
+import data_mesh_util.lib.utils as utils
+
+# the records table holds items which support the subscriptions table, such as the fingerprint of each subscription
+# request which guarantees that duplicate requests are never created, and the history of each subscription sorted by
+# History ID
+RECORD_KEY = 'RecordKey'
+RECORD_SORT = 'RecordSort'
+FINGERPRINT_RECORD = 'Fingerprint'
+HISTORY_RECORD = 'History'
+COUNTS_RECORD = 'Counts'
+
+# rough fraction of an index that we assume each matched key attribute selects, used only for explain() estimates
+PLANNER_KEY_SELECTIVITY = 0.1
+READ_UNIT_BYTES = 4096
+
+# DynamoDB service limits and retry behaviour for batch operations
+BATCH_GET_ITEM_LIMIT = 100
+BATCH_MAX_RETRIES = 8
+BATCH_BACKOFF_BASE_SECONDS = 0.05
+TRANSACT_WRITE_ITEM_LIMIT = 100
+
+# requests which can report the capacity they consume, and whether they read or write
+READ_REQUESTS = ['get_item', 'batch_get_item', 'query', 'scan', 'transact_get_items']
+WRITE_REQUESTS = ['put_item', 'update_item', 'delete_item', 'batch_write_item', 'transact_write_items']
+
+# how long table endpoints and index status cached in the local state file are trusted for when using lazy_init
+TABLE_STATE_TTL_SECONDS = 3600
+
+
+def _merge_counter_deltas(merged: dict, counter_deltas: dict) -> dict:
+    '''
+    Returns a copy of merged with counter_deltas added to it
+    '''
+    out = {k: dict(v) for k, v in merged.items()}
+    for counter_id, deltas in (counter_deltas or {}).items():
+        target = out.setdefault(counter_id, {})
+        for status, delta in deltas.items():
+            target[status] = target.get(status, 0) + delta
+
+    return out
+
+
+class DynamoSubscriptionStore(SubscriptionStore):
+    '''
+    Subscription store backed by the AwsDataMeshSubscriptions and AwsDataMeshSubscriptionRecords DynamoDB tables
+    '''
+    _data_mesh_account_id = None
+    _region = None
+    _credentials = None
+    _lazy_init = False
+    _session = None
+    _clients = None
+    _dynamo_resource = None
+    _client_lock = None
+    _table = None
+    _table_info = None
+    _table_description = None
+    _active_indexes = None
+    _logger = None
+
+    def __init__(self, credentials, data_mesh_account_id: str, region_name: str, lazy_init: bool = False,
+                 logger: logging.Logger = None):
+        '''
+        :param credentials:
+        :param data_mesh_account_id:
+        :param region_name:
+        :param lazy_init: Skip all AWS calls at construction. Clients are built on first use, the tables are only
+        described or created when found to be missing, and table endpoints are cached in the local state file
+        :param logger:
+        '''
+        self._data_mesh_account_id = data_mesh_account_id
+        self._region = region_name
+        self._credentials = credentials
+        self._lazy_init = lazy_init
+        self._client_lock = threading.Lock()
+        self._clients = {}
+        self._logger = logger if logger is not None else logging.getLogger("DynamoSubscriptionStore")
+
+        if lazy_init is not True:
+            self._init_table()
+
+    def _get_client(self, client_name: str):
+        client = self._clients.get(client_name)
+
+        if client is None:
+            # sessions are not thread safe, so build clients one at a time
+            with self._client_lock:
+                if self._session is None:
+                    self._session = utils.create_session(credentials=self._credentials, region=self._region)
+
+                client = self._clients.get(client_name)
+                if client is None:
+                    client = self._session.client(client_name)
+                    self._clients[client_name] = client
+
+        return client
+
+    def _get_resource(self):
+        if self._dynamo_resource is None:
+            self._get_client('dynamodb')
+
+            with self._client_lock:
+                if self._dynamo_resource is None:
+                    self._dynamo_resource = self._session.resource('dynamodb')
+
+        return self._dynamo_resource
+
+    def _get_table(self):
+        # creating the table handle makes no AWS calls
+        if self._table is None:
+            self._table = self._get_resource().Table(SUBSCRIPTIONS_TRACKER_TABLE)
+
+        return self._table
+
+    def _call(self, fn, **kwargs):
+        '''
+        Invokes a DynamoDB operation. If the subscriptions table doesn't exist yet, then it is created and the
+        operation retried, so that existence only needs to be checked on failure
+        :param fn:
+        :param kwargs:
+        :return:
+        '''
+        try:
+            return self._measure(fn, **kwargs)
+        except botocore.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ResourceNotFoundException':
+                raise e
+
+        self._logger.info(f"Table {SUBSCRIPTIONS_TRACKER_TABLE} not found")
+        self._init_table()
+
+        return self._measure(fn, **kwargs)
+
+    def _measure(self, fn, **kwargs):
+        '''
+        Invokes a DynamoDB operation, reporting its latency, consumed capacity and item counts to the metrics registry
+        '''
+        request = fn.__name__
+        if self._metrics is None:
+            return fn(**kwargs)
+
+        if request in READ_REQUESTS or request in WRITE_REQUESTS:
+            kwargs.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+        start = time.perf_counter()
+        try:
+            response = fn(**kwargs)
+        except Exception as e:
+            self._metrics.record_request(request=request, latency_seconds=time.perf_counter() - start, failed=True)
+            raise e
+        latency = time.perf_counter() - start
+
+        # single table requests return one ConsumedCapacity, and batches or transactions return one per table
+        consumed = response.get('ConsumedCapacity', [])
+        consumed = consumed if isinstance(consumed, list) else [consumed]
+        read_units = 0.0
+        write_units = 0.0
+        for c in consumed:
+            units = float(c.get('CapacityUnits', 0))
+            if 'ReadCapacityUnits' in c or 'WriteCapacityUnits' in c:
+                read_units += float(c.get('ReadCapacityUnits', 0))
+                write_units += float(c.get('WriteCapacityUnits', 0))
+            elif request in READ_REQUESTS:
+                read_units += units
+            else:
+                write_units += units
+
+        if 'Count' in response:
+            returned = response.get('Count')
+            scanned = response.get('ScannedCount', returned)
+        elif 'Responses' in response:
+            returned = sum([len(v) for v in response.get('Responses').values()])
+            scanned = returned
+        else:
+            returned = 1 if 'Item' in response else 0
+            scanned = returned
+
+        self._metrics.record_request(request=request, latency_seconds=latency, read_units=read_units,
+                                     write_units=write_units, items_returned=returned, items_scanned=scanned)
+
+        return response
+
+    def _state_key(self) -> str:
+        return f"{self._data_mesh_account_id}/{self._region}/{SUBSCRIPTIONS_TRACKER_TABLE}"
+
+    def _load_table_state(self) -> dict:
+        '''
+        Returns the table endpoints, loading them and the list of active indexes from the local state file when using
+        lazy_init, and otherwise describing the table
+        :return:
+        '''
+        if self._table_info is None:
+            state = None
+            if self._lazy_init is True:
+                state = utils.load_local_state(self._state_key(), max_age_seconds=TABLE_STATE_TTL_SECONDS)
+
+            if state is None:
+                self._init_table()
+            else:
+                self._table_info = state.get('Endpoints')
+                self._active_indexes = state.get('ActiveIndexes')
+
+        return self._table_info
+
+    def _init_table(self):
+        dynamo_client = self._get_client('dynamodb')
+
+        t = None
+        try:
+            response = dynamo_client.describe_table(
+                TableName=SUBSCRIPTIONS_TRACKER_TABLE
+            )
+
+            t = response.get('Table')
+
+            # add any secondary indexes introduced since the table was created
+            self._migrate_indexes(t)
+        except dynamo_client.exceptions.ResourceNotFoundException:
+            t = self._create_table()
+
+        self._table_description = t
+        self._active_indexes = self._get_active_indexes(t)
+        self._table_info = {
+            'Table': t.get('TableArn'),
+            'Stream': t.get('LatestStreamArn'),
+            'RecordsTable': self._init_records_table().get('TableArn')
+        }
+
+        utils.save_local_state(self._state_key(), {
+            'Endpoints': self._table_info,
+            'ActiveIndexes': self._active_indexes
+        })
+
+        return self._table_info
+
+    def get_endpoints(self) -> dict:
+        return self._load_table_state()
+
+    def _indexname(self, index: str) -> str:
+        return "%s-%s" % (SUBSCRIPTIONS_TRACKER_TABLE, index)
+
+    def subscriber_indexname(self):
+        return self._indexname(SUBSCRIBER_INDEX)
+
+    def owner_indexname(self):
+        return self._indexname(OWNER_INDEX)
+
+    def _get_active_indexes(self, table_description: dict) -> list:
+        '''
+        Returns the list of secondary indexes which can be queried, excluding those still being created or backfilled
+        :param table_description:
+        :return:
+        '''
+        active = []
+        for gsi in table_description.get('GlobalSecondaryIndexes', []):
+            if gsi.get('IndexStatus', 'ACTIVE') == 'ACTIVE' and gsi.get('Backfilling') is not True:
+                active.append(gsi.get('IndexName'))
+
+        return active
+
+    def _attribute_definitions(self, indexes: list = None) -> list:
+        '''
+        Returns the attribute definitions needed for the table key and the key attributes of a list of indexes
+        :param indexes: Index suffixes, or None for every index
+        :return:
+        '''
+        attributes = [SUBSCRIPTION_ID]
+        for index in INDEX_KEYS.keys() if indexes is None else indexes:
+            for k in INDEX_KEYS.get(index):
+                if k is not None and k not in attributes:
+                    attributes.append(k)
+
+        return [{'AttributeName': a, 'AttributeType': 'N' if a in NUMERIC_ATTRIBUTES else 'S'} for a in attributes]
+
+    def _index_definition(self, index: str) -> dict:
+        hash_key, range_key = INDEX_KEYS.get(index)
+        key_schema = [
+            {
+                'AttributeName': hash_key,
+                'KeyType': 'HASH',
+            }
+        ]
+        if range_key is not None:
+            key_schema.append({
+                'AttributeName': range_key,
+                'KeyType': 'RANGE',
+            })
+
+        return {
+            'IndexName': self._indexname(index),
+            'KeySchema': key_schema,
+            'Projection': {
+                'ProjectionType': 'ALL'
+            }
+        }
+
+    def _migrate_indexes(self, table_description: dict) -> None:
+        '''
+        Creates secondary indexes which are missing from an existing subscriptions table. DynamoDB only allows a single
+        index to be created per update, so any further missing indexes are created on subsequent initialisations. Until
+        an index is ACTIVE the query planner will not use it.
+        :param table_description:
+        :return:
+        '''
+        existing = [gsi.get('IndexName') for gsi in table_description.get('GlobalSecondaryIndexes', [])]
+        missing = [i for i in INDEX_KEYS.keys() if self._indexname(i) not in existing]
+
+        if len(missing) > 0:
+            try:
+                self._get_client('dynamodb').update_table(
+                    TableName=SUBSCRIPTIONS_TRACKER_TABLE,
+                    AttributeDefinitions=self._attribute_definitions(indexes=[missing[0]]),
+                    GlobalSecondaryIndexUpdates=[
+                        {
+                            'Create': self._index_definition(missing[0])
+                        }
+                    ]
+                )
+                self._logger.info(f"Creating Secondary Index {self._indexname(missing[0])}")
+            except Exception as e:
+                # the caller may not be allowed to modify the table, or another index may already be in flight. Queries
+                # which would use the index scan the table until it has been created
+                self._logger.warning(f"Unable to create Secondary Index {self._indexname(missing[0])}: {e}")
+
+    def _drop_active_index(self, index_name: str) -> None:
+        '''
+        Stops the query planner using an index which DynamoDB reports doesn't exist, for example because the active
+        indexes were loaded from an out of date local state file
+        :param index_name:
+        :return:
+        '''
+        self._logger.warning(f"Secondary Index {index_name} is not available, falling back to a table scan")
+        self._active_indexes = [i for i in (self._active_indexes or []) if i != index_name]
+
+        if self._table_info is not None:
+            utils.save_local_state(self._state_key(), {
+                'Endpoints': self._table_info,
+                'ActiveIndexes': self._active_indexes
+            })
+
+    def _is_missing_index_error(self, e: botocore.exceptions.ClientError, args: dict) -> bool:
+        return args.get('IndexName') is not None and e.response.get('Error', {}).get('Code') == 'ValidationException'
+
+    def _create_table(self):
+        response = self._get_client('dynamodb').create_table(
+            TableName=SUBSCRIPTIONS_TRACKER_TABLE,
+            AttributeDefinitions=self._attribute_definitions(),
+            KeySchema=[
+                {
+                    'AttributeName': SUBSCRIPTION_ID,
+                    'KeyType': 'HASH'
+                }
+            ],
+            GlobalSecondaryIndexes=[self._index_definition(i) for i in INDEX_KEYS.keys()],
+            BillingMode='PAY_PER_REQUEST',
+            StreamSpecification={
+                'StreamEnabled': True,
+                'StreamViewType': 'NEW_AND_OLD_IMAGES'
+            },
+            Tags=[DEFAULT_TAGS]
+        )
+
+        # block until the table is ACTIVE
+        t = self._get_table()
+        t.wait_until_exists()
+
+        return response.get('TableDescription')
+
+    def _init_records_table(self) -> dict:
+        dynamo_client = self._get_client('dynamodb')
+
+        try:
+            return dynamo_client.describe_table(TableName=SUBSCRIPTION_RECORDS_TABLE).get('Table')
+        except dynamo_client.exceptions.ResourceNotFoundException:
+            self._logger.info(f"Creating {SUBSCRIPTION_RECORDS_TABLE}")
+            response = dynamo_client.create_table(
+                TableName=SUBSCRIPTION_RECORDS_TABLE,
+                AttributeDefinitions=[
+                    {
+                        'AttributeName': RECORD_KEY,
+                        'AttributeType': 'S'
+                    },
+                    {
+                        'AttributeName': RECORD_SORT,
+                        'AttributeType': 'S'
+                    }
+                ],
+                KeySchema=[
+                    {
+                        'AttributeName': RECORD_KEY,
+                        'KeyType': 'HASH'
+                    },
+                    {
+                        'AttributeName': RECORD_SORT,
+                        'KeyType': 'RANGE'
+                    }
+                ],
+                BillingMode='PAY_PER_REQUEST',
+                Tags=[DEFAULT_TAGS]
+            )
+
+            # block until the table is ACTIVE
+            dynamo_client.get_waiter('table_exists').wait(TableName=SUBSCRIPTION_RECORDS_TABLE)
+
+            return response.get('TableDescription')
+
+    def _serialize(self, item: dict) -> dict:
+        serializer = TypeSerializer()
+        return {k: serializer.serialize(v) for k, v in item.items() if v is not None}
+
+    def _deserialize(self, item: dict) -> dict:
+        deserializer = TypeDeserializer()
+        return {k: deserializer.deserialize(v) for k, v in item.items()}
+
+    def _fingerprint_key(self, fingerprint: str) -> dict:
+        return {
+            RECORD_KEY: f"{FINGERPRINT_RECORD}#{fingerprint}",
+            RECORD_SORT: FINGERPRINT_RECORD
+        }
+
+    def _history_put(self, history: dict) -> dict:
+        record = {
+            RECORD_KEY: f"{HISTORY_RECORD}#{history.get(SUBSCRIPTION_ID)}",
+            RECORD_SORT: history.get(HISTORY_ID)
+        }
+        record.update(history)
+
+        return {
+            'Put': {
+                'TableName': SUBSCRIPTION_RECORDS_TABLE,
+                'Item': self._serialize(record),
+                'ConditionExpression': 'attribute_not_exists(#key)',
+                'ExpressionAttributeNames': {'#key': RECORD_KEY}
+            }
+        }
+
+    def _counts_key(self, counter_id: str) -> dict:
+        return {
+            RECORD_KEY: f"{COUNTS_RECORD}#{counter_id}",
+            RECORD_SORT: COUNTS_RECORD
+        }
+
+    def _counter_actions(self, counter_deltas: dict) -> list:
+        '''
+        Builds the transaction actions which add to counters. Counter items are created by their first update, with a
+        numeric attribute for each Status
+        :param counter_deltas:
+        :return:
+        '''
+        actions = []
+        for counter_id, deltas in sorted((counter_deltas or {}).items()):
+            deltas = {k: v for k, v in deltas.items() if v != 0}
+            if len(deltas) == 0:
+                continue
+
+            names = {}
+            values = {}
+            expressions = []
+            for i, (status, delta) in enumerate(sorted(deltas.items())):
+                names[f"#c{i}"] = status
+                values[f":c{i}"] = delta
+                expressions.append(f"#c{i} :c{i}")
+
+            actions.append({
+                'Update': {
+                    'TableName': SUBSCRIPTION_RECORDS_TABLE,
+                    'Key': self._serialize(self._counts_key(counter_id)),
+                    'UpdateExpression': f"ADD {', '.join(expressions)}",
+                    'ExpressionAttributeNames': names,
+                    'ExpressionAttributeValues': self._serialize(values)
+                }
+            })
+
+        return actions
+
+    def _create_actions(self, item: dict, replaces: str = None, history: dict = None) -> list:
+        '''
+        Builds the transaction actions which create a subscription. The fingerprint record is only written if it
+        doesn't already exist, which fails the whole transaction when the same request has been made before
+        :param item:
+        :param replaces: Subscription ID held by an existing fingerprint record which may be overwritten, because that
+        subscription has expired and been removed, or was deleted or denied
+        :param history: History record to write with the subscription
+        :return:
+        '''
+        guard = self._fingerprint_key(item.get(FINGERPRINT))
+        guard[SUBSCRIPTION_ID] = item.get(SUBSCRIPTION_ID)
+
+        guard_put = {
+            'TableName': SUBSCRIPTION_RECORDS_TABLE,
+            'Item': self._serialize(guard),
+            'ConditionExpression': 'attribute_not_exists(#key)',
+            'ExpressionAttributeNames': {'#key': RECORD_KEY}
+        }
+        if replaces is not None:
+            guard_put['ConditionExpression'] = 'attribute_not_exists(#key) OR #sid = :sid'
+            guard_put['ExpressionAttributeNames']['#sid'] = SUBSCRIPTION_ID
+            guard_put['ExpressionAttributeValues'] = self._serialize({':sid': replaces})
+
+        actions = [
+            {
+                'Put': guard_put
+            },
+            {
+                'Put': {
+                    'TableName': SUBSCRIPTIONS_TRACKER_TABLE,
+                    'Item': self._serialize(item),
+                    'ConditionExpression': 'attribute_not_exists(#key)',
+                    'ExpressionAttributeNames': {'#key': SUBSCRIPTION_ID}
+                }
+            }
+        ]
+        if history is not None:
+            actions.append(self._history_put(history))
+
+        return actions
+
+    def _get_fingerprint_owner(self, fingerprint: str) -> str:
+        response = self._call(self._get_client('dynamodb').get_item, TableName=SUBSCRIPTION_RECORDS_TABLE,
+                              Key=self._serialize(self._fingerprint_key(fingerprint)), ConsistentRead=True)
+
+        if 'Item' not in response:
+            return None
+        else:
+            return response.get('Item').get(SUBSCRIPTION_ID).get('S')
+
+    def create(self, item: dict, history: dict = None, counter_deltas: dict = None) -> tuple:
+        replaces = None
+        while True:
+            try:
+                self._call(self._get_client('dynamodb').transact_write_items,
+                           TransactItems=self._create_actions(item, replaces=replaces, history=history) +
+                                         self._counter_actions(counter_deltas))
+                return item.get(SUBSCRIPTION_ID), False
+            except botocore.exceptions.ClientError as e:
+                reasons = e.response.get('CancellationReasons', [])
+                if e.response.get('Error', {}).get('Code') != 'TransactionCanceledException' or len(reasons) == 0 or \
+                        reasons[0].get('Code') != 'ConditionalCheckFailed':
+                    raise e
+
+                existing = self._get_fingerprint_owner(item.get(FINGERPRINT))
+                if existing is None:
+                    raise e
+                elif existing == replaces:
+                    return existing, True
+
+                current = self.get(existing)
+                if current is not None and current.get(STATUS) not in REPLACEABLE_STATUSES:
+                    return existing, True
+                else:
+                    # the original subscription expired and was removed by Time to Live, or was deleted or denied, so
+                    # the request is new again
+                    replaces = existing
+
+    def create_many(self, items: list, histories: list = None, counter_deltas: list = None) -> dict:
+        '''
+        Looks up which fingerprints already exist using BatchGetItem, and then writes the remaining subscriptions in
+        transactions of up to 100 actions. Each subscription is two or three actions, and the counters of every
+        subscription in a transaction are merged into one action per counter
+        :param items:
+        :param histories:
+        :param counter_deltas:
+        :return:
+        '''
+        history_by_fingerprint = {}
+        if histories is not None:
+            history_by_fingerprint = {i.get(FINGERPRINT): h for i, h in zip(items, histories)}
+        deltas_by_fingerprint = {}
+        if counter_deltas is not None:
+            deltas_by_fingerprint = {i.get(FINGERPRINT): d for i, d in zip(items, counter_deltas)}
+
+        def _create(item: dict) -> tuple:
+            return self.create(item, history=history_by_fingerprint.get(item.get(FINGERPRINT)),
+                               counter_deltas=deltas_by_fingerprint.get(item.get(FINGERPRINT)))
+
+        existing = {}
+        fingerprints = [i.get(FINGERPRINT) for i in items]
+        for i in range(0, len(fingerprints), BATCH_GET_ITEM_LIMIT):
+            keys = [self._serialize(self._fingerprint_key(f)) for f in fingerprints[i:i + BATCH_GET_ITEM_LIMIT]]
+            for record in self._batch_get_keys(table_name=SUBSCRIPTION_RECORDS_TABLE, keys=keys, consistent_read=True):
+                existing[record.get(RECORD_KEY).split('#', 1)[1]] = record.get(SUBSCRIPTION_ID)
+
+        # fingerprints whose subscription has expired and been removed, or was deleted or denied, are treated as new
+        # requests by create()
+        live = set([i.get(SUBSCRIPTION_ID) for i in self.get_many(list(set(existing.values())))
+                    if i.get(STATUS) not in REPLACEABLE_STATUSES])
+        replaceable = [i for i in items if
+                       i.get(FINGERPRINT) in existing and existing.get(i.get(FINGERPRINT)) not in live]
+        for item in replaceable:
+            subscription_id, is_existing = _create(item)
+            if is_existing:
+                existing[item.get(FINGERPRINT)] = subscription_id
+            else:
+                existing.pop(item.get(FINGERPRINT))
+
+        created = set([i.get(FINGERPRINT) for i in replaceable])
+        to_create = [i for i in items if i.get(FINGERPRINT) not in existing and i.get(FINGERPRINT) not in created]
+
+        # fill each transaction with as many subscriptions as fit alongside their merged counters
+        chunks = []
+        chunk, actions, merged = [], [], {}
+        for item in to_create:
+            item_actions = self._create_actions(item, history=history_by_fingerprint.get(item.get(FINGERPRINT)))
+            item_merged = _merge_counter_deltas(merged, deltas_by_fingerprint.get(item.get(FINGERPRINT)))
+
+            if len(chunk) > 0 and len(actions) + len(item_actions) + len(item_merged) > TRANSACT_WRITE_ITEM_LIMIT:
+                chunks.append((chunk, actions + self._counter_actions(merged)))
+                chunk, actions = [], []
+                item_merged = _merge_counter_deltas({}, deltas_by_fingerprint.get(item.get(FINGERPRINT)))
+
+            chunk.append(item)
+            actions.extend(item_actions)
+            merged = item_merged
+        if len(chunk) > 0:
+            chunks.append((chunk, actions + self._counter_actions(merged)))
+
+        for chunk, actions in chunks:
+            try:
+                self._call(self._get_client('dynamodb').transact_write_items, TransactItems=actions)
+            except botocore.exceptions.ClientError as e:
+                if e.response.get('Error', {}).get('Code') != 'TransactionCanceledException':
+                    raise e
+
+                # a concurrent caller created some of these requests, so resolve each one individually
+                for item in chunk:
+                    subscription_id, is_existing = _create(item)
+                    if is_existing:
+                        existing[item.get(FINGERPRINT)] = subscription_id
+
+        return existing
+
+    def get(self, subscription_id: str, consistent_read: bool = True) -> dict:
+        item = self._call(self._get_table().get_item, Key={SUBSCRIPTION_ID: subscription_id},
+                          ConsistentRead=consistent_read)
+
+        return item.get("Item")
+
+    def get_many(self, subscription_ids: list, consistent_read: bool = True, max_workers: int = 4) -> list:
+        '''
+        Keys are split into BatchGetItem requests of 100 which are run concurrently, and any UnprocessedKeys are
+        retried with exponential backoff
+        '''
+        keys = [{SUBSCRIPTION_ID: {'S': i}} for i in subscription_ids]
+        chunks = [keys[i:i + BATCH_GET_ITEM_LIMIT] for i in range(0, len(keys), BATCH_GET_ITEM_LIMIT)]
+
+        # requests made by the pool are attributed to the caller's operation
+        operation = None if self._metrics is None else self._metrics.current_operation()
+
+        def _get_chunk(chunk: list) -> list:
+            if operation is None:
+                return self._batch_get_keys(table_name=SUBSCRIPTIONS_TRACKER_TABLE, keys=chunk,
+                                            consistent_read=consistent_read)
+
+            with self._metrics.attribute(operation):
+                return self._batch_get_keys(table_name=SUBSCRIPTIONS_TRACKER_TABLE, keys=chunk,
+                                            consistent_read=consistent_read)
+
+        items = []
+        if len(chunks) > 0:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+                for found in executor.map(_get_chunk, chunks):
+                    items.extend(found)
+
+        return items
+
+    def _batch_get_keys(self, table_name: str, keys: list, consistent_read: bool) -> list:
+        # use the low level client as it's safe to share across threads, unlike the resource
+        request = {
+            table_name: {
+                'Keys': keys,
+                'ConsistentRead': consistent_read
+            }
+        }
+
+        items = []
+        retries = 0
+        while len(request) > 0:
+            response = self._call(self._get_client('dynamodb').batch_get_item, RequestItems=request)
+
+            for i in response.get('Responses', {}).get(table_name, []):
+                items.append(self._deserialize(i))
+
+            request = response.get('UnprocessedKeys', {})
+            if len(request) > 0:
+                if retries >= BATCH_MAX_RETRIES:
+                    raise Exception(f"Unable to read {len(request.get(table_name).get('Keys'))} "
+                                    f"items from {table_name} after {retries} retries")
+
+                time.sleep(BATCH_BACKOFF_BASE_SECONDS * (2 ** retries))
+                retries += 1
+
+        return items
+
+    def update(self, subscription_id: str, set_values: dict, add_values: dict = None, expected_status: list = None,
+               remove_attributes: list = None, history: dict = None, counter_deltas: dict = None,
+               on_condition_failure=None) -> dict:
+        names = {}
+        values = {}
+        set_expressions = []
+        add_expressions = []
+        remove_expressions = []
+
+        # boto3 uses #n and :v placeholders for the condition expression, so these must not collide
+        def _name(attribute: str) -> str:
+            alias = f"#u{len(names)}"
+            names[alias] = attribute
+            return alias
+
+        def _value(value) -> str:
+            alias = f":u{len(values)}"
+            values[alias] = value
+            return alias
+
+        for k, v in set_values.items():
+            set_expressions.append(f"{_name(k)} = {_value(v)}")
+
+        for k, v in (add_values or {}).items():
+            add_expressions.append(f"{_name(k)} {_value(v)}")
+
+        for k in (remove_attributes or []):
+            remove_expressions.append(_name(k))
+
+        update_expression = ""
+        if len(set_expressions) > 0:
+            update_expression = f"SET {', '.join(set_expressions)}"
+        if len(add_expressions) > 0:
+            update_expression = f"{update_expression} ADD {', '.join(add_expressions)}".strip()
+        if len(remove_expressions) > 0:
+            update_expression = f"{update_expression} REMOVE {', '.join(remove_expressions)}".strip()
+
+        # never create a subscription through an update
+        condition = Attr(SUBSCRIPTION_ID).exists()
+        if expected_status is not None:
+            condition = And(condition, Attr(STATUS).is_in(expected_status))
+
+        if history is not None or counter_deltas is not None:
+            return self._update_transaction(subscription_id=subscription_id, update_expression=update_expression,
+                                            names=names, values=values, condition=condition, set_values=set_values,
+                                            history=history, counter_deltas=counter_deltas,
+                                            on_condition_failure=on_condition_failure)
+
+        args = {
+            "Key": {
+                SUBSCRIPTION_ID: subscription_id
+            },
+            "UpdateExpression": update_expression,
+            "ExpressionAttributeNames": names,
+            "ConditionExpression": condition
+        }
+        if len(values) > 0:
+            args["ExpressionAttributeValues"] = values
+
+        try:
+            self._call(self._get_table().update_item, **args)
+        except botocore.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return None
+            else:
+                raise e
+
+        # return the same values as the transaction path, which can't return updated attributes
+        return dict(set_values)
+
+    def _update_transaction(self, subscription_id: str, update_expression: str, names: dict, values: dict, condition,
+                            set_values: dict, history: dict, counter_deltas: dict,
+                            on_condition_failure=None) -> dict:
+        '''
+        Applies an update, writes its history record and adjusts counters in one transaction, so that history and
+        counts only change for updates which are applied. Transactions don't return updated attributes, so the values
+        which were set are returned. A failed condition returns the subscription as found with the cancellation
+        '''
+        built = ConditionExpressionBuilder().build_expression(condition)
+        names = dict(names, **built.attribute_name_placeholders)
+        values = dict(values, **built.attribute_value_placeholders)
+
+        update = {
+            'TableName': SUBSCRIPTIONS_TRACKER_TABLE,
+            'Key': self._serialize({SUBSCRIPTION_ID: subscription_id}),
+            'UpdateExpression': update_expression,
+            'ConditionExpression': built.condition_expression,
+            'ExpressionAttributeNames': names
+        }
+        if len(values) > 0:
+            update['ExpressionAttributeValues'] = {k: TypeSerializer().serialize(v) for k, v in values.items()}
+        if on_condition_failure is not None:
+            update['ReturnValuesOnConditionCheckFailure'] = 'ALL_OLD'
+
+        actions = [{'Update': update}]
+        if history is not None:
+            actions.append(self._history_put(history))
+        actions.extend(self._counter_actions(counter_deltas))
+
+        try:
+            self._call(self._get_client('dynamodb').transact_write_items, TransactItems=actions)
+        except botocore.exceptions.ClientError as e:
+            reasons = e.response.get('CancellationReasons', [])
+            if e.response.get('Error', {}).get('Code') == 'TransactionCanceledException' and len(reasons) > 0 and \
+                    reasons[0].get('Code') == 'ConditionalCheckFailed':
+                if on_condition_failure is not None:
+                    found = reasons[0].get('Item')
+                    on_condition_failure(None if found is None else self._deserialize(found))
+                return None
+            else:
+                raise e
+
+        return dict(set_values)
+
+    def get_counts(self, counter_id: str) -> dict:
+        response = self._call(self._get_client('dynamodb').get_item, TableName=SUBSCRIPTION_RECORDS_TABLE,
+                              Key=self._serialize(self._counts_key(counter_id)))
+
+        counts = self._deserialize(response.get('Item', {}))
+        counts.pop(RECORD_KEY, None)
+        counts.pop(RECORD_SORT, None)
+
+        return {k: int(v) for k, v in counts.items()}
+
+    def set_counts(self, counter_id: str, counts: dict) -> None:
+        item = self._counts_key(counter_id)
+        item.update({k: int(v) for k, v in counts.items()})
+
+        self._call(self._get_client('dynamodb').put_item, TableName=SUBSCRIPTION_RECORDS_TABLE,
+                   Item=self._serialize(item))
+
+    def list_counter_ids(self) -> list:
+        # counter records share the records table with history, so are picked out by their sort key
+        args = {
+            'TableName': SUBSCRIPTION_RECORDS_TABLE,
+            'FilterExpression': '#sort = :counts',
+            'ProjectionExpression': '#key',
+            'ExpressionAttributeNames': {'#key': RECORD_KEY, '#sort': RECORD_SORT},
+            'ExpressionAttributeValues': self._serialize({':counts': COUNTS_RECORD})
+        }
+
+        counter_ids = []
+        while True:
+            response = self._call(self._get_client('dynamodb').scan, **args)
+            for i in response.get('Items'):
+                counter_ids.append(self._deserialize(i).get(RECORD_KEY)[len(COUNTS_RECORD) + 1:])
+
+            if response.get('LastEvaluatedKey') is None:
+                return counter_ids
+            args['ExclusiveStartKey'] = response.get('LastEvaluatedKey')
+
+    def get_history(self, subscription_id: str, start_token: dict = None, page_size: int = None) -> tuple:
+        args = {
+            'TableName': SUBSCRIPTION_RECORDS_TABLE,
+            'KeyConditionExpression': '#key = :key',
+            'ExpressionAttributeNames': {'#key': RECORD_KEY},
+            'ExpressionAttributeValues': self._serialize({':key': f"{HISTORY_RECORD}#{subscription_id}"}),
+            'ScanIndexForward': True
+        }
+        if start_token is not None:
+            args['ExclusiveStartKey'] = start_token
+        if page_size is not None:
+            args['Limit'] = int(page_size)
+
+        response = self._call(self._get_client('dynamodb').query, **args)
+
+        records = []
+        for i in response.get('Items'):
+            record = self._deserialize(i)
+            record.pop(RECORD_KEY, None)
+            record.pop(RECORD_SORT, None)
+            records.append(record)
+
+        return records, response.get('LastEvaluatedKey')
+
+    def _build_filter_expression(self, args: dict, exclude_deleted: bool = True):
+        filter = None
+
+        for arg in args.items():
+            if arg[1] is not None:
+                if filter is None:
+                    filter = Attr(arg[0]).eq(arg[1])
+                else:
+                    filter = And(filter, Attr(arg[0]).eq(arg[1]))
+
+        # add the deleted filter
+        if exclude_deleted is True:
+            deleted_filter = Attr(STATUS).ne(STATUS_DELETED)
+            filter = deleted_filter if filter is None else And(filter, deleted_filter)
+
+        return filter
+
+    def _plan(self, filters: dict, active: list = None) -> dict:
+        '''
+        Query planner which chooses the cheapest access path for a set of attribute equality filters. Every ACTIVE
+        secondary index whose hash key is supplied as a string filter is a candidate, and the index matching the most
+        key attributes wins. If no index can be used then the plan falls back to a full table scan.
+        :param filters: dict of attribute name to required value. None values are ignored
+        :param active: Names of the ACTIVE indexes. Defaults to those of the initialised table
+        :return:
+        '''
+        supplied = {k: v for k, v in filters.items() if v is not None}
+        if active is None:
+            self._load_table_state()
+            active = self._active_indexes if self._active_indexes is not None else []
+
+        best = None
+        for index, (hash_key, range_key) in INDEX_KEYS.items():
+            # the UpdatedAt indexes are sparse, as subscriptions created before UpdatedAt was introduced are missing
+            if index in UPDATED_INDEXES.values() or self._indexname(index) not in active or not isinstance(
+                    supplied.get(hash_key), str):
+                continue
+
+            key_attributes = [hash_key]
+            if range_key is not None and isinstance(supplied.get(range_key), str):
+                key_attributes.append(range_key)
+
+            if best is None or len(key_attributes) > len(best.get('KeyAttributes')):
+                best = {
+                    'Operation': 'query',
+                    'IndexName': self._indexname(index),
+                    'KeyAttributes': key_attributes
+                }
+
+        if best is None:
+            best = {
+                'Operation': 'scan',
+                'IndexName': None,
+                'KeyAttributes': []
+            }
+
+        best['FilterAttributes'] = [k for k in supplied.keys() if k not in best.get('KeyAttributes')]
+
+        return best
+
+    def _estimate_read_units(self, plan: dict):
+        '''
+        Rough estimate of the eventually consistent read units consumed by a plan, based upon the table statistics
+        which DynamoDB refreshes approximately every six hours
+        :param plan:
+        :return:
+        '''
+        if self._table_description is None:
+            return None
+
+        if plan.get('IndexName') is None:
+            size_bytes = self._table_description.get('TableSizeBytes')
+        else:
+            size_bytes = None
+            for gsi in self._table_description.get('GlobalSecondaryIndexes', []):
+                if gsi.get('IndexName') == plan.get('IndexName'):
+                    size_bytes = gsi.get('IndexSizeBytes')
+
+        if size_bytes is None:
+            return None
+
+        read_bytes = size_bytes * (PLANNER_KEY_SELECTIVITY ** len(plan.get('KeyAttributes')))
+
+        # every request consumes at least half a read unit
+        return max(0.5, math.ceil(read_bytes / READ_UNIT_BYTES) * 0.5)
+
+    def explain(self, filters: dict) -> dict:
+        '''
+        Reports the index used for a set of filters and an estimate of the read units consumed
+        '''
+        # table statistics are needed for the estimate. The table is only described, so that explaining a query never
+        # creates or modifies the table
+        if self._table_description is None:
+            self._table_description = self._get_client('dynamodb').describe_table(
+                TableName=SUBSCRIPTIONS_TRACKER_TABLE
+            ).get('Table')
+
+        plan = self._plan(filters, active=self._get_active_indexes(self._table_description))
+        plan['EstimatedReadUnits'] = self._estimate_read_units(plan)
+
+        return plan
+
+    def _build_query_args(self, filters: dict, exclude_deleted: bool = True, start_token: dict = None,
+                          page_size: int = None) -> tuple:
+        '''
+        Builds the DynamoDB operation name and arguments needed to list subscriptions for the supplied filters
+        :return: tuple of (operation, args)
+        '''
+        plan = self._plan(filters)
+
+        args = {}
+
+        def _add_arg(key: str, value):
+            if value is not None:
+                args[key] = value
+
+        _add_arg("ExclusiveStartKey", start_token)
+        _add_arg("Limit", page_size)
+
+        if plan.get('Operation') == 'query':
+            key_condition = None
+            for k in plan.get('KeyAttributes'):
+                key_condition = Key(k).eq(filters.get(k)) if key_condition is None else And(key_condition,
+                                                                                           Key(k).eq(filters.get(k)))
+
+            _add_arg("IndexName", plan.get('IndexName'))
+            _add_arg("KeyConditionExpression", key_condition)
+            _add_arg("Select", "ALL_PROJECTED_ATTRIBUTES")
+
+        _add_arg("FilterExpression",
+                 self._build_filter_expression({k: filters.get(k) for k in plan.get('FilterAttributes')},
+                                               exclude_deleted=exclude_deleted))
+
+        return plan.get('Operation'), args
+
+    def query(self, filters: dict, exclude_deleted: bool = True, start_token: dict = None,
+              page_size: int = None) -> tuple:
+        operation, args = self._build_query_args(filters=filters, exclude_deleted=exclude_deleted,
+                                                 start_token=start_token, page_size=page_size)
+
+        try:
+            response = self._call(getattr(self._get_table(), operation), **args)
+        except botocore.exceptions.ClientError as e:
+            if not self._is_missing_index_error(e, args):
+                raise e
+
+            self._drop_active_index(args.get('IndexName'))
+            operation, args = self._build_query_args(filters=filters, exclude_deleted=exclude_deleted,
+                                                     start_token=start_token, page_size=page_size)
+            response = self._call(getattr(self._get_table(), operation), **args)
+
+        return response.get('Items'), response.get('LastEvaluatedKey')
+
+    def query_updated_since(self, principal_attribute: str, principal: str, since: int, start_token: dict = None,
+                            page_size: int = None) -> tuple:
+        '''
+        Queries the UpdatedAt index of the owner or subscriber. Until that index is ACTIVE, the principal's
+        subscriptions are filtered on UpdatedAt instead, and results are not ordered
+        '''
+        self._load_table_state()
+        index_name = self._indexname(UPDATED_INDEXES.get(principal_attribute))
+
+        if index_name in (self._active_indexes or []):
+            args = {
+                "IndexName": index_name,
+                "KeyConditionExpression": And(Key(principal_attribute).eq(principal), Key(UPDATED_AT).gte(since)),
+                "Select": "ALL_PROJECTED_ATTRIBUTES"
+            }
+            if start_token is not None:
+                args["ExclusiveStartKey"] = start_token
+            if page_size is not None:
+                args["Limit"] = page_size
+
+            try:
+                return self._query_page(self._get_table().query, **args)
+            except botocore.exceptions.ClientError as e:
+                if not self._is_missing_index_error(e, args):
+                    raise e
+                self._drop_active_index(index_name)
+
+        operation, args = self._build_query_args(filters={principal_attribute: principal}, exclude_deleted=False,
+                                                 start_token=start_token, page_size=page_size)
+        args["FilterExpression"] = And(args.get("FilterExpression"), Attr(UPDATED_AT).gte(since)) if args.get(
+            "FilterExpression") is not None else Attr(UPDATED_AT).gte(since)
+
+        return self._query_page(getattr(self._get_table(), operation), **args)
+
+    def _query_page(self, fn, **kwargs) -> tuple:
+        response = self._call(fn, **kwargs)
+        return response.get('Items'), response.get('LastEvaluatedKey')
+
+    def scan_segment(self, segment: int, total_segments: int, start_token: dict = None) -> tuple:
+        args = {
+            'TableName': SUBSCRIPTIONS_TRACKER_TABLE,
+            'Segment': segment,
+            'TotalSegments': total_segments
+        }
+        if start_token is not None:
+            args['ExclusiveStartKey'] = start_token
+
+        # use the low level client as it's safe to share across threads, unlike the resource
+        response = self._call(self._get_client('dynamodb').scan, **args)
+
+        return [self._deserialize(i) for i in response.get('Items')], response.get('LastEvaluatedKey')
+
+    def enable_expiry(self) -> bool:
+        dynamo_client = self._get_client('dynamodb')
+        ttl = self._call(dynamo_client.describe_time_to_live, TableName=SUBSCRIPTIONS_TRACKER_TABLE).get(
+            'TimeToLiveDescription', {})
+
+        if ttl.get('TimeToLiveStatus') in ['ENABLED', 'ENABLING']:
+            return False
+
+        self._call(dynamo_client.update_time_to_live, TableName=SUBSCRIPTIONS_TRACKER_TABLE,
+                   TimeToLiveSpecification={'Enabled': True, 'AttributeName': EXPIRES_AT})
+        self._logger.info(f"Enabled Time to Live on {EXPIRES_AT} for {SUBSCRIPTIONS_TRACKER_TABLE}")
+
+        return True
+
+    def scan_expired(self, before: int, segment: int, total_segments: int, start_token: dict = None) -> tuple:
+        args = {
+            'TableName': SUBSCRIPTIONS_TRACKER_TABLE,
+            'Segment': segment,
+            'TotalSegments': total_segments,
+            'FilterExpression': '#e <= :before',
+            'ExpressionAttributeNames': {'#e': EXPIRES_AT},
+            'ExpressionAttributeValues': self._serialize({':before': int(before)})
+        }
+        if start_token is not None:
+            args['ExclusiveStartKey'] = start_token
+
+        response = self._call(self._get_client('dynamodb').scan, **args)
+
+        return [self._deserialize(i) for i in response.get('Items')], response.get('LastEvaluatedKey')
+
+    def delete_expired(self, item: dict, before: int, counter_deltas: dict = None) -> bool:
+        subscription_id = item.get(SUBSCRIPTION_ID)
+        actions = [
+            {
+                'Delete': {
+                    'TableName': SUBSCRIPTIONS_TRACKER_TABLE,
+                    'Key': self._serialize({SUBSCRIPTION_ID: subscription_id}),
+                    'ConditionExpression': '#e <= :before',
+                    'ExpressionAttributeNames': {'#e': EXPIRES_AT},
+                    'ExpressionAttributeValues': self._serialize({':before': int(before)})
+                }
+            }
+        ]
+
+        # subscriptions created before fingerprints were introduced have no fingerprint record
+        if item.get(FINGERPRINT) is not None:
+            actions.append({
+                'Delete': {
+                    'TableName': SUBSCRIPTION_RECORDS_TABLE,
+                    'Key': self._serialize(self._fingerprint_key(item.get(FINGERPRINT))),
+                    'ConditionExpression': 'attribute_not_exists(#key) OR #sid = :sid',
+                    'ExpressionAttributeNames': {'#key': RECORD_KEY, '#sid': SUBSCRIPTION_ID},
+                    'ExpressionAttributeValues': self._serialize({':sid': subscription_id})
+                }
+            })
+
+        actions.extend(self._counter_actions(counter_deltas))
+
+        try:
+            self._call(self._get_client('dynamodb').transact_write_items, TransactItems=actions)
+        except botocore.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'TransactionCanceledException':
+                return False
+            else:
+                raise e
+
+        return True
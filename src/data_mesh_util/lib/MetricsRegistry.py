@@ -0,0 +1,207 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+METRIC_PREFIX = 'data_mesh_subscriptions'
+
+
+class OperationMetrics:
+    '''
+    Totals for one logical operation, such as list_subscriptions, and the storage requests made on its behalf
+    '''
+    calls = 0
+    errors = 0
+    latency_seconds = 0.0
+    max_latency_seconds = 0.0
+    requests = None
+    request_errors = 0
+    request_latency_seconds = 0.0
+    read_units = 0.0
+    write_units = 0.0
+    items_returned = 0
+    items_scanned = 0
+
+    def __init__(self):
+        self.requests = {}
+
+    def to_dict(self) -> dict:
+        return {
+            'Calls': self.calls,
+            'Errors': self.errors,
+            'LatencySeconds': {
+                'Sum': self.latency_seconds,
+                'Max': self.max_latency_seconds,
+                'Mean': self.latency_seconds / self.calls if self.calls > 0 else 0.0
+            },
+            'Requests': dict(self.requests),
+            'RequestErrors': self.request_errors,
+            'RequestLatencySeconds': self.request_latency_seconds,
+            'ReadCapacityUnits': self.read_units,
+            'WriteCapacityUnits': self.write_units,
+            'ItemsReturned': self.items_returned,
+            'ItemsScanned': self.items_scanned,
+            # items read for every item returned. Values well above 1 show filters that an index should serve
+            'ScannedToReturnedRatio': self.items_scanned / self.items_returned if self.items_returned > 0 else None
+        }
+
+
+class MetricsRegistry:
+    '''
+    Thread safe registry of per operation metrics. Callers mark the logical operation being performed with
+    operation(), and storage requests made on the same thread are recorded against it with record_request(). Metrics
+    can be read as a dict, JSON, or in the Prometheus text exposition format.
+    '''
+    _operations = None
+    _lock = None
+    _local = None
+
+    def __init__(self):
+        self._operations = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _get(self, operation: str) -> OperationMetrics:
+        metrics = self._operations.get(operation)
+        if metrics is None:
+            metrics = OperationMetrics()
+            self._operations[operation] = metrics
+
+        return metrics
+
+    def current_operation(self) -> str:
+        return getattr(self._local, 'operation', None)
+
+    @contextmanager
+    def operation(self, name: str, call: bool = True):
+        '''
+        Times a logical operation on this thread. Operations started within another operation are attributed to the
+        outer operation, so that a call is only counted once
+        :param name:
+        :param call: Whether to count a call, or only add to the latency of the operation, as when resuming a generator
+        :return:
+        '''
+        if self.current_operation() is not None:
+            yield
+            return
+
+        self._local.operation = name
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except BaseException as e:
+            failed = not isinstance(e, GeneratorExit)
+            raise e
+        finally:
+            self._local.operation = None
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                metrics = self._get(name)
+                if call is True:
+                    metrics.calls += 1
+                if failed:
+                    metrics.errors += 1
+                metrics.latency_seconds += elapsed
+                metrics.max_latency_seconds = max(metrics.max_latency_seconds, elapsed)
+
+    @contextmanager
+    def attribute(self, name: str):
+        '''
+        Attributes requests made on this thread to an operation without timing it, for work done by a thread pool on
+        behalf of an operation running on another thread
+        :param name:
+        :return:
+        '''
+        previous = self.current_operation()
+        self._local.operation = name
+        try:
+            yield
+        finally:
+            self._local.operation = previous
+
+    def record_request(self, request: str, latency_seconds: float, read_units: float = 0.0, write_units: float = 0.0,
+                       items_returned: int = 0, items_scanned: int = 0, failed: bool = False,
+                       operation: str = None) -> None:
+        '''
+        Records a storage request against the current operation
+        :param request: Name of the storage API called, such as query
+        :param latency_seconds:
+        :param read_units: Read capacity consumed
+        :param write_units: Write capacity consumed
+        :param items_returned:
+        :param items_scanned: Items read by the request, before any filter was applied
+        :param failed:
+        :param operation: Operation to record against. Defaults to the operation running on this thread, or the request
+        name if there is none
+        :return:
+        '''
+        operation = operation if operation is not None else self.current_operation()
+        operation = operation if operation is not None else request
+
+        with self._lock:
+            metrics = self._get(operation)
+            metrics.requests[request] = metrics.requests.get(request, 0) + 1
+            if failed:
+                metrics.request_errors += 1
+            metrics.request_latency_seconds += latency_seconds
+            metrics.read_units += read_units
+            metrics.write_units += write_units
+            metrics.items_returned += items_returned
+            metrics.items_scanned += items_scanned
+
+    def reset(self) -> None:
+        with self._lock:
+            self._operations = {}
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {k: v.to_dict() for k, v in sorted(self._operations.items())}
+
+    def to_json(self, indent: int = None) -> str:
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def to_prometheus(self) -> str:
+        '''
+        Renders every metric in the Prometheus text exposition format
+        :return:
+        '''
+        metrics = self.to_dict()
+
+        # metric name, type, help, and function returning the value for an operation
+        families = [
+            ('operation_calls_total', 'counter', 'Calls to each operation', lambda m: m.get('Calls')),
+            ('operation_errors_total', 'counter', 'Operations which raised an error', lambda m: m.get('Errors')),
+            ('operation_latency_seconds_sum', 'counter', 'Total time spent in each operation',
+             lambda m: m.get('LatencySeconds').get('Sum')),
+            ('operation_latency_seconds_max', 'gauge', 'Longest single call to each operation',
+             lambda m: m.get('LatencySeconds').get('Max')),
+            ('request_errors_total', 'counter', 'Storage requests which failed', lambda m: m.get('RequestErrors')),
+            ('request_latency_seconds_sum', 'counter', 'Total time spent in storage requests',
+             lambda m: m.get('RequestLatencySeconds')),
+            ('read_capacity_units_total', 'counter', 'Read capacity consumed',
+             lambda m: m.get('ReadCapacityUnits')),
+            ('write_capacity_units_total', 'counter', 'Write capacity consumed',
+             lambda m: m.get('WriteCapacityUnits')),
+            ('items_returned_total', 'counter', 'Items returned by storage requests',
+             lambda m: m.get('ItemsReturned')),
+            ('items_scanned_total', 'counter', 'Items read by storage requests before filtering',
+             lambda m: m.get('ItemsScanned'))
+        ]
+
+        lines = []
+        for name, metric_type, description, value in families:
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {description}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {metric_type}")
+            for operation, m in metrics.items():
+                lines.append(f'{METRIC_PREFIX}_{name}{{operation="{operation}"}} {value(m)}')
+
+        # requests are broken down by the storage API called
+        lines.append(f"# HELP {METRIC_PREFIX}_requests_total Storage requests made by each operation")
+        lines.append(f"# TYPE {METRIC_PREFIX}_requests_total counter")
+        for operation, m in metrics.items():
+            for request, count in sorted(m.get('Requests').items()):
+                lines.append(f'{METRIC_PREFIX}_requests_total{{operation="{operation}",request="{request}"}} {count}')
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,49 @@
+import threading
+import time
+
+
+class RateLimiter:
+    '''
+    Thread safe token bucket which limits the rate of requests made to a service across all threads sharing it.
+    Requests may be made in bursts of up to burst requests, after which they are spaced to the configured rate.
+    '''
+    _rate_per_second = None
+    _burst = None
+    _tokens = None
+    _updated = None
+    _lock = None
+
+    def __init__(self, rate_per_second: float, burst: int = None):
+        '''
+        :param rate_per_second: Sustained number of requests allowed per second
+        :param burst: Number of requests which may be made at once. Defaults to one second of requests
+        '''
+        if rate_per_second is None or rate_per_second <= 0:
+            raise Exception("Rate Limit must be greater than 0 requests per second")
+
+        self._rate_per_second = float(rate_per_second)
+        self._burst = float(burst if burst is not None else max(1, int(rate_per_second)))
+        self._tokens = self._burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        '''
+        Blocks until a request may be made
+        :return: The number of seconds spent waiting
+        '''
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate_per_second)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+
+                wait = (1 - self._tokens) / self._rate_per_second
+
+            time.sleep(wait)
+            waited += wait
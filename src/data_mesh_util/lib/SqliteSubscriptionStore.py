@@ -0,0 +1,422 @@
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from data_mesh_util.lib.SubscriptionStore import *
+import data_mesh_util.lib.utils as utils
+
+# subscription attributes which are held in their own column so that they can be indexed
+COLUMNS = {
+    SUBSCRIPTION_ID: 'subscription_id',
+    OWNER_PRINCIPAL: 'owner_principal',
+    SUBSCRIBER_PRINCIPAL: 'subscriber_principal',
+    DATABASE_NAME: 'database_name',
+    STATUS: 'status',
+    FINGERPRINT: 'fingerprint',
+    UPDATED_AT: 'updated_at'
+}
+SET_MARKER = '__set__'
+SCAN_PAGE_SIZE = 1000
+
+
+def _encode(item: dict) -> str:
+    def _default(value):
+        # sets have no JSON representation, so they are tagged in order to round trip
+        if isinstance(value, (set, frozenset)):
+            return {SET_MARKER: sorted(value)}
+        else:
+            return utils.dynamo_json_default(value)
+
+    return json.dumps(item, default=_default)
+
+
+def _decode(value: str) -> dict:
+    def _object_hook(o: dict):
+        if len(o) == 1 and SET_MARKER in o:
+            return set(o.get(SET_MARKER))
+        else:
+            return o
+
+    return json.loads(value, object_hook=_object_hook)
+
+
+def _json_path(attribute: str) -> str:
+    return '$."%s"' % attribute
+
+
+class SqliteSubscriptionStore(SubscriptionStore):
+    '''
+    Embedded subscription store backed by SQLite, which needs no AWS access. Useful for tests, benchmarks and ephemeral
+    meshes. Indexes equivalent to the DynamoDB secondary indexes are maintained over the key attributes, and all other
+    attributes are stored as a JSON document.
+    '''
+    _path = None
+    _connection = None
+    _lock = None
+
+    def __init__(self, path: str = ':memory:'):
+        '''
+        :param path: Database file to use, or ':memory:' for a store which only lives as long as this object
+        '''
+        self._path = path
+        self._lock = threading.RLock()
+
+        # transactions are managed explicitly, so that updates can read and write under a single lock
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._init_schema()
+
+    def _init_schema(self) -> None:
+        with self._lock:
+            self._connection.execute(
+                "create table if not exists subscriptions (subscription_id text primary key, owner_principal text, "
+                "subscriber_principal text, database_name text, status text, fingerprint text unique, "
+                "item text not null, updated_at integer)")
+
+            # add columns introduced since the database was created
+            existing = [r[1] for r in self._connection.execute("pragma table_info(subscriptions)").fetchall()]
+            if COLUMNS.get(UPDATED_AT) not in existing:
+                self._connection.execute("alter table subscriptions add column updated_at integer")
+                self._connection.execute("update subscriptions set updated_at = json_extract(item, ?)",
+                                         [_json_path(UPDATED_AT)])
+
+            # history records are only ever read by subscription, in History ID order
+            self._connection.execute(
+                "create table if not exists subscription_history (subscription_id text not null, "
+                "history_id text not null, item text not null, primary key (subscription_id, history_id))")
+
+            self._connection.execute(
+                "create table if not exists subscription_counts (counter_id text not null, status text not null, "
+                "count integer not null, primary key (counter_id, status))")
+
+            for index, (hash_key, range_key) in INDEX_KEYS.items():
+                columns = [COLUMNS.get(k) for k in [hash_key, range_key] if k is not None]
+                self._connection.execute(
+                    f"create index if not exists subscriptions_{index.lower()} on subscriptions ({', '.join(columns)})")
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._connection.execute("begin immediate")
+            try:
+                yield self._connection
+                self._connection.execute("commit")
+            except BaseException as e:
+                self._connection.execute("rollback")
+                raise e
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def get_endpoints(self) -> dict:
+        return {
+            'Table': f"sqlite:{self._path}",
+            'Stream': None
+        }
+
+    def _insert(self, connection, item: dict) -> None:
+        connection.execute(
+            f"insert into subscriptions ({', '.join(COLUMNS.values())}, item) "
+            f"values ({', '.join(['?'] * (len(COLUMNS) + 1))})",
+            [item.get(k) for k in COLUMNS.keys()] + [_encode(item)])
+
+    def _insert_history(self, connection, history: dict) -> None:
+        if history is not None:
+            connection.execute("insert into subscription_history values (?, ?, ?)",
+                               [history.get(SUBSCRIPTION_ID), history.get(HISTORY_ID), _encode(history)])
+
+    def _apply_counter_deltas(self, connection, counter_deltas: dict) -> None:
+        for counter_id, deltas in (counter_deltas or {}).items():
+            for status, delta in deltas.items():
+                connection.execute(
+                    "insert into subscription_counts values (?, ?, ?) "
+                    "on conflict (counter_id, status) do update set count = count + excluded.count",
+                    [counter_id, status, delta])
+
+    def _fingerprint_owner(self, connection, fingerprint: str) -> str:
+        '''
+        Returns the subscription holding a fingerprint. Deleted or denied subscriptions give up their fingerprint, so
+        that a new request can take it
+        '''
+        row = connection.execute("select subscription_id, item from subscriptions where fingerprint = ?",
+                                 [fingerprint]).fetchone()
+
+        if row is None:
+            return None
+
+        item = _decode(row[1])
+        if item.get(STATUS) not in REPLACEABLE_STATUSES:
+            return row[0]
+
+        item.pop(FINGERPRINT)
+        connection.execute("update subscriptions set fingerprint = null, item = ? where subscription_id = ?",
+                           [_encode(item), row[0]])
+        return None
+
+    def create(self, item: dict, history: dict = None, counter_deltas: dict = None) -> tuple:
+        with self._transaction() as connection:
+            existing = None
+            if item.get(FINGERPRINT) is not None:
+                existing = self._fingerprint_owner(connection, item.get(FINGERPRINT))
+
+            if existing is not None:
+                return existing, True
+            else:
+                self._insert(connection, item)
+                self._insert_history(connection, history)
+                self._apply_counter_deltas(connection, counter_deltas)
+                return item.get(SUBSCRIPTION_ID), False
+
+    def create_many(self, items: list, histories: list = None, counter_deltas: list = None) -> dict:
+        existing = {}
+        histories = histories if histories is not None else [None] * len(items)
+        counter_deltas = counter_deltas if counter_deltas is not None else [None] * len(items)
+        with self._transaction() as connection:
+            for item, history, deltas in zip(items, histories, counter_deltas):
+                found = self._fingerprint_owner(connection, item.get(FINGERPRINT))
+
+                if found is not None:
+                    existing[item.get(FINGERPRINT)] = found
+                else:
+                    self._insert(connection, item)
+                    self._insert_history(connection, history)
+                    self._apply_counter_deltas(connection, deltas)
+
+        return existing
+
+    def get(self, subscription_id: str, consistent_read: bool = True) -> dict:
+        with self._lock:
+            row = self._connection.execute("select item from subscriptions where subscription_id = ?",
+                                           [subscription_id]).fetchone()
+
+        return None if row is None else _decode(row[0])
+
+    def get_many(self, subscription_ids: list, consistent_read: bool = True, max_workers: int = 4) -> list:
+        ids = list(subscription_ids)
+        if len(ids) == 0:
+            return []
+
+        with self._lock:
+            rows = self._connection.execute(
+                f"select item from subscriptions where subscription_id in ({', '.join(['?'] * len(ids))})",
+                ids).fetchall()
+
+        return [_decode(r[0]) for r in rows]
+
+    def update(self, subscription_id: str, set_values: dict, add_values: dict = None, expected_status: list = None,
+               remove_attributes: list = None, history: dict = None, counter_deltas: dict = None,
+               on_condition_failure=None) -> dict:
+        with self._transaction() as connection:
+            row = connection.execute("select item from subscriptions where subscription_id = ?",
+                                     [subscription_id]).fetchone()
+
+            item = None if row is None else _decode(row[0])
+            if item is None or (expected_status is not None and item.get(STATUS) not in expected_status):
+                if on_condition_failure is not None:
+                    on_condition_failure(item)
+                return None
+
+            updated = dict(set_values)
+            for k, v in (add_values or {}).items():
+                current = item.get(k)
+                if isinstance(v, (set, frozenset)):
+                    updated[k] = set(v) if current is None else set(current) | set(v)
+                else:
+                    updated[k] = v if current is None else current + v
+
+            item.update(updated)
+            for k in (remove_attributes or []):
+                item.pop(k, None)
+
+            connection.execute(
+                f"update subscriptions set {', '.join([f'{c} = ?' for c in COLUMNS.values()])}, item = ? "
+                f"where subscription_id = ?",
+                [item.get(k) for k in COLUMNS.keys()] + [_encode(item), subscription_id])
+            self._insert_history(connection, history)
+            self._apply_counter_deltas(connection, counter_deltas)
+
+            return dict(set_values)
+
+    def _where(self, filters: dict, exclude_deleted: bool) -> tuple:
+        clauses = []
+        params = []
+        for k, v in filters.items():
+            if v is None:
+                continue
+
+            if k in COLUMNS:
+                clauses.append(f"{COLUMNS.get(k)} = ?")
+                params.append(v)
+            elif isinstance(v, (list, dict)):
+                # sqlite returns structured values as compact JSON text
+                clauses.append("json_extract(item, ?) = ?")
+                params.extend([_json_path(k), json.dumps(v, separators=(',', ':'))])
+            else:
+                clauses.append("json_extract(item, ?) = ?")
+                params.extend([_json_path(k), v])
+
+        if exclude_deleted is True:
+            clauses.append("status <> ?")
+            params.append(STATUS_DELETED)
+
+        return clauses, params
+
+    def _select(self, clauses: list, params: list, start_token: dict, page_size: int) -> tuple:
+        # pages are keyed on the subscription ID, so a page never has to skip over rows which have already been read
+        if start_token is not None:
+            clauses = clauses + ["subscription_id > ?"]
+            params = params + [start_token.get(SUBSCRIPTION_ID)]
+
+        sql = "select subscription_id, item from subscriptions"
+        if len(clauses) > 0:
+            sql = f"{sql} where {' and '.join(clauses)}"
+        sql = f"{sql} order by subscription_id"
+
+        if page_size is not None:
+            sql = f"{sql} limit ?"
+            params = params + [int(page_size)]
+
+        return sql, params
+
+    def _page(self, rows: list, page_size: int) -> tuple:
+        # a full page means there may be more rows after the last one returned
+        next_token = None
+        if page_size is not None and len(rows) == int(page_size):
+            next_token = {SUBSCRIPTION_ID: rows[-1][0]}
+
+        return [_decode(r[1]) for r in rows], next_token
+
+    def query(self, filters: dict, exclude_deleted: bool = True, start_token: dict = None,
+              page_size: int = None) -> tuple:
+        clauses, params = self._where(filters, exclude_deleted)
+        sql, params = self._select(clauses, params, start_token, page_size)
+
+        with self._lock:
+            rows = self._connection.execute(sql, params).fetchall()
+
+        return self._page(rows, page_size)
+
+    def query_updated_since(self, principal_attribute: str, principal: str, since: int, start_token: dict = None,
+                            page_size: int = None) -> tuple:
+        sql = "select subscription_id, item, updated_at from subscriptions " \
+              f"where {COLUMNS.get(principal_attribute)} = ?"
+        params = [principal]
+
+        # pages are keyed on the update time, with the subscription ID breaking ties
+        if start_token is None:
+            sql = f"{sql} and updated_at >= ?"
+            params.append(since)
+        else:
+            sql = f"{sql} and (updated_at > ? or (updated_at = ? and subscription_id > ?))"
+            params.extend([start_token.get(UPDATED_AT), start_token.get(UPDATED_AT), start_token.get(SUBSCRIPTION_ID)])
+        sql = f"{sql} order by updated_at, subscription_id"
+
+        if page_size is not None:
+            sql = f"{sql} limit ?"
+            params.append(int(page_size))
+
+        with self._lock:
+            rows = self._connection.execute(sql, params).fetchall()
+
+        next_token = None
+        if page_size is not None and len(rows) == int(page_size):
+            next_token = {SUBSCRIPTION_ID: rows[-1][0], UPDATED_AT: rows[-1][2]}
+
+        return [_decode(r[1]) for r in rows], next_token
+
+    def get_counts(self, counter_id: str) -> dict:
+        with self._lock:
+            rows = self._connection.execute("select status, count from subscription_counts where counter_id = ?",
+                                            [counter_id]).fetchall()
+
+        return {r[0]: r[1] for r in rows}
+
+    def set_counts(self, counter_id: str, counts: dict) -> None:
+        with self._transaction() as connection:
+            connection.execute("delete from subscription_counts where counter_id = ?", [counter_id])
+            for status, count in counts.items():
+                connection.execute("insert into subscription_counts values (?, ?, ?)",
+                                   [counter_id, status, int(count)])
+
+    def list_counter_ids(self) -> list:
+        with self._lock:
+            rows = self._connection.execute("select distinct counter_id from subscription_counts").fetchall()
+
+        return [r[0] for r in rows]
+
+    def get_history(self, subscription_id: str, start_token: dict = None, page_size: int = None) -> tuple:
+        sql = "select history_id, item from subscription_history where subscription_id = ?"
+        params = [subscription_id]
+        if start_token is not None:
+            sql = f"{sql} and history_id > ?"
+            params.append(start_token.get(HISTORY_ID))
+        sql = f"{sql} order by history_id"
+
+        if page_size is not None:
+            sql = f"{sql} limit ?"
+            params.append(int(page_size))
+
+        with self._lock:
+            rows = self._connection.execute(sql, params).fetchall()
+
+        next_token = None
+        if page_size is not None and len(rows) == int(page_size):
+            next_token = {HISTORY_ID: rows[-1][0]}
+
+        return [_decode(r[1]) for r in rows], next_token
+
+    def explain(self, filters: dict) -> dict:
+        '''
+        Reports the SQLite query plan used for a set of filters
+        '''
+        clauses, params = self._where(filters, exclude_deleted=filters.get(STATUS) is None)
+        sql, params = self._select(clauses, params, None, None)
+
+        with self._lock:
+            detail = [r[-1] for r in self._connection.execute(f"explain query plan {sql}", params).fetchall()]
+
+        # a SEARCH seeks into an index using the filters, whereas a SCAN reads every row
+        index_name = None
+        for d in detail:
+            if d.startswith('SEARCH') and ' INDEX ' in d:
+                index_name = d.split(' INDEX ')[1].split(' ')[0]
+
+        return {
+            'Operation': 'scan' if index_name is None else 'query',
+            'IndexName': index_name,
+            'Detail': detail
+        }
+
+    def scan_segment(self, segment: int, total_segments: int, start_token: dict = None) -> tuple:
+        sql, params = self._select(["rowid % ? = ?"], [int(total_segments), int(segment)], start_token,
+                                   SCAN_PAGE_SIZE)
+
+        with self._lock:
+            rows = self._connection.execute(sql, params).fetchall()
+
+        return self._page(rows, SCAN_PAGE_SIZE)
+
+    def enable_expiry(self) -> bool:
+        # SQLite has no Time to Live, so expired subscriptions are only removed when they are archived
+        return False
+
+    def scan_expired(self, before: int, segment: int, total_segments: int, start_token: dict = None) -> tuple:
+        sql, params = self._select(["rowid % ? = ?", "json_extract(item, ?) <= ?"],
+                                   [int(total_segments), int(segment), _json_path(EXPIRES_AT), int(before)],
+                                   start_token, SCAN_PAGE_SIZE)
+
+        with self._lock:
+            rows = self._connection.execute(sql, params).fetchall()
+
+        return self._page(rows, SCAN_PAGE_SIZE)
+
+    def delete_expired(self, item: dict, before: int, counter_deltas: dict = None) -> bool:
+        with self._transaction() as connection:
+            deleted = connection.execute(
+                "delete from subscriptions where subscription_id = ? and json_extract(item, ?) <= ?",
+                [item.get(SUBSCRIPTION_ID), _json_path(EXPIRES_AT), int(before)]).rowcount
+
+            if deleted > 0:
+                self._apply_counter_deltas(connection, counter_deltas)
+
+        return deleted > 0
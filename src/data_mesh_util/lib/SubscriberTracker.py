@@ -1,34 +1,31 @@
+import base64
+import functools
+import hashlib
+import inspect
+import json
 import logging
+import os
+import queue
 import sys
-import re
-import shortuuid
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from boto3.dynamodb.conditions import Attr, Or, And, Key
 from enum import Enum
 from data_mesh_util.lib.constants import *
+from data_mesh_util.lib.SubscriptionStore import *
+from data_mesh_util.lib.DynamoSubscriptionStore import DynamoSubscriptionStore
+from data_mesh_util.lib.MetricsRegistry import MetricsRegistry
+from data_mesh_util.lib.SubscriptionArchive import SubscriptionArchive
+from data_mesh_util.lib.SubscriptionStreamConsumer import DynamoStreamSource, SubscriptionStreamConsumer
+from data_mesh_util.lib.TtlCache import TtlCache
 import data_mesh_util.lib.utils as utils
 
-STATUS_ACTIVE = 'Active'
-STATUS_DENIED = 'Denied'
-STATUS_PENDING = 'Pending'
-STATUS_DELETED = 'Deleted'
-SUBSCRIPTION_ID = 'SubscriptionId'
-OWNER_PRINCIPAL = 'OwnerPrincipal'
-SUBSCRIBER_PRINCIPAL = 'SubscriberPrincipal'
-STATUS = 'Status'
-CREATION_DATE = 'CreationDate'
-CREATED_BY = 'CreatedBy'
-UPDATED_DATE = 'UpdatedDate'
-UPDATED_BY = 'UpdatedBy'
-DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
-DATABASE_NAME = 'DatabaseName'
-TABLE_NAME = 'TableName'
-REQUESTED_GRANTS = 'RequestedGrants'
-PERMITTED_GRANTS = 'PermittedGrants'
-GRANTABLE_GRANTS = 'GrantableGrants'
-TABLE_ARNS = 'GrantedTableARNs'
-RAM_SHARES = 'RamShares'
-NOTES = 'Notes'
+# parallel scan limits. Each segment may buffer up to a page of items in the export queue
+MAX_SCAN_SEGMENTS = 1000000
+EXPORT_QUEUE_PAGES = 2
+# Crockford base32, as used by ULIDs
+ULID_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
 
 
 class SubType(Enum):
@@ -38,58 +35,234 @@ class SubType(Enum):
     DOMAIN = 4
 
 
-def _generate_id():
-    return shortuuid.uuid()
+def _now_millis() -> int:
+    return int(time.time() * 1000)
+
+
+_ulid_lock = threading.Lock()
+_last_ulid = [0]
+
+
+def _generate_id(now_millis: int = None) -> str:
+    '''
+    Generates a ULID: a 48 bit millisecond timestamp followed by 80 random bits, encoded as 26 characters of Crockford
+    base32. IDs sort in the order in which they were created, as IDs generated within the same millisecond increment
+    the random bits of the previous ID
+    '''
+    now_millis = _now_millis() if now_millis is None else now_millis
+    with _ulid_lock:
+        value = (now_millis << 80) | int.from_bytes(os.urandom(10), 'big')
+        if value >> 80 <= _last_ulid[0] >> 80:
+            value = _last_ulid[0] + 1
+        _last_ulid[0] = value
+
+    return ''.join(ULID_ALPHABET[(value >> (5 * i)) & 31] for i in reversed(range(26)))
+
+
+def _counter_id(attribute: str, value: str) -> str:
+    return f"{attribute}#{value}"
+
+
+def _counter_deltas(item: dict, from_status: str = None, to_status: str = None) -> dict:
+    '''
+    Returns the changes to the counters of a subscription's owner, subscriber and database when it moves from one
+    Status to another, or None if no counts change
+    :param item: The subscription
+    :param from_status: Status being left, or None for a new subscription
+    :param to_status: Status being entered, or None for a subscription being removed
+    :return:
+    '''
+    deltas = {}
+    if from_status is not None:
+        deltas[from_status] = deltas.get(from_status, 0) - 1
+    if to_status is not None:
+        deltas[to_status] = deltas.get(to_status, 0) + 1
+    deltas = {k: v for k, v in deltas.items() if v != 0}
+
+    if len(deltas) == 0:
+        return None
+    else:
+        return {_counter_id(a, item.get(a)): dict(deltas) for a in COUNTED_ATTRIBUTES if item.get(a) is not None}
+
+
+def _encode_watermark(state: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(state, default=utils.dynamo_json_default).encode()).decode()
+
+
+def _decode_watermark(watermark) -> dict:
+    '''
+    Returns the sync state held by a watermark from list_subscriptions_changed_since, or the state of a first sync from
+    a time in UTC epoch milliseconds
+    '''
+    if isinstance(watermark, str) and not watermark.isdigit():
+        return json.loads(base64.urlsafe_b64decode(watermark.encode()))
+    else:
+        return {'Since': int(watermark), 'Seen': []}
+
+
+def _measured(fn):
+    '''
+    Decorator which records a SubscriberTracker method as a logical operation in the tracker's MetricsRegistry, so that
+    the storage requests it makes are attributed to it. Generators are timed while they run, but not while the caller
+    holds the generator between items
+    '''
+    if inspect.isgeneratorfunction(fn):
+        @functools.wraps(fn)
+        def _generator(self, *args, **kwargs):
+            generator = fn(self, *args, **kwargs)
+            first = True
+            try:
+                while True:
+                    with self._metrics.operation(fn.__name__, call=first):
+                        first = False
+                        try:
+                            value = next(generator)
+                        except StopIteration:
+                            return
+                    yield value
+            finally:
+                generator.close()
+
+        return _generator
+    else:
+        @functools.wraps(fn)
+        def _wrapper(self, *args, **kwargs):
+            with self._metrics.operation(fn.__name__):
+                return fn(self, *args, **kwargs)
+
+        return _wrapper
 
 
 def _format_time_now():
     return datetime.now().strftime(DATE_FORMAT)
 
 
+def _fingerprint(principal: str, owner_account_id: str, subscription_type: SubType, target: str, tables: list,
+                 request_grants: list) -> str:
+    '''
+    Generates a deterministic fingerprint for a subscription request, so that the same request always maps to the same
+    key regardless of the order in which tables or grants were supplied
+    '''
+    value = json.dumps([principal, owner_account_id, subscription_type.name, target,
+                        sorted(utils.ensure_list(tables)), sorted(utils.ensure_list(request_grants))])
+
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
 class SubscriberTracker:
     _data_mesh_account_id = None
-    _dynamo_client = None
-    _dynamo_resource = None
-    _glue_client = None
-    _sts_client = None
-    _table_info = None
-    _table = None
+    _session = None
+    _clients = None
+    _client_lock = None
+    _store = None
     _logger = None
     _region = None
-
-    def __init__(self, credentials, data_mesh_account_id: str, region_name: str, log_level: str = "INFO"):
+    _cache = None
+    _credentials = None
+    _identity = None
+    _identity_key = None
+    _identity_lock = None
+    _identity_local = False
+    _sts_calls = 0
+    _sts_calls_saved = 0
+    _retention_days = None
+    _metrics = None
+
+    def __init__(self, credentials, data_mesh_account_id: str, region_name: str, log_level: str = "INFO",
+                 cache_size: int = 0, cache_ttl_seconds: int = 60, lazy_init: bool = False,
+                 store: SubscriptionStore = None, retention_days: int = SUBSCRIPTION_RETENTION_DAYS,
+                 metrics: MetricsRegistry = None):
         '''
         Initialize a subscriber tracker. Requires the external creation of clients because we will span roles
         :param dynamo_client:
         :param dynamo_resource:
         :param log_level:
+        :param cache_size: Number of subscriptions to hold in an in-process read cache. 0 disables the cache
+        :param cache_ttl_seconds: Number of seconds a cached subscription may be served for
+        :param lazy_init: Skip all AWS calls at construction. Clients are built on first use, the table is only
+        described or created when it is found to be missing, and table endpoints are cached in the local state file
+        :param store: Storage engine for subscriptions, such as a SqliteSubscriptionStore. Defaults to DynamoDB. When a
+        store is supplied without credentials, no AWS calls are made and changes are attributed to the mesh account root
+        :param retention_days: Number of days that deleted and denied subscriptions are kept before they expire and
+        may be archived. None keeps them indefinitely
+        :param metrics: Registry in which to record the latency and storage cost of each operation. A registry is
+        created if not supplied, and can be read with get_metrics_registry()
         '''
         self._data_mesh_account_id = data_mesh_account_id
+        self._metrics = metrics if metrics is not None else MetricsRegistry()
+        self._retention_days = retention_days
         self._region = region_name
-        self._dynamo_client = utils.generate_client(service='dynamodb', region=region_name,
-                                                    credentials=credentials)
-        self._dynamo_resource = utils.generate_resource(service='dynamodb', region=region_name,
-                                                        credentials=credentials)
-        self._glue_client = utils.generate_client(service='glue', region=region_name,
-                                                  credentials=credentials)
-        self._iam_client = utils.generate_client(service='iam', region=region_name,
-                                                 credentials=credentials)
-        self._sts_client = utils.generate_client(service='sts', region=region_name,
-                                                 credentials=credentials)
+        self._credentials = credentials
+        self._identity_lock = threading.Lock()
+        self._client_lock = threading.Lock()
+        self._clients = {}
 
-        # validate that we are running from within the mesh
-        utils.validate_correct_account(credentials=credentials, account_id=data_mesh_account_id)
+        self._logger = logging.getLogger("SubscriberTracker")
 
-        self._table_info = self._init_table()
+        # make sure we always log to standard out
+        self._logger.addHandler(logging.StreamHandler(sys.stdout))
+        self._logger.setLevel(log_level)
 
-        _logger = logging.getLogger("SubscriberTracker")
+        if store is not None and credentials is None:
+            self._identity = {
+                'Account': data_mesh_account_id,
+                'Arn': f"arn:aws:iam::{data_mesh_account_id}:root"
+            }
+            self._identity_local = True
+            self._identity_key = utils.get_credentials_key(credentials)
+        elif lazy_init is not True:
+            # validate that we are running from within the mesh. When lazy, this happens on first use of the identity
+            self._caller_identity()
+
+        if store is not None:
+            self._store = store
+        else:
+            self._store = DynamoSubscriptionStore(credentials=credentials, data_mesh_account_id=data_mesh_account_id,
+                                                  region_name=region_name, lazy_init=lazy_init, logger=self._logger)
+        self._store.set_metrics(self._metrics)
 
-        # make sure we always log to standard out
-        _logger.addHandler(logging.StreamHandler(sys.stdout))
-        _logger.setLevel(log_level)
+        if cache_size is not None and cache_size > 0:
+            self._cache = TtlCache(max_size=cache_size, ttl_seconds=cache_ttl_seconds)
+
+    def _caller_identity(self) -> dict:
+        '''
+        Returns the caller identity for the tracker's credentials. STS is only called the first time, and again if the
+        credentials have since rotated
+        :return:
+        '''
+        credentials_key = utils.get_credentials_key(self._credentials)
+
+        with self._identity_lock:
+            if self._identity is not None and self._identity_key == credentials_key:
+                # identities made up locally never needed an STS call, so don't count as a saving
+                if self._identity_local is not True:
+                    self._sts_calls_saved += 1
+            else:
+                identity = self._get_client('sts').get_caller_identity()
+                self._sts_calls += 1
+
+                # validate that we are running from within the mesh
+                utils.validate_correct_account(credentials=self._credentials, account_id=self._data_mesh_account_id,
+                                               caller_account=identity.get('Account'))
+
+                self._identity = identity
+                self._identity_key = credentials_key
+                self._identity_local = False
+
+            return self._identity
 
     def _who_am_i(self):
-        return self._sts_client.get_caller_identity().get('Arn')
+        return self._caller_identity().get('Arn')
+
+    def get_identity_stats(self) -> dict:
+        '''
+        Returns the number of STS GetCallerIdentity calls made, and the number avoided by memoizing the identity
+        :return:
+        '''
+        return {
+            'StsCalls': self._sts_calls,
+            'StsCallsSaved': self._sts_calls_saved
+        }
 
     def _add_www(self, item: dict, new: bool = True, notes: str = None):
         '''
@@ -99,140 +272,83 @@ class SubscriberTracker:
         :param new:
         :return:
         '''
+        now = _now_millis()
         if new:
             item[CREATION_DATE] = _format_time_now()
+            item[CREATED_AT] = now
             item[CREATED_BY] = self._who_am_i()
         else:
             item[UPDATED_DATE] = _format_time_now()
             item[UPDATED_BY] = self._who_am_i()
 
+        # new subscriptions are also stamped with UpdatedAt, so that they are found by iter_subscriptions_changed_since
+        item[UPDATED_AT] = now
+
         if notes is not None:
-            item[NOTES] = notes
+            item[LATEST_NOTE] = notes
+            item[NOTE_COUNT] = 1
 
         return item
 
-    def _upd_www(self, args: dict):
-        # check that the updates haven't already been added
-        if "#upd_dt" not in list(args.get("ExpressionAttributeNames").keys()):
-            # split the update expression and extract the SET portion, which we will rewrite
-            tokens = re.split('(ADD|SET)', args.get("UpdateExpression"), flags=re.IGNORECASE)
-            set_clause = tokens[tokens.index('SET') + 1]
-
-            add_clause = None
-            if 'ADD' in tokens:
-                add_clause = tokens[tokens.index('ADD') + 1]
-
-            # add the update expression, names, and values
-            set_clause = "%s, #upd_dt = :upd_dt, #upd_by = :upd_by" % set_clause
-            args["ExpressionAttributeNames"]["#upd_dt"] = UPDATED_DATE
-            args["ExpressionAttributeNames"]["#upd_by"] = UPDATED_BY
-            args["ExpressionAttributeValues"][":upd_dt"] = _format_time_now()
-            args["ExpressionAttributeValues"][":upd_by"] = self._who_am_i()
-
-            if add_clause is not None:
-                args["UpdateExpression"] = f"SET {set_clause} ADD {add_clause}"
-            else:
-                args["UpdateExpression"] = f"SET {set_clause}"
+    def _history(self, subscription_id: str, action: str, changes: dict, note: str = None) -> dict:
+        '''
+        Builds the history record of a change to a subscription
+        :param subscription_id:
+        :param action: One of the ACTION_ values
+        :param changes: dict of the attributes set by the change
+        :param note:
+        :return:
+        '''
+        history = {
+            HISTORY_ID: _generate_id(),
+            SUBSCRIPTION_ID: subscription_id,
+            EVENT_TIME: _now_millis(),
+            EVENT_BY: self._who_am_i(),
+            ACTION: action,
+            CHANGES: {k: v for k, v in changes.items() if v is not None}
+        }
+        if note is not None:
+            history[NOTE] = note
 
-            return args
+        return history
 
-    def _init_table(self):
-        t = None
-        try:
-            response = self._dynamo_client.describe_table(
-                TableName=SUBSCRIPTIONS_TRACKER_TABLE
-            )
+    def _get_client(self, client_name: str):
+        client = self._clients.get(client_name)
 
-            t = response.get('Table')
-        except self._dynamo_client.exceptions.ResourceNotFoundException:
-            t = self._create_table()
+        if client is None:
+            # sessions are not thread safe, so build clients one at a time
+            with self._client_lock:
+                if self._session is None:
+                    self._session = utils.create_session(credentials=self._credentials, region=self._region)
 
-        self._table = self._dynamo_resource.Table(SUBSCRIPTIONS_TRACKER_TABLE)
+                client = self._clients.get(client_name)
+                if client is None:
+                    client = self._session.client(client_name)
+                    self._clients[client_name] = client
 
-        return {
-            'Table': t.get('TableArn'),
-            'Stream': t.get('LatestStreamArn')
-        }
+        return client
 
-    def subscriber_indexname(self):
-        return "%s-%s" % (SUBSCRIPTIONS_TRACKER_TABLE, 'Subscriber')
-
-    def owner_indexname(self):
-        return "%s-%s" % (SUBSCRIPTIONS_TRACKER_TABLE, 'Owner')
-
-    def _create_table(self):
-        response = self._dynamo_client.create_table(
-            TableName=SUBSCRIPTIONS_TRACKER_TABLE,
-            AttributeDefinitions=[
-                {
-                    'AttributeName': SUBSCRIPTION_ID,
-                    'AttributeType': 'S'
-                },
-                {
-                    'AttributeName': SUBSCRIBER_PRINCIPAL,
-                    'AttributeType': 'S'
-                },
-                {
-                    'AttributeName': OWNER_PRINCIPAL,
-                    'AttributeType': 'S'
-                },
-                {
-                    'AttributeName': STATUS,
-                    'AttributeType': 'S'
-                }
-            ],
-            KeySchema=[
-                {
-                    'AttributeName': SUBSCRIPTION_ID,
-                    'KeyType': 'HASH'
-                }
-            ],
-            GlobalSecondaryIndexes=[
-                {
-                    'IndexName': self.owner_indexname(),
-                    'KeySchema': [
-                        {
-                            'AttributeName': OWNER_PRINCIPAL,
-                            'KeyType': 'HASH',
-                        },
-                        {
-                            'AttributeName': STATUS,
-                            'KeyType': 'RANGE',
-                        }
-                    ],
-                    'Projection': {
-                        'ProjectionType': 'ALL'
-                    }
-                },
-                {
-                    'IndexName': self.subscriber_indexname(),
-                    'KeySchema': [
-                        {
-                            'AttributeName': SUBSCRIBER_PRINCIPAL,
-                            'KeyType': 'HASH',
-                        }
-                    ],
-                    'Projection': {
-                        'ProjectionType': 'ALL'
-                    }
-                }
-            ],
-            BillingMode='PAY_PER_REQUEST',
-            StreamSpecification={
-                'StreamEnabled': True,
-                'StreamViewType': 'NEW_AND_OLD_IMAGES'
-            },
-            Tags=[DEFAULT_TAGS]
-        )
+    def get_endpoints(self):
+        return self._store.get_endpoints()
 
-        # block until the table is ACTIVE
-        t = self._dynamo_resource.Table(SUBSCRIPTIONS_TRACKER_TABLE)
-        t.wait_until_exists()
+    def get_event_consumer(self, checkpoint_name: str = None, initial_position: str = 'TRIM_HORIZON',
+                           log_level: str = "INFO") -> SubscriptionStreamConsumer:
+        '''
+        Returns a consumer of the subscriptions table change stream, to which handlers can be registered for each type
+        of SubscriptionEvent
+        :param checkpoint_name: Name under which to persist the stream position between runs
+        :param initial_position: Where to start reading when there is no checkpoint, either TRIM_HORIZON or LATEST
+        :param log_level:
+        :return:
+        '''
+        stream_arn = self.get_endpoints().get('Stream')
+        if stream_arn is None:
+            raise Exception("Subscription store does not provide a change stream")
 
-        return response.get('TableDescription')
+        source = DynamoStreamSource(credentials=self._credentials, region_name=self._region, stream_arn=stream_arn,
+                                    initial_position=initial_position)
 
-    def get_endpoints(self):
-        return self._table_info
+        return SubscriptionStreamConsumer(source=source, checkpoint_name=checkpoint_name, log_level=log_level)
 
     def _validate_objects(self, database_name: str, tables: list, suppress_object_validation: bool = False):
         for table_name in tables:
@@ -247,9 +363,11 @@ class SubscriberTracker:
         if suppress_object_validation is True:
             return True
         else:
+            glue_client = self._get_client('glue')
+
             if table_name is not None:
                 try:
-                    response = self._glue_client.get_table(
+                    response = glue_client.get_table(
                         DatabaseName=database_name,
                         Name=table_name
                     )
@@ -259,13 +377,13 @@ class SubscriberTracker:
                     else:
                         return True
                 except (
-                        self._glue_client.exceptions.AccessDeniedException,
-                        self._glue_client.exceptions.EntityNotFoundException):
+                        glue_client.exceptions.AccessDeniedException,
+                        glue_client.exceptions.EntityNotFoundException):
                     # if we get access denied here, it's because the object doesn't exist
                     return False
             else:
                 try:
-                    response = self._glue_client.get_database(
+                    response = glue_client.get_database(
                         Name=database_name
                     )
 
@@ -274,63 +392,143 @@ class SubscriberTracker:
                     else:
                         return True
                 except (
-                        self._glue_client.exceptions.AccessDeniedException,
-                        self._glue_client.exceptions.EntityNotFoundException):
+                        glue_client.exceptions.AccessDeniedException,
+                        glue_client.exceptions.EntityNotFoundException):
                     # if we get access denied here, it's because the object doesn't exist
                     return False
 
+    def _list_table_names(self, database_name: str) -> set:
+        '''
+        Returns the names of all tables in a database with a single paginated get_tables call, or None if the database
+        isn't visible to the caller
+        :param database_name:
+        :return:
+        '''
+        glue_client = self._get_client('glue')
+
+        names = set()
+        try:
+            for page in glue_client.get_paginator('get_tables').paginate(DatabaseName=database_name):
+                names.update([t.get('Name') for t in page.get('TableList')])
+        except (
+                glue_client.exceptions.AccessDeniedException,
+                glue_client.exceptions.EntityNotFoundException):
+            return None
+
+        return names
+
+    def _validate_requests(self, requests: list) -> None:
+        # validate objects one database at a time, rather than issuing a request per table
+        by_database = {}
+        for r in requests:
+            by_database.setdefault(r.get('database_name'), set()).update(utils.ensure_list(r.get('tables')))
+
+        for database_name, tables in by_database.items():
+            existing = self._list_table_names(database_name)
+
+            if existing is None:
+                raise Exception("Database %s does not exist" % (database_name))
+
+            missing = tables - existing
+            if len(missing) > 0:
+                raise Exception("Tables %s do not exist in Database %s" % (sorted(missing), database_name))
+
+    @_measured
+    def create_subscription_requests(self, principal: str, requests: list,
+                                     suppress_object_validation: bool = False) -> list:
+        '''
+        Creates many database or table level subscription requests for a single principal. Requests are de-duplicated
+        against each other and against existing subscriptions by fingerprint, objects are validated once per database,
+        and new subscriptions are written in batches. Requests matching a deleted or denied subscription create a new
+        one
+        :param principal:
+        :param requests: list of dicts containing owner_account_id, database_name, tables and request_grants
+        :param suppress_object_validation:
+        :return: list of dicts with the Type, object and SubscriptionId for each request, in the order supplied
+        '''
+        if suppress_object_validation is not True:
+            self._validate_requests(requests)
+
+        fingerprints = []
+        new_items = {}
+        for r in requests:
+            tables = utils.ensure_list(r.get('tables'))
+            request_grants = utils.ensure_list(r.get('request_grants'))
+            subscription_type = SubType.TABLE if len(tables) > 0 else SubType.DATABASE
+            fingerprint = _fingerprint(principal=principal, owner_account_id=r.get('owner_account_id'),
+                                       subscription_type=subscription_type, target=r.get('database_name'),
+                                       tables=tables, request_grants=request_grants)
+            fingerprints.append(fingerprint)
+
+            if fingerprint not in new_items:
+                item = {
+                    SUBSCRIPTION_ID: _generate_id(),
+                    OWNER_PRINCIPAL: r.get('owner_account_id'),
+                    SUBSCRIBER_PRINCIPAL: principal,
+                    REQUESTED_GRANTS: request_grants,
+                    STATUS: STATUS_PENDING,
+                    DATABASE_NAME: r.get('database_name'),
+                    FINGERPRINT: fingerprint
+                }
+                if subscription_type == SubType.TABLE:
+                    item[TABLE_NAME] = tables
+
+                new_items[fingerprint] = self._add_www(item=item)
+
+        # requests which have been made before return the existing subscription, unless it was deleted or denied
+        histories = [self._history(subscription_id=i.get(SUBSCRIPTION_ID), action=ACTION_CREATE,
+                                   changes={STATUS: STATUS_PENDING}) for i in new_items.values()]
+        counter_deltas = [_counter_deltas(i, to_status=STATUS_PENDING) for i in new_items.values()]
+        existing = self._store.create_many(list(new_items.values()), histories=histories,
+                                           counter_deltas=counter_deltas)
+
+        out = []
+        for r, fingerprint in zip(requests, fingerprints):
+            item = new_items.get(fingerprint)
+            subscription_id = existing.get(fingerprint, item.get(SUBSCRIPTION_ID))
+            is_existing = fingerprint in existing
+
+            if item.get(TABLE_NAME) is not None:
+                out.append({"Type": SubType.TABLE.name, TABLE_NAME: item.get(TABLE_NAME),
+                            SUBSCRIPTION_ID: subscription_id, "Existing": is_existing})
+            else:
+                out.append({"Type": SubType.DATABASE.name, DATABASE_NAME: item.get(DATABASE_NAME),
+                            SUBSCRIPTION_ID: subscription_id, "Existing": is_existing})
+
+        return out
+
+    @_measured
     def create_subscription_request(self, owner_account_id: str, principal: str,
                                     request_grants: list, domain=None, data_product_name=None,
                                     database_name: str = None, tables: list = None,
                                     suppress_object_validation: bool = False) -> dict:
-        # look up if there is already a subscription request for this object
         subscription_type = None
+        target = None
         if database_name is not None:
-            filter = Attr(DATABASE_NAME).eq(database_name)
+            target = database_name
             if tables is None or tables == []:
                 subscription_type = SubType.DATABASE
             else:
                 subscription_type = SubType.TABLE
         elif data_product_name is not None:
-            filter = And(Attr(DATA_PRODUCT_TAG_KEY).eq(data_product_name))
+            target = data_product_name
             subscription_type = SubType.DATA_PRODUCT
         elif domain is not None:
-            filter = And(Attr(DOMAIN_TAG_KEY).eq(domain))
+            target = domain
             subscription_type = SubType.DOMAIN
 
-        def _sub_exists():
-            found = self._table.query(
-                IndexName=self.subscriber_indexname(),
-                Select='ALL_ATTRIBUTES',
-                ConsistentRead=False,
-                KeyConditionExpression=Key(SUBSCRIBER_PRINCIPAL).eq(principal),
-                FilterExpression=filter
-            )
-
-            for i in found.get('Items'):
-                if (subscription_type == SubType.TABLE and tables == i.get(TABLE_NAME)) and request_grants == i.get(
-                        REQUESTED_GRANTS):
-                    return i
-
-            return None
-
-        def _put_subscription(item: dict):
-            item = self._add_www(item=item)
-
-            self._table.put_item(
-                Item=item
-            )
-
-        # check if a subscription already exists
-        subscription = _sub_exists()
-
-        # create the base subscription object to be inserted into DDB
+        # create the base subscription object to be inserted into DDB. Identical requests share a fingerprint, which is
+        # used to return the existing subscription rather than creating a duplicate, unless it was deleted or denied
         item = {
-            SUBSCRIPTION_ID: _generate_id() if subscription is None else subscription.get(SUBSCRIPTION_ID),
+            SUBSCRIPTION_ID: _generate_id(),
             OWNER_PRINCIPAL: owner_account_id,
             SUBSCRIBER_PRINCIPAL: principal,
             REQUESTED_GRANTS: request_grants,
-            STATUS: STATUS_PENDING if subscription is None else subscription.get(STATUS)
+            STATUS: STATUS_PENDING,
+            FINGERPRINT: _fingerprint(principal=principal, owner_account_id=owner_account_id,
+                                      subscription_type=subscription_type, target=target,
+                                      tables=tables if subscription_type == SubType.TABLE else None,
+                                      request_grants=request_grants)
         }
 
         sub_type = ()
@@ -366,211 +564,601 @@ class SubscriberTracker:
         else:
             # create a data product level subscription
             item[DATA_PRODUCT_TAG_KEY] = data_product_name
-            _put_subscription(item=item, principal=principal)
             sub_type = DATA_PRODUCT_TAG_KEY, data_product_name
 
-        _put_subscription(item=item)
+        history = self._history(subscription_id=item.get(SUBSCRIPTION_ID), action=ACTION_CREATE,
+                                changes={STATUS: STATUS_PENDING})
+        item[SUBSCRIPTION_ID], _ = self._store.create(self._add_www(item=item), history=history,
+                                                      counter_deltas=_counter_deltas(item, to_status=STATUS_PENDING))
+        self._invalidate(item.get(SUBSCRIPTION_ID))
+
         return _return()
 
-    def get_subscription(self, subscription_id: str, force: bool = False) -> dict:
-        args = {
-            "Key": {
-                SUBSCRIPTION_ID: subscription_id
-            },
-            "ConsistentRead": True
-        }
+    def _invalidate(self, subscription_id: str) -> None:
+        if self._cache is not None:
+            self._cache.invalidate(subscription_id)
 
-        item = self._table.get_item(**args)
+    def get_metrics_registry(self) -> MetricsRegistry:
+        '''
+        Returns the registry of per operation metrics, which can be rendered with to_json() or to_prometheus()
+        '''
+        return self._metrics
+
+    def get_operation_metrics(self) -> dict:
+        '''
+        Returns the calls, latency, storage requests, consumed capacity and item counts of each operation
+        '''
+        return self._metrics.to_dict()
+
+    def get_cache_stats(self) -> dict:
+        '''
+        Returns the hit, miss and eviction counters of the subscription cache, or None if caching is disabled
+        :return:
+        '''
+        return None if self._cache is None else self._cache.get_stats()
+
+    @_measured
+    def get_subscription(self, subscription_id: str, force: bool = False, consistent_read: bool = True) -> dict:
+        '''
+        Fetch a single subscription. Strongly consistent reads always go to the store and refresh the cache, while
+        eventually consistent reads are served from the cache where possible
+        :param subscription_id:
+        :param force: Return the subscription even if it has been deleted
+        :param consistent_read:
+        :return:
+        '''
+        i = None
+        if consistent_read is False and self._cache is not None:
+            i = self._cache.get(subscription_id)
+
+        if i is None:
+            i = self._store.get(subscription_id=subscription_id, consistent_read=consistent_read)
+
+            if i is not None and self._cache is not None:
+                self._cache.put(subscription_id, i)
 
-        i = item.get("Item")
         if i is None:
             return None
         else:
             if i.get(STATUS) != STATUS_DELETED or force:
                 return i
 
-    def _arg_builder(self, key: str, value):
-        if value is not None:
-            if isinstance(value, str):
-                return Attr(key).eq(value)
-            elif isinstance(value, list):
-                # for this use case, lists are OR'ed together
-                k = Attr(key)
+    @_measured
+    def get_subscriptions(self, subscription_ids: list, force: bool = False, consistent_read: bool = True,
+                          max_workers: int = 4) -> dict:
+        '''
+        Fetch many subscriptions at once. With DynamoDB, keys are split into BatchGetItem requests of 100 which are
+        run concurrently, and any UnprocessedKeys are retried with exponential backoff
+        :param subscription_ids:
+        :param force: Include subscriptions which have been deleted
+        :param consistent_read:
+        :param max_workers: Number of batch requests to run in parallel
+        :return: dict of subscription ID to subscription. IDs which don't exist are not included
+        '''
+        found = {}
+        to_fetch = []
+        for subscription_id in dict.fromkeys(utils.ensure_list(subscription_ids)):
+            cached = None
+            if consistent_read is False and self._cache is not None:
+                cached = self._cache.get(subscription_id)
+
+            if cached is not None:
+                found[subscription_id] = cached
+            else:
+                to_fetch.append(subscription_id)
 
-                # add the first value from the list
-                or_clause = Or(k.eq(value[0]), k.eq(value[1]))
+        for i in self._store.get_many(subscription_ids=to_fetch, consistent_read=consistent_read,
+                                      max_workers=max_workers):
+            found[i.get(SUBSCRIPTION_ID)] = i
 
-                def _or_closure(value):
-                    return Or(or_clause, k.eq(value))
+            if self._cache is not None:
+                self._cache.put(i.get(SUBSCRIPTION_ID), i)
 
-                for v in value[2:]:
-                    _or_closure(v)
+        return {k: v for k, v in found.items() if v.get(STATUS) != STATUS_DELETED or force}
 
-                return or_clause
-        else:
-            return None
+    @_measured
+    def get_subscription_history(self, subscription_id: str, start_token: dict = None, page_size: int = None) -> dict:
+        '''
+        Returns the history of a subscription, oldest first: its creation, each status transition and grant change,
+        and the notes recorded with them
+        :param subscription_id:
+        :param start_token: LastEvaluatedKey returned by a previous call, from which to continue
+        :param page_size: Maximum number of history records to return
+        :return: dict of History, and LastEvaluatedKey if there are more records
+        '''
+        records, next_token = self._store.get_history(subscription_id=subscription_id, start_token=start_token,
+                                                      page_size=page_size)
 
-    def _build_filter_expression(self, args: dict):
-        filter = None
+        out = {
+            'History': records
+        }
+        if next_token is not None:
+            out['LastEvaluatedKey'] = next_token
 
-        for arg in args.items():
-            if arg[1] is not None:
-                if filter is None:
-                    filter = Attr(arg[0]).eq(arg[1])
-                else:
-                    filter = And(filter, Attr(arg[0]).eq(arg[1]))
+        return out
 
-        # add the deleted filter
-        filter = And(filter, Attr(STATUS).ne(STATUS_DELETED))
+    @_measured
+    def get_subscription_counts(self, owner_id: str = None, principal_id: str = None,
+                                database_name: str = None) -> dict:
+        '''
+        Returns the number of subscriptions in each Status for an owner, a subscriber, or a database, from a single
+        counter read. Expired subscriptions are no longer counted once archived, but subscriptions removed by DynamoDB
+        Time to Live before being archived remain counted until rebuild_subscription_counts() is run
+        :param owner_id:
+        :param principal_id:
+        :param database_name:
+        :return: dict of Status to count
+        '''
+        supplied = [(a, v) for a, v in [(OWNER_PRINCIPAL, owner_id), (SUBSCRIBER_PRINCIPAL, principal_id),
+                                         (DATABASE_NAME, database_name)] if v is not None]
+        if len(supplied) != 1:
+            raise Exception("Exactly one of owner_id, principal_id or database_name must be supplied")
+
+        counts = {s: 0 for s in [STATUS_PENDING, STATUS_ACTIVE, STATUS_DENIED, STATUS_DELETED]}
+        counts.update(self._store.get_counts(_counter_id(supplied[0][0], supplied[0][1])))
+
+        return counts
+
+    @_measured
+    def rebuild_subscription_counts(self, total_segments: int = 4, workers: int = None) -> int:
+        '''
+        Recalculates every subscription counter from a parallel scan of the store, for use after counters were
+        introduced or after subscriptions have been removed by Time to Live. Counters with no remaining subscriptions
+        are reset to zero. Status changes made while the rebuild runs may not be reflected, so it should be run while
+        the mesh is quiet
+        :param total_segments:
+        :param workers:
+        :return: The number of counters written
+        '''
+        totals = {}
+        for item in self.export_all(total_segments=total_segments, workers=workers):
+            for counter_id, deltas in (_counter_deltas(item, to_status=item.get(STATUS)) or {}).items():
+                counter = totals.setdefault(counter_id, {})
+                for status, delta in deltas.items():
+                    counter[status] = counter.get(status, 0) + delta
+
+        # owners, subscribers and databases whose subscriptions have all been removed appear in no scanned item
+        for counter_id in self._store.list_counter_ids():
+            if counter_id not in totals:
+                totals[counter_id] = {s: 0 for s in [STATUS_PENDING, STATUS_ACTIVE, STATUS_DENIED, STATUS_DELETED]}
+
+        for counter_id, counts in totals.items():
+            self._store.set_counts(counter_id, counts)
+
+        return len(totals)
+
+    def _list_filters(self, owner_id: str = None, principal_id: str = None, database_name: str = None,
+                      tables: list = None, includes_grants: list = None, request_status: str = None) -> dict:
+        return {
+            OWNER_PRINCIPAL: owner_id,
+            SUBSCRIBER_PRINCIPAL: principal_id,
+            DATABASE_NAME: database_name,
+            TABLE_NAME: tables,
+            REQUESTED_GRANTS: includes_grants,
+            STATUS: request_status
+        }
 
-        return filter
+    @_measured
+    def explain(self, owner_id: str = None, principal_id: str = None, database_name: str = None,
+                tables: list = None, includes_grants: list = None, request_status: str = None) -> dict:
+        '''
+        Reports how list_subscriptions would satisfy the supplied filters, including the index used and, for
+        DynamoDB, an estimate of the read units consumed
+        :return:
+        '''
+        return self._store.explain(self._list_filters(owner_id=owner_id, principal_id=principal_id,
+                                                      database_name=database_name, tables=tables,
+                                                      includes_grants=includes_grants, request_status=request_status))
 
+    @_measured
     def list_subscriptions(self, owner_id: str = None, principal_id: str = None, database_name: str = None,
                            tables: list = None, includes_grants: list = None, request_status: str = None,
-                           start_token: str = None) -> dict:
-        args = {}
-
-        def _add_arg(key: str, value):
-            if value is not None:
-                args[key] = value
-
-        _add_arg("TableName", SUBSCRIPTIONS_TRACKER_TABLE)
-        _add_arg("ExclusiveStartKey", start_token)
-
-        if principal_id is not None:
-            _add_arg("IndexName", self.subscriber_indexname())
-            _add_arg("KeyConditionExpression", Key(SUBSCRIBER_PRINCIPAL).eq(principal_id))
-            _add_arg("Select", "ALL_PROJECTED_ATTRIBUTES")
-            _add_arg("FilterExpression", Attr(STATUS).ne(STATUS_DELETED))
-
-            response = self._table.query(**args)
-            return self._format_list_response(response)
-        elif owner_id is not None and request_status is not None:
-            _add_arg("IndexName", self.owner_indexname())
-            key_condition = And(Key(OWNER_PRINCIPAL).eq(owner_id), Key(STATUS).eq(request_status))
-            _add_arg("KeyConditionExpression", key_condition)
-            _add_arg("Select", "ALL_PROJECTED_ATTRIBUTES")
-
-            response = self._table.query(**args)
-            return self._format_list_response(response)
+                           start_token: dict = None, page_size: int = None) -> dict:
+        '''
+        Returns a single page of subscriptions matching the supplied filters. If more results are available, the
+        response includes a LastEvaluatedKey which can be supplied as the start_token of the next call
+        :param page_size: Maximum number of items to evaluate for this page
+        :return:
+        '''
+        filters = self._list_filters(owner_id=owner_id, principal_id=principal_id, database_name=database_name,
+                                     tables=tables, includes_grants=includes_grants, request_status=request_status)
+
+        # deleted subscriptions are hidden unless a specific status has been requested
+        items, next_token = self._store.query(filters=filters, exclude_deleted=request_status is None,
+                                              start_token=start_token, page_size=page_size)
+
+        return self._format_list_response(items, next_token)
+
+    @_measured
+    def iter_subscriptions(self, owner_id: str = None, principal_id: str = None, database_name: str = None,
+                           tables: list = None, includes_grants: list = None, request_status: str = None,
+                           page_size: int = None, limit: int = None):
+        '''
+        Generator which yields all subscriptions matching the supplied filters, lazily following LastEvaluatedKey
+        so that only one page is held in memory at a time. Stopping iteration early avoids reading further pages.
+        :param page_size: Maximum number of items to evaluate per request
+        :param limit: Maximum number of subscriptions to yield in total
+        :return:
+        '''
+        filters = self._list_filters(owner_id=owner_id, principal_id=principal_id, database_name=database_name,
+                                     tables=tables, includes_grants=includes_grants, request_status=request_status)
+
+        query = functools.partial(self._store.query, filters=filters, exclude_deleted=request_status is None)
+        for i in self._iter_items(query, page_size=page_size, limit=limit):
+            yield self._format_item(i)
+
+    def _iter_items(self, query, page_size: int = None, limit: int = None, start_token: dict = None,
+                    position: dict = None):
+        '''
+        Generator over the raw items returned by a paginated store query
+        :param query: Function of start_token and page_size returning a page of items and the token for the next page
+        :param page_size:
+        :param limit:
+        :param start_token:
+        :param position: dict whose StartToken is kept at the token of the next unread page. Requests then never ask for
+        more than the remaining limit, so that reaching the limit always ends a page and no item is skipped on resuming
+        :return:
+        '''
+        yielded = 0
+        while True:
+            request_size = page_size
+            if position is not None and limit is not None:
+                request_size = limit - yielded if page_size is None else min(int(page_size), limit - yielded)
+
+            items, start_token = query(start_token=start_token, page_size=request_size)
+            if position is not None:
+                position['StartToken'] = start_token
+
+            for i in items:
+                if limit is not None and yielded >= limit:
+                    return
+
+                yield i
+                yielded += 1
+
+            if start_token is None or (limit is not None and yielded >= limit):
+                return
+
+    def _changed_since_query(self, since: int, owner_id: str = None, principal_id: str = None):
+        if (owner_id is None) == (principal_id is None):
+            raise Exception("Exactly one of owner_id or principal_id must be supplied")
+
+        if owner_id is not None:
+            principal_attribute, principal = OWNER_PRINCIPAL, owner_id
+        else:
+            principal_attribute, principal = SUBSCRIBER_PRINCIPAL, principal_id
+
+        return functools.partial(self._store.query_updated_since, principal_attribute=principal_attribute,
+                                 principal=principal, since=int(since))
+
+    @_measured
+    def iter_subscriptions_changed_since(self, since: int, owner_id: str = None, principal_id: str = None,
+                                         page_size: int = None, limit: int = None):
+        '''
+        Generator which yields the subscriptions of an owner or subscriber which were created or updated at or after a
+        point in time, including deleted subscriptions. Incremental sync jobs should use
+        list_subscriptions_changed_since, whose watermark resumes exactly where the previous sync stopped
+        :param since: UTC epoch milliseconds
+        :param owner_id: Owner whose subscriptions are returned. Exactly one of owner_id or principal_id is required
+        :param principal_id: Subscriber whose subscriptions are returned
+        :param page_size: Maximum number of items to evaluate per request
+        :param limit: Maximum number of subscriptions to yield in total
+        :return:
+        '''
+        # Status is kept, so that sync jobs can tell which subscriptions have been deleted or denied
+        query = self._changed_since_query(since=since, owner_id=owner_id, principal_id=principal_id)
+        yield from self._iter_items(query, page_size=page_size, limit=limit)
+
+    @_measured
+    def list_subscriptions_changed_since(self, watermark, owner_id: str = None, principal_id: str = None,
+                                         page_size: int = None, limit: int = None) -> dict:
+        '''
+        Returns the subscriptions of an owner or subscriber which were created or updated since a watermark, including
+        deleted subscriptions, with the Watermark to pass to the next call. Watermarks are opaque. A call which stops
+        at its limit records where it stopped, and a call which finishes records the latest UpdatedAt it saw and the
+        subscriptions changed at that time, so that subscriptions sharing an UpdatedAt, or read before their index is
+        ACTIVE and so in no particular order, are never skipped
+        :param watermark: Watermark returned by a previous call, or UTC epoch milliseconds for the first call
+        :param owner_id: Owner whose subscriptions are returned. Exactly one of owner_id or principal_id is required
+        :param principal_id: Subscriber whose subscriptions are returned
+        :param page_size: Maximum number of items to evaluate per request
+        :param limit: Maximum number of subscriptions to read in this call
+        :return: dict of Subscriptions and Watermark
+        '''
+        state = _decode_watermark(watermark)
+        since = state.get('Since')
+        seen = set(state.get('Seen'))
+
+        # the latest UpdatedAt read by this sync so far, and the subscriptions changed at that time
+        latest = state.get('Latest', since)
+        latest_seen = set(state.get('LatestSeen', state.get('Seen')))
+
+        position = {}
+        changed = []
+        query = self._changed_since_query(since=since, owner_id=owner_id, principal_id=principal_id)
+        for i in self._iter_items(query, page_size=page_size, limit=limit, start_token=state.get('StartToken'),
+                                  position=position):
+            updated_at = int(i.get(UPDATED_AT))
+
+            # subscriptions changed at the watermark time which were returned by the previous sync
+            if updated_at == since and i.get(SUBSCRIPTION_ID) in seen:
+                continue
+
+            changed.append(i)
+            if updated_at > latest:
+                latest = updated_at
+                latest_seen = set()
+            if updated_at == latest:
+                latest_seen.add(i.get(SUBSCRIPTION_ID))
+
+        if position.get('StartToken') is not None:
+            # continue the same sync from the next unread page
+            next_state = {'Since': since, 'Seen': sorted(seen), 'StartToken': position.get('StartToken'),
+                          'Latest': latest, 'LatestSeen': sorted(latest_seen)}
         else:
-            # build the filter expression
-            filter_expression = self._build_filter_expression(
-                {
-                    OWNER_PRINCIPAL: owner_id,
-                    SUBSCRIBER_PRINCIPAL: principal_id,
-                    DATABASE_NAME: database_name,
-                    TABLE_NAME: tables,
-                    REQUESTED_GRANTS: includes_grants
-                })
-            _add_arg("FilterExpression", filter_expression)
-
-            response = self._table.scan(**args)
-            return self._format_list_response(response)
-
-    def _format_list_response(self, response) -> dict:
-        response_items = []
+            next_state = {'Since': latest, 'Seen': sorted(latest_seen)}
+
+        return {'Subscriptions': changed, 'Watermark': _encode_watermark(next_state)}
+
+    def _parallel_scan(self, scan, total_segments: int, workers: int = None):
+        '''
+        Generator which runs a segmented scan on a thread pool, yielding pages from every segment as a single merged
+        stream. Closing the generator early stops the remaining segments.
+        :param scan: Function of (segment, total_segments, start_token) returning a page and the next start token
+        :param total_segments: Number of segments to divide the store into
+        :param workers: Number of segments to scan at the same time. Defaults to total_segments
+        :return:
+        '''
+        total_segments = int(total_segments)
+        if total_segments < 1 or total_segments > MAX_SCAN_SEGMENTS:
+            raise Exception(f"Total Segments must be between 1 and {MAX_SCAN_SEGMENTS}")
+        workers = total_segments if workers is None else max(1, int(workers))
+
+        pages = queue.Queue(maxsize=EXPORT_QUEUE_PAGES * workers)
+        stop = threading.Event()
+        finished = object()
+
+        def _put(value) -> bool:
+            # block while the consumer is behind, but give up if the scan has been stopped
+            while not stop.is_set():
+                try:
+                    pages.put(value, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
 
+            return False
+
+        # requests made by the pool are attributed to the caller's operation
+        operation = self._metrics.current_operation()
+
+        def _scan_segment(segment: int) -> None:
+            start_token = None
+
+            try:
+                while not stop.is_set():
+                    with self._metrics.attribute(operation):
+                        page, start_token = scan(segment, total_segments, start_token)
+                    if not _put(page):
+                        return
+
+                    if start_token is None:
+                        break
+            except Exception as e:
+                _put(e)
+            finally:
+                _put(finished)
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        for segment in range(total_segments):
+            executor.submit(_scan_segment, segment)
+
+        try:
+            remaining = total_segments
+            while remaining > 0:
+                value = pages.get()
+
+                if value is finished:
+                    remaining -= 1
+                elif isinstance(value, Exception):
+                    raise value
+                else:
+                    yield value
+        finally:
+            stop.set()
+            executor.shutdown(wait=True)
+
+    @_measured
+    def export_all(self, total_segments: int = 4, workers: int = None, output_path: str = None,
+                   include_deleted: bool = True):
+        '''
+        Generator which yields every subscription using a parallel scan of the store. The table is split into
+        total_segments which are scanned concurrently on a thread pool, and items are yielded as a single merged stream
+        in no particular order. Closing the generator early stops the remaining segments.
+        :param total_segments: Number of segments to divide the table into
+        :param workers: Number of segments to scan at the same time. Defaults to total_segments
+        :param output_path: Optional file to which each item is also written as newline delimited JSON
+        :param include_deleted: Whether to include deleted subscriptions
+        :return:
+        '''
+
+        def _scan(segment: int, segments: int, start_token: dict) -> tuple:
+            return self._store.scan_segment(segment=segment, total_segments=segments, start_token=start_token)
+
+        output = open(output_path, 'w') if output_path is not None else None
+        try:
+            for page in self._parallel_scan(scan=_scan, total_segments=total_segments, workers=workers):
+                for i in page:
+                    if include_deleted is True or i.get(STATUS) != STATUS_DELETED:
+                        if output is not None:
+                            output.write(json.dumps(i, default=utils.dynamo_json_default))
+                            output.write('\n')
+
+                        yield i
+        finally:
+            if output is not None:
+                output.close()
+
+    def enable_expiry(self) -> bool:
+        '''
+        Configures the store to remove expired subscriptions automatically, which for DynamoDB enables Time to Live on
+        the ExpiresAt attribute
+        :return: True if expiry was enabled by this call
+        '''
+        return self._store.enable_expiry()
+
+    @_measured
+    def archive_expired(self, output_path: str, total_segments: int = 4, workers: int = None,
+                        before: int = None) -> dict:
+        '''
+        Moves deleted and denied subscriptions whose retention period has passed out of the store, into a gzip
+        compressed newline delimited JSON archive. Only subscriptions which have been removed are written to the archive,
+        a page at a time, so subscriptions reactivated since they were read are kept in the store, left out of the
+        archive and counted as skipped. Subscriptions which DynamoDB has already removed through Time to Live can be archived from the change stream with SubscriptionArchive.handle_event.
+        :param output_path: Archive file, which is appended to if it already exists
+        :param total_segments: Number of segments to divide the store into
+        :param workers: Number of segments to scan at the same time. Defaults to total_segments
+        :param before: Archive subscriptions which expire at or before this time, in UTC epoch seconds. Defaults to now
+        :return: dict of the number of subscriptions archived, and skipped because they were reactivated
+        '''
+        before = int(time.time()) if before is None else int(before)
+
+        def _scan(segment: int, segments: int, start_token: dict) -> tuple:
+            return self._store.scan_expired(before=before, segment=segment, total_segments=segments,
+                                            start_token=start_token)
+
+        archived = 0
+        skipped = 0
+        with SubscriptionArchive(output_path) as archive:
+            for page in self._parallel_scan(scan=_scan, total_segments=total_segments, workers=workers):
+                removed = []
+                for i in page:
+                    if self._store.delete_expired(item=i, before=before,
+                                                  counter_deltas=_counter_deltas(i, from_status=i.get(STATUS))):
+                        self._invalidate(i.get(SUBSCRIPTION_ID))
+                        removed.append(i)
+                    else:
+                        skipped += 1
+
+                if len(removed) > 0:
+                    archive.write(removed)
+                    archived += len(removed)
+
+        self._logger.info(f"Archived {archived} expired Subscriptions to {output_path}")
+
+        return {
+            'Archived': archived,
+            'Skipped': skipped,
+            'Path': output_path
+        }
+
+    def _format_item(self, item: dict) -> dict:
         # filter out values not relevant to the requestor
-        for i in response.get('Items'):
-            del i[STATUS]
-            del i[OWNER_PRINCIPAL]
+        item.pop(STATUS, None)
+        item.pop(OWNER_PRINCIPAL, None)
 
-            response_items.append(i)
+        return item
+
+    def _format_list_response(self, items: list, next_token: dict) -> dict:
         out = {
-            'Subscriptions': response_items
+            'Subscriptions': [self._format_item(i) for i in items]
         }
-        lek = 'LastEvaluatedKey'
-        if lek in response:
-            out[lek] = response.get(lek)
+        if next_token is not None:
+            out['LastEvaluatedKey'] = next_token
 
         return out
 
-    def _handle_update(self, args: dict):
-        ist = "Invalid State Transition"
+    def _handle_update(self, subscription_id: str, action: str, set_values: dict, add_values: dict = None,
+                       expected_status: list = None, remove_attributes: list = None, notes: str = None,
+                       counter_deltas: dict = None, retry_transition=None) -> dict:
+        '''
+        Applies an update to a subscription in a single request, returning the values set by the update. Values which
+        are added to, such as NoteCount, are not returned.
+        Updates to subscriptions which don't exist, or are not in an expected Status, raise an Exception which includes
+        the current Status. A history record of the change and its notes is written with the update, and the
+        subscription itself only keeps the latest note
+        :param retry_transition: Function given the subscription as found by an update which was not applied, returning
+        the expected Status and counter deltas to retry the update with once, or None if it shouldn't be retried
+        :return:
+        '''
+        history = self._history(subscription_id=subscription_id, action=action, changes=set_values, note=notes)
 
-        # add the consumed capacity metric which allows us to check if the update worked
-        if "ReturnConsumedCapacity" not in args:
-            args["ReturnConsumedCapacity"] = 'TOTAL'
+        if notes is not None:
+            set_values[LATEST_NOTE] = notes
+            add_values = dict(add_values or {}, **{NOTE_COUNT: 1})
 
         # add who information
-        args = self._upd_www(args)
-
-        try:
-            response = self._table.update_item(**args)
-
-            if response is None or response.get('ConsumedCapacity') is None or response.get('ConsumedCapacity').get(
-                    'CapacityUnits') == 0:
-                raise Exception(ist)
+        set_values[UPDATED_DATE] = _format_time_now()
+        set_values[UPDATED_AT] = _now_millis()
+        set_values[UPDATED_BY] = self._who_am_i()
+
+        # any cached copy is stale whether or not the update is applied
+        self._invalidate(subscription_id)
+
+        # stores report the subscription as found by an update which wasn't applied, where they can do so without a read
+        found = {}
+
+        def _update(update_status: list, update_counter_deltas: dict) -> dict:
+            found.clear()
+            return self._store.update(subscription_id=subscription_id, set_values=set_values, add_values=add_values,
+                                      expected_status=update_status, remove_attributes=remove_attributes,
+                                      history=history, counter_deltas=update_counter_deltas,
+                                      on_condition_failure=lambda item: found.update({'Item': item}))
+
+        updated = _update(expected_status, counter_deltas)
+        if updated is None and retry_transition is not None and found.get('Item') is not None:
+            retry = retry_transition(found.get('Item'))
+            if retry is not None:
+                updated = _update(*retry)
+
+        if updated is None:
+            # only failed transitions which the store couldn't report pay for a read, to tell the caller what state the
+            # subscription is really in
+            if 'Item' in found:
+                current = found.get('Item')
             else:
-                return True
-        except Exception as e:
-            if 'ConditionalCheckFailedException' in str(e):
-                pass
+                current = self.get_subscription(subscription_id=subscription_id, force=True)
+            if current is None:
+                raise Exception(f"Subscription {subscription_id} not found")
             else:
-                raise e
+                raise Exception(
+                    f"Invalid State Transition for Subscription {subscription_id} (current Status {current.get(STATUS)})")
+
+        return updated
 
-    def delete_subscription(self, subscription_id: str, reason: str):
+    @_measured
+    def delete_subscription(self, subscription_id: str, reason: str, subscription: dict = None):
         self.update_status(
             subscription_id=subscription_id, status=STATUS_DELETED,
-            notes=reason
+            notes=reason, subscription=subscription
         )
 
+    @_measured
     def update_grants(self, subscription_id: str, permitted_grants: list, notes: str, grantable_grants: list = None):
-        set_expressions = [
-            "#permitted = :permitted"
-        ]
-        expression_attribute_names = {
-            "#permitted": PERMITTED_GRANTS,
-            "#notes": NOTES
-        }
-        expression_attribute_values = {
-            ":permitted": permitted_grants,
-            ":notes": {notes}
+        set_values = {
+            PERMITTED_GRANTS: permitted_grants
         }
 
         if grantable_grants is not None:
-            set_expressions.append("#grantable = :grantable")
-            expression_attribute_names["#grantable"] = GRANTABLE_GRANTS
-            expression_attribute_values[":grantable"] = grantable_grants
-
-        args = {
-            "Key": {
-                SUBSCRIPTION_ID: subscription_id
-            },
-            "UpdateExpression": f"SET {','.join(set_expressions)} ADD #notes :notes",
-            "ExpressionAttributeNames": expression_attribute_names,
-            "ExpressionAttributeValues": expression_attribute_values
-        }
+            set_values[GRANTABLE_GRANTS] = grantable_grants
 
-        return self._handle_update(args)
+        return self._handle_update(subscription_id=subscription_id, action=ACTION_UPDATE_GRANTS, set_values=set_values,
+                                   notes=notes)
 
+    @_measured
     def mark_subscription_as_imported(self, subscription_id: str):
         current_sub = self.get_subscription(subscription_id=subscription_id)
 
         if current_sub.get(STATUS) != STATUS_ACTIVE:
             raise Exception("Subscription must be Active to import")
         else:
-            update_expression = "SET #imported = :imported"
-            expression_attribute_names = {
-                "#imported": "ImportedToConsumer"
-            }
-            expression_attribute_values = {
-                ":imported": True
-            }
-            args = {
-                "Key": {
-                    SUBSCRIPTION_ID: subscription_id
-                },
-                "UpdateExpression": update_expression,
-                "ExpressionAttributeNames": expression_attribute_names,
-                "ExpressionAttributeValues": expression_attribute_values
-            }
-
-            return self._handle_update(args)
+            return self._handle_update(subscription_id=subscription_id, action=ACTION_IMPORT,
+                                       set_values={"ImportedToConsumer": True})
 
+    @_measured
     def update_status(self, subscription_id: str, status: str, table_arns: list = None, permitted_grants: list = None,
-                      grantable_grants: list = None, notes: str = None, ram_shares: dict = None):
+                      grantable_grants: list = None, notes: str = None, ram_shares: dict = None,
+                      subscription: dict = None):
         '''
         Updates the status of a subscription. Valid transitions are:
         PENDING->ACTIVE
@@ -580,71 +1168,76 @@ class SubscriberTracker:
         DELETED->ACTIVE
         DELETED->PENDING
 
+        Any other transition raises an Exception including the current Status of the subscription. Subscription counts
+        are moved from the current to the new Status in the same transaction as the update.
+
         :param subscription_id:
         :param status:
-        :return:
+        :param subscription: The subscription if the caller has already loaded it, which saves reading it again to find
+        the counters to move
+        :return: The attributes set by the transition, which include PermittedGrants
         '''
         # build the map of proposed status to allowed status
-        status_attr = Attr(STATUS)
         expected = None
         if status == STATUS_ACTIVE:
-            expected = Or(Or(Or(status_attr.eq(STATUS_PENDING), status_attr.eq(STATUS_DENIED)),
-                             status_attr.eq(STATUS_DELETED)), status_attr.eq(STATUS_ACTIVE))
+            expected = [STATUS_PENDING, STATUS_DENIED, STATUS_DELETED, STATUS_ACTIVE]
         elif status == STATUS_DENIED:
-            expected = status_attr.eq(STATUS_PENDING)
+            expected = [STATUS_PENDING]
         elif status == STATUS_DELETED:
-            expected = status_attr.eq(STATUS_ACTIVE)
+            expected = [STATUS_ACTIVE]
         elif status == STATUS_PENDING:
-            expected = status_attr.eq(STATUS_DELETED)
-
-        set_expressions = [
-            "#status = :status",
-            "#permitted = :permitted",
-            "#table_arns = :table_arns",
-            "#grantable = :grantable",
-        ]
-
-        expression_attribute_names = {
-            "#status": STATUS,
-            "#permitted": PERMITTED_GRANTS,
-            "#grantable": GRANTABLE_GRANTS,
-            "#table_arns": TABLE_ARNS
-        }
-        expression_attribute_values = {
-            ":status": status,
-            ":table_arns": table_arns,
-            ":grantable": grantable_grants
+            expected = [STATUS_DELETED]
+
+        # counted attributes never change, so any copy of the subscription identifies its counters. Only read it if
+        # neither the caller nor the cache has one
+        current = subscription
+        if current is None and self._cache is not None:
+            current = self._cache.get(subscription_id)
+        if current is None:
+            with self._metrics.attribute(f"{self.update_status.__name__}.pre_read"):
+                current = self._store.get(subscription_id)
+            if current is None:
+                raise Exception(f"Subscription {subscription_id} not found")
+
+        # counts can only be moved knowing the Status being left, so the update is conditional on the Status of the copy
+        # we hold, which is almost always still current
+        from_status = current.get(STATUS)
+        if expected is not None and from_status not in expected and len(expected) == 1:
+            from_status = expected[0]
+
+        def _retry_transition(found: dict):
+            # the copy we hold was stale, so retry once from the Status which the failed update found
+            if found.get(STATUS) == from_status or (expected is not None and found.get(STATUS) not in expected):
+                return None
+            else:
+                return [found.get(STATUS)], _counter_deltas(found, found.get(STATUS), status)
+
+        set_values = {
+            STATUS: status,
+            TABLE_ARNS: table_arns,
+            GRANTABLE_GRANTS: grantable_grants
         }
 
-        # add the permitted grants if they are provided
+        # add the permitted grants if they are provided. Otherwise they are whatever was requested, which never changes
+        # once created, so are set from the copy we hold
         if permitted_grants is not None and len(permitted_grants) > 0:
-            expression_attribute_values[":permitted"] = permitted_grants
-        else:
-            # permitted grants will be set to whatever was previously requested
-            current_sub = self.get_subscription(subscription_id=subscription_id)
-            expression_attribute_values[":permitted"] = current_sub.get(REQUESTED_GRANTS)
+            set_values[PERMITTED_GRANTS] = permitted_grants
+        elif current.get(REQUESTED_GRANTS) is not None:
+            set_values[PERMITTED_GRANTS] = current.get(REQUESTED_GRANTS)
 
         if ram_shares is not None:
-            set_expressions.append("#ram = :ram")
-            expression_attribute_names["#ram"] = RAM_SHARES
-            expression_attribute_values[":ram"] = ram_shares
+            set_values[RAM_SHARES] = ram_shares
 
-        # add the notes field as a set if we got any
-        add_clause = ""
-        if notes is not None:
-            add_clause = "ADD #notes :notes"
-            expression_attribute_names["#notes"] = NOTES
-            expression_attribute_values[":notes"] = {notes}
-
-        update_expression = f"SET {','.join(set_expressions)} {add_clause}".strip()
-        args = {
-            "Key": {
-                SUBSCRIPTION_ID: subscription_id
-            },
-            "UpdateExpression": update_expression,
-            "ExpressionAttributeNames": expression_attribute_names,
-            "ExpressionAttributeValues": expression_attribute_values,
-            "ConditionExpression": expected
-        }
+        # deleted and denied subscriptions expire after the retention period, unless they are reactivated first
+        remove_attributes = None
+        if status in [STATUS_DELETED, STATUS_DENIED]:
+            if self._retention_days is not None:
+                set_values[EXPIRES_AT] = int(time.time() + self._retention_days * 86400)
+        else:
+            remove_attributes = [EXPIRES_AT]
 
-        return self._handle_update(args)
+        return self._handle_update(subscription_id=subscription_id, action=ACTION_UPDATE_STATUS, set_values=set_values,
+                                   expected_status=[from_status],
+                                   remove_attributes=remove_attributes, notes=notes,
+                                   counter_deltas=_counter_deltas(current, from_status, status),
+                                   retry_transition=_retry_transition)
@@ -0,0 +1,60 @@
+import gzip
+import json
+import threading
+import data_mesh_util.lib.utils as utils
+
+
+class SubscriptionArchive:
+    '''
+    Appends subscriptions to a gzip compressed, newline delimited JSON file. Opening an existing archive adds a new gzip
+    member to the end of the file, and gzip readers treat consecutive members as one stream, so an archive can be
+    written to by many runs.
+    '''
+    _path = None
+    _file = None
+    _lock = None
+    _count = 0
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, items: list) -> None:
+        '''
+        Appends subscriptions to the archive, such as a page of subscriptions which have been removed from the store.
+        The file is flushed once the whole list is written
+        :param items:
+        :return:
+        '''
+        with self._lock:
+            for item in items:
+                self._file.write(json.dumps(item, default=utils.dynamo_json_default))
+                self._file.write('\n')
+            self._file.flush()
+            self._count += len(items)
+
+    def handle_event(self, event) -> None:
+        '''
+        Handler for a SubscriptionStreamConsumer, which archives the subscriptions that DynamoDB removed through Time
+        to Live before they could be archived by SubscriberTracker.archive_expired()
+        :param event: SubscriptionEvent
+        :return:
+        '''
+        if event.expired is True and event.previous is not None:
+            self.write([event.previous])
+
+    def get_count(self) -> int:
+        return self._count
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,271 @@
+STATUS_ACTIVE = 'Active'
+STATUS_DENIED = 'Denied'
+STATUS_PENDING = 'Pending'
+STATUS_DELETED = 'Deleted'
+SUBSCRIPTION_ID = 'SubscriptionId'
+OWNER_PRINCIPAL = 'OwnerPrincipal'
+SUBSCRIBER_PRINCIPAL = 'SubscriberPrincipal'
+STATUS = 'Status'
+CREATION_DATE = 'CreationDate'
+CREATED_BY = 'CreatedBy'
+UPDATED_DATE = 'UpdatedDate'
+UPDATED_BY = 'UpdatedBy'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+DATABASE_NAME = 'DatabaseName'
+TABLE_NAME = 'TableName'
+REQUESTED_GRANTS = 'RequestedGrants'
+PERMITTED_GRANTS = 'PermittedGrants'
+GRANTABLE_GRANTS = 'GrantableGrants'
+TABLE_ARNS = 'GrantedTableARNs'
+RAM_SHARES = 'RamShares'
+NOTES = 'Notes'
+FINGERPRINT = 'Fingerprint'
+
+# UTC epoch millisecond timestamps, which unlike the date strings above can be compared across timezones
+CREATED_AT = 'CreatedAt'
+UPDATED_AT = 'UpdatedAt'
+NUMERIC_ATTRIBUTES = [CREATED_AT, UPDATED_AT]
+
+# a request whose fingerprint matches a subscription in one of these Statuses creates a new subscription rather than
+# returning the closed one, so that access can be requested again after a denial or deletion
+REPLACEABLE_STATUSES = [STATUS_DELETED, STATUS_DENIED]
+
+# UTC epoch seconds after which a deleted or denied subscription may be archived and removed. DynamoDB uses this as the
+# table's Time to Live attribute
+EXPIRES_AT = 'ExpiresAt'
+
+# notes and status transitions are recorded as separate history records, so that a subscription stays the same size
+# however often it changes. The subscription only keeps the most recent note and a count of all notes
+LATEST_NOTE = 'LatestNote'
+NOTE_COUNT = 'NoteCount'
+HISTORY_ID = 'HistoryId'
+EVENT_TIME = 'EventTime'
+EVENT_BY = 'EventBy'
+ACTION = 'Action'
+CHANGES = 'Changes'
+NOTE = 'Note'
+ACTION_CREATE = 'Create'
+ACTION_UPDATE_STATUS = 'UpdateStatus'
+ACTION_UPDATE_GRANTS = 'UpdateGrants'
+ACTION_IMPORT = 'Import'
+
+# subscription counts by Status are maintained for each owner, subscriber and database, in counters identified by
+# '<attribute name>#<value>', such as 'OwnerPrincipal#111111111111'
+COUNTED_ATTRIBUTES = [OWNER_PRINCIPAL, SUBSCRIBER_PRINCIPAL, DATABASE_NAME]
+
+# secondary indexes maintained over subscriptions, as index suffix -> (hash key, range key). Each store engine keeps an
+# equivalent index, and the DynamoDB query planner picks between these and a full table scan based upon which filters
+# are supplied to list_subscriptions
+OWNER_INDEX = 'Owner'
+SUBSCRIBER_INDEX = 'Subscriber'
+DATABASE_INDEX = 'Database'
+OWNER_DATABASE_INDEX = 'OwnerDatabase'
+OWNER_UPDATED_INDEX = 'OwnerUpdated'
+SUBSCRIBER_UPDATED_INDEX = 'SubscriberUpdated'
+INDEX_KEYS = {
+    OWNER_INDEX: (OWNER_PRINCIPAL, STATUS),
+    SUBSCRIBER_INDEX: (SUBSCRIBER_PRINCIPAL, None),
+    DATABASE_INDEX: (DATABASE_NAME, STATUS),
+    OWNER_DATABASE_INDEX: (OWNER_PRINCIPAL, DATABASE_NAME),
+    OWNER_UPDATED_INDEX: (OWNER_PRINCIPAL, UPDATED_AT),
+    SUBSCRIBER_UPDATED_INDEX: (SUBSCRIBER_PRINCIPAL, UPDATED_AT)
+}
+
+# index used to find the subscriptions changed since a point in time, for each principal attribute
+UPDATED_INDEXES = {
+    OWNER_PRINCIPAL: OWNER_UPDATED_INDEX,
+    SUBSCRIBER_PRINCIPAL: SUBSCRIBER_UPDATED_INDEX
+}
+
+
+class SubscriptionStore:
+    '''
+    Storage interface used by the SubscriberTracker. Subscriptions are dicts of attribute name to value, keyed by
+    SubscriptionId and de-duplicated by Fingerprint. All business rules, such as which status transitions are valid,
+    stay in the SubscriberTracker, so that every engine behaves the same way.
+    '''
+    _metrics = None
+
+    def set_metrics(self, metrics) -> None:
+        '''
+        Sets the MetricsRegistry to which engines report the cost of each storage request
+        :param metrics:
+        :return:
+        '''
+        self._metrics = metrics
+
+    def get_endpoints(self) -> dict:
+        '''
+        Returns the locations at which subscriptions are stored, creating the storage if required
+        :return:
+        '''
+        raise NotImplementedError()
+
+    def create(self, item: dict, history: dict = None, counter_deltas: dict = None) -> tuple:
+        '''
+        Stores a new subscription, unless a subscription with the same Fingerprint already exists
+        :param item:
+        :param history: History record written together with the subscription
+        :param counter_deltas: dict of counter ID to a dict of Status to the amount to add, applied together with the
+        subscription
+        :return: tuple of the Subscription ID and whether it already existed
+        '''
+        raise NotImplementedError()
+
+    def create_many(self, items: list, histories: list = None, counter_deltas: list = None) -> dict:
+        '''
+        Stores many new subscriptions, skipping those whose Fingerprint already exists
+        :param items: list of subscriptions, each with a unique Fingerprint
+        :param histories: list of history records, one for each item, written together with the subscription
+        :param counter_deltas: list of counter deltas, one for each item, applied only if the item is created
+        :return: dict of Fingerprint to existing Subscription ID for the items which were not created
+        '''
+        raise NotImplementedError()
+
+    def get(self, subscription_id: str, consistent_read: bool = True) -> dict:
+        '''
+        Returns a single subscription, or None if it doesn't exist
+        :param subscription_id:
+        :param consistent_read:
+        :return:
+        '''
+        raise NotImplementedError()
+
+    def get_many(self, subscription_ids: list, consistent_read: bool = True, max_workers: int = 4) -> list:
+        '''
+        Returns the subscriptions which exist out of a list of Subscription IDs, in no particular order
+        :param subscription_ids:
+        :param consistent_read:
+        :param max_workers: Number of requests which may be run in parallel
+        :return:
+        '''
+        raise NotImplementedError()
+
+    def update(self, subscription_id: str, set_values: dict, add_values: dict = None, expected_status: list = None,
+               remove_attributes: list = None, history: dict = None, counter_deltas: dict = None,
+               on_condition_failure=None) -> dict:
+        '''
+        Atomically updates an existing subscription
+        :param subscription_id:
+        :param set_values: dict of attribute name to new value
+        :param add_values: dict of attribute name to a set which is added to the current set, or a number which is
+        added to the current number
+        :param expected_status: Only apply the update if the current Status is one of these values
+        :param remove_attributes: list of attribute names to remove
+        :param history: History record which is only written if the update is applied
+        :param counter_deltas: Counter changes which are only applied if the update is applied
+        :param on_condition_failure: Function called with the subscription as found, or None if it doesn't exist, when
+        the update is not applied. Only called where the store can report the subscription without another request
+        :return: dict of the values which were set, or None if the subscription doesn't exist or is not in an expected
+        Status. Values changed by add_values are not returned, as DynamoDB transactions can't return updated attributes
+        '''
+        raise NotImplementedError()
+
+    def query(self, filters: dict, exclude_deleted: bool = True, start_token: dict = None,
+              page_size: int = None) -> tuple:
+        '''
+        Returns one page of subscriptions whose attributes equal the supplied filters. Lookups by subscriber
+        principal, or by owner with an optional status, are served from an index
+        :param filters: dict of attribute name to required value. None values are ignored
+        :param exclude_deleted: Whether to exclude deleted subscriptions
+        :param start_token: Token returned by a previous call, from which to continue
+        :param page_size: Maximum number of subscriptions to evaluate
+        :return: tuple of the list of subscriptions, and the token for the next page or None if there are no more
+        '''
+        raise NotImplementedError()
+
+    def query_updated_since(self, principal_attribute: str, principal: str, since: int, start_token: dict = None,
+                            page_size: int = None) -> tuple:
+        '''
+        Returns one page of the subscriptions of an owner or subscriber which were updated at or after a point in time,
+        including those which have been deleted, in ascending order of UpdatedAt
+        :param principal_attribute: Either OwnerPrincipal or SubscriberPrincipal
+        :param principal:
+        :param since: UTC epoch milliseconds
+        :param start_token:
+        :param page_size:
+        :return: tuple of the list of subscriptions, and the token for the next page or None if there are no more
+        '''
+        raise NotImplementedError()
+
+    def get_history(self, subscription_id: str, start_token: dict = None, page_size: int = None) -> tuple:
+        '''
+        Returns one page of the history records of a subscription, oldest first
+        :param subscription_id:
+        :param start_token:
+        :param page_size:
+        :return: tuple of the list of history records, and the token for the next page or None if there are no more
+        '''
+        raise NotImplementedError()
+
+    def get_counts(self, counter_id: str) -> dict:
+        '''
+        Returns the number of subscriptions in each Status for a counter
+        :param counter_id:
+        :return: dict of Status to count
+        '''
+        raise NotImplementedError()
+
+    def set_counts(self, counter_id: str, counts: dict) -> None:
+        '''
+        Overwrites a counter, used when counts are rebuilt from the subscriptions themselves
+        :param counter_id:
+        :param counts: dict of Status to count
+        :return:
+        '''
+        raise NotImplementedError()
+
+    def list_counter_ids(self) -> list:
+        '''
+        Returns the ID of every counter which has been written, including counters of subscriptions which no longer
+        exist
+        :return:
+        '''
+        raise NotImplementedError()
+
+    def explain(self, filters: dict) -> dict:
+        '''
+        Reports how query() would satisfy the supplied filters
+        :param filters:
+        :return:
+        '''
+        raise NotImplementedError()
+
+    def scan_segment(self, segment: int, total_segments: int, start_token: dict = None) -> tuple:
+        '''
+        Returns one page of all subscriptions in a segment of the store. Segments may be read concurrently
+        :param segment:
+        :param total_segments:
+        :param start_token:
+        :return: tuple of the list of subscriptions, and the token for the next page or None if there are no more
+        '''
+        raise NotImplementedError()
+
+    def enable_expiry(self) -> bool:
+        '''
+        Configures the store to remove subscriptions once their ExpiresAt has passed, where the engine supports it
+        :return: True if expiry was enabled by this call
+        '''
+        raise NotImplementedError()
+
+    def scan_expired(self, before: int, segment: int, total_segments: int, start_token: dict = None) -> tuple:
+        '''
+        Returns one page of the subscriptions in a segment of the store whose ExpiresAt is at or before a point in time
+        :param before: UTC epoch seconds
+        :param segment:
+        :param total_segments:
+        :param start_token:
+        :return: tuple of the list of subscriptions, and the token for the next page or None if there are no more
+        '''
+        raise NotImplementedError()
+
+    def delete_expired(self, item: dict, before: int, counter_deltas: dict = None) -> bool:
+        '''
+        Permanently removes a subscription, along with its Fingerprint, if its ExpiresAt is at or before a point in
+        time. Subscriptions which have been reactivated in the meantime no longer have an ExpiresAt, and are kept
+        :param item: The subscription, as returned by scan_expired
+        :param counter_deltas: Counter changes which are only applied if the subscription is removed
+        :param before: UTC epoch seconds
+        :return: True if the subscription was removed
+        '''
+        raise NotImplementedError()
@@ -0,0 +1,353 @@
+import json
+import logging
+import threading
+import botocore.exceptions
+from enum import Enum
+from boto3.dynamodb.types import TypeDeserializer
+from data_mesh_util.lib.SubscriptionStore import *
+import data_mesh_util.lib.utils as utils
+
+# marker stored in a checkpoint once a shard has been closed and every record in it has been processed
+SHARD_END = 'SHARD_END'
+REPLAY_SHARD = 'replay'
+STREAM_RECORD_LIMIT = 1000
+# principal recorded against items removed by DynamoDB Time to Live
+TTL_PRINCIPAL = 'dynamodb.amazonaws.com'
+
+
+class SubscriptionEventType(Enum):
+    CREATED = 1
+    APPROVED = 2
+    DENIED = 3
+    DELETED = 4
+    IMPORTED = 5
+    UPDATED = 6
+
+
+class SubscriptionEvent:
+    '''
+    A change to a subscription, classified from a DynamoDB stream record
+    '''
+    event_type = None
+    subscription_id = None
+    subscription = None
+    previous = None
+    sequence_number = None
+    approximate_creation_time = None
+    expired = False
+
+    def __init__(self, event_type: SubscriptionEventType, subscription_id: str, subscription: dict,
+                 previous: dict = None, sequence_number: str = None, approximate_creation_time=None,
+                 expired: bool = False):
+        self.event_type = event_type
+        self.subscription_id = subscription_id
+        self.subscription = subscription
+        self.previous = previous
+        self.sequence_number = sequence_number
+        self.approximate_creation_time = approximate_creation_time
+        self.expired = expired
+
+    def __repr__(self):
+        return f"SubscriptionEvent({self.event_type.name}, {self.subscription_id}, {self.sequence_number})"
+
+    @staticmethod
+    def from_stream_record(record: dict):
+        '''
+        Builds an event from a DynamoDB stream record, as returned by GetRecords with a NEW_AND_OLD_IMAGES view
+        :param record:
+        :return:
+        '''
+        deserializer = TypeDeserializer()
+        change = record.get('dynamodb', {})
+
+        def _image(name: str) -> dict:
+            image = change.get(name)
+            return None if image is None else {k: deserializer.deserialize(v) for k, v in image.items()}
+
+        new = _image('NewImage')
+        old = _image('OldImage')
+        keys = _image('Keys') or {}
+        event_name = record.get('eventName')
+
+        if event_name == 'INSERT':
+            event_type = SubscriptionEventType.CREATED
+        elif event_name == 'REMOVE':
+            event_type = SubscriptionEventType.DELETED
+        else:
+            new_status = (new or {}).get(STATUS)
+            if new_status != (old or {}).get(STATUS):
+                event_type = {
+                    STATUS_ACTIVE: SubscriptionEventType.APPROVED,
+                    STATUS_DENIED: SubscriptionEventType.DENIED,
+                    STATUS_DELETED: SubscriptionEventType.DELETED,
+                    STATUS_PENDING: SubscriptionEventType.CREATED
+                }.get(new_status, SubscriptionEventType.UPDATED)
+            elif (new or {}).get('ImportedToConsumer') is True and (old or {}).get('ImportedToConsumer') is not True:
+                event_type = SubscriptionEventType.IMPORTED
+            else:
+                event_type = SubscriptionEventType.UPDATED
+
+        # items removed by Time to Live, rather than by a caller, are attributed to the DynamoDB service
+        identity = record.get('userIdentity') or {}
+        expired = event_name == 'REMOVE' and identity.get('type') == 'Service' and identity.get(
+            'principalId') == TTL_PRINCIPAL
+
+        return SubscriptionEvent(event_type=event_type, subscription_id=keys.get(SUBSCRIPTION_ID),
+                                 subscription=new, previous=old, sequence_number=change.get('SequenceNumber'),
+                                 approximate_creation_time=change.get('ApproximateCreationDateTime'),
+                                 expired=expired)
+
+
+class DynamoStreamSource:
+    '''
+    Reads records from every shard of a DynamoDB stream. Child shards are only read once their parent has been
+    completely processed, so that changes to a subscription are always seen in order
+    '''
+    _stream_arn = None
+    _client = None
+    _initial_position = None
+    _iterators = None
+    _logger = None
+
+    def __init__(self, credentials, region_name: str, stream_arn: str, initial_position: str = 'TRIM_HORIZON'):
+        '''
+        :param credentials:
+        :param region_name:
+        :param stream_arn:
+        :param initial_position: Where to start reading shards which have no checkpoint, either TRIM_HORIZON or LATEST
+        '''
+        self._stream_arn = stream_arn
+        self._client = utils.generate_client(service='dynamodbstreams', region=region_name, credentials=credentials)
+        self._initial_position = initial_position
+        self._iterators = {}
+        self._logger = logging.getLogger("DynamoStreamSource")
+
+    def _list_shards(self) -> list:
+        shards = []
+        args = {'StreamArn': self._stream_arn}
+        while True:
+            description = self._client.describe_stream(**args).get('StreamDescription')
+            shards.extend(description.get('Shards', []))
+
+            last_shard = description.get('LastEvaluatedShardId')
+            if last_shard is None:
+                return shards
+            else:
+                args['ExclusiveStartShardId'] = last_shard
+
+    def _get_iterator(self, shard_id: str, position: str, initial_position: str = None) -> str:
+        args = {
+            'StreamArn': self._stream_arn,
+            'ShardId': shard_id
+        }
+        if position is None:
+            args['ShardIteratorType'] = self._initial_position if initial_position is None else initial_position
+        else:
+            args['ShardIteratorType'] = 'AFTER_SEQUENCE_NUMBER'
+            args['SequenceNumber'] = position
+
+        return self._client.get_shard_iterator(**args).get('ShardIterator')
+
+    def reset(self, shard_id: str) -> None:
+        '''
+        Discards the position within a shard, so that the next poll resumes from the checkpoint
+        '''
+        self._iterators.pop(shard_id, None)
+
+    def poll(self, checkpoint: dict) -> list:
+        '''
+        Reads the next page of records from each shard which is ready to be read
+        :param checkpoint: dict of shard ID to the sequence number of the last record processed, or SHARD_END
+        :return: list of tuples of (shard ID, records, whether the shard has now been completely read)
+        '''
+        shards = self._list_shards()
+        shard_ids = [s.get('ShardId') for s in shards]
+
+        out = []
+        for shard in shards:
+            shard_id = shard.get('ShardId')
+            parent = shard.get('ParentShardId')
+
+            # skip shards already drained, and those whose parent still has records to process
+            if checkpoint.get(shard_id) == SHARD_END or (
+                    parent in shard_ids and checkpoint.get(parent) != SHARD_END):
+                continue
+
+            iterator = self._iterators.get(shard_id)
+            if iterator is None:
+                # the children of a shard we have processed must be read from the start, so that nothing is missed
+                iterator = self._get_iterator(shard_id, checkpoint.get(shard_id),
+                                              'TRIM_HORIZON' if checkpoint.get(parent) == SHARD_END else None)
+
+            try:
+                response = self._client.get_records(ShardIterator=iterator, Limit=STREAM_RECORD_LIMIT)
+            except botocore.exceptions.ClientError as e:
+                code = e.response.get('Error', {}).get('Code')
+                if code == 'ExpiredIteratorException':
+                    # iterators expire after 15 minutes, so resume from the checkpoint on the next poll
+                    self._iterators.pop(shard_id, None)
+                    continue
+                elif code == 'TrimmedDataAccessException':
+                    self._logger.warning(f"Records in Shard {shard_id} have been trimmed before being processed")
+                    self._iterators[shard_id] = self._get_iterator(shard_id, None, 'TRIM_HORIZON')
+                    continue
+                else:
+                    raise e
+
+            next_iterator = response.get('NextShardIterator')
+            if next_iterator is None:
+                self._iterators.pop(shard_id, None)
+            else:
+                self._iterators[shard_id] = next_iterator
+
+            out.append((shard_id, response.get('Records', []), next_iterator is None))
+
+        return out
+
+
+class JsonlReplaySource:
+    '''
+    Replays DynamoDB stream records from a newline delimited JSON file, one GetRecords record per line. Useful for
+    testing handlers without access to a stream
+    '''
+    _path = None
+
+    def __init__(self, path: str):
+        self._path = path
+
+    def reset(self, shard_id: str) -> None:
+        # every poll reads from the checkpoint
+        pass
+
+    def poll(self, checkpoint: dict) -> list:
+        if checkpoint.get(REPLAY_SHARD) == SHARD_END:
+            return []
+
+        # the checkpoint for a replay is the last line number processed
+        start = int(checkpoint.get(REPLAY_SHARD, 0))
+
+        records = []
+        with open(self._path, 'r') as f:
+            for line_number, line in enumerate(f, start=1):
+                if line_number > start and line.strip() != '':
+                    record = json.loads(line)
+                    # checkpoints are line numbers, so replace any captured sequence number with the line number
+                    record.setdefault('dynamodb', {})['SequenceNumber'] = str(line_number)
+                    records.append(record)
+
+        return [(REPLAY_SHARD, records, True)]
+
+
+class SubscriptionStreamConsumer:
+    '''
+    Delivers subscription change events from a stream source to registered handlers. Processing is at least once: a
+    shard's checkpoint only advances after every handler has processed a record, so a failed handler sees the record
+    again on the next poll. Checkpoints can be persisted in the local state file to resume after a restart.
+    '''
+    _source = None
+    _handlers = None
+    _checkpoint = None
+    _checkpoint_name = None
+    _logger = None
+
+    def __init__(self, source, checkpoint_name: str = None, log_level: str = "INFO"):
+        '''
+        :param source: A DynamoStreamSource or JsonlReplaySource
+        :param checkpoint_name: Name under which to persist the checkpoint. If not supplied the checkpoint is only held
+        in memory
+        :param log_level:
+        '''
+        self._source = source
+        self._handlers = {}
+        self._checkpoint_name = checkpoint_name
+        self._logger = logging.getLogger("SubscriptionStreamConsumer")
+        self._logger.setLevel(log_level)
+
+        checkpoint = None
+        if checkpoint_name is not None:
+            checkpoint = utils.load_local_state(self._checkpoint_key())
+        self._checkpoint = checkpoint if checkpoint is not None else {}
+
+    def _checkpoint_key(self) -> str:
+        return f"stream-checkpoint/{self._checkpoint_name}"
+
+    def register(self, handler, event_type: SubscriptionEventType = None) -> None:
+        '''
+        Registers a function which is called with each SubscriptionEvent of a type
+        :param handler:
+        :param event_type: The type of event to handle, or None to receive every event
+        :return:
+        '''
+        self._handlers.setdefault(event_type, []).append(handler)
+
+    def on(self, event_type: SubscriptionEventType = None):
+        '''
+        Decorator form of register()
+        '''
+
+        def _decorator(handler):
+            self.register(handler=handler, event_type=event_type)
+            return handler
+
+        return _decorator
+
+    def get_checkpoint(self) -> dict:
+        return dict(self._checkpoint)
+
+    def _save_checkpoint(self) -> None:
+        if self._checkpoint_name is not None:
+            utils.save_local_state(self._checkpoint_key(), self._checkpoint)
+
+    def _dispatch(self, event: SubscriptionEvent) -> None:
+        for handler in self._handlers.get(event.event_type, []) + self._handlers.get(None, []):
+            handler(event)
+
+    def process(self) -> int:
+        '''
+        Polls the source once and delivers every record read to the registered handlers
+        :return: The number of events delivered
+        '''
+        delivered = 0
+        for shard_id, records, finished in self._source.poll(self.get_checkpoint()):
+            for record in records:
+                try:
+                    self._dispatch(SubscriptionEvent.from_stream_record(record))
+                except Exception as e:
+                    # keep what has been processed so far, and read this record again on the next poll
+                    self._save_checkpoint()
+                    self._source.reset(shard_id)
+                    raise e
+
+                delivered += 1
+                self._checkpoint[shard_id] = record.get('dynamodb', {}).get('SequenceNumber')
+
+            if finished:
+                self._checkpoint[shard_id] = SHARD_END
+
+            if len(records) > 0 or finished:
+                self._save_checkpoint()
+
+        return delivered
+
+    def run(self, poll_interval_seconds: float = 1.0, stop: threading.Event = None, until_idle: bool = False) -> int:
+        '''
+        Processes events until stopped
+        :param poll_interval_seconds: Time to wait between polls which return no events
+        :param stop: Event which ends processing when set
+        :param until_idle: Return once a poll delivers no events, such as at the end of a replay
+        :return: The total number of events delivered
+        '''
+        stop = stop if stop is not None else threading.Event()
+
+        total = 0
+        while not stop.is_set():
+            delivered = self.process()
+            total += delivered
+
+            if delivered == 0:
+                if until_idle is True:
+                    break
+
+                stop.wait(poll_interval_seconds)
+
+        return total
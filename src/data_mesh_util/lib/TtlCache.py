@@ -0,0 +1,83 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+
+class TtlCache:
+    '''
+    Thread safe in-process LRU cache where each entry also expires after a fixed time to live. Values are copied on
+    the way in and out so that callers can't mutate cached state.
+    '''
+    _max_size = None
+    _ttl_seconds = None
+    _entries = None
+    _lock = None
+    _hits = 0
+    _misses = 0
+    _evictions = 0
+    _expirations = 0
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        if max_size is None or max_size < 1:
+            raise Exception("Cache size must be at least 1")
+
+        self._max_size = max_size
+        self._ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        Returns the cached value for a key, or None if the key is not cached or has expired
+        :param key:
+        :return:
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self._misses += 1
+                return None
+
+            expires, value = entry
+            if self._ttl_seconds is not None and time.monotonic() >= expires:
+                del self._entries[key]
+                self._expirations += 1
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+
+            return copy.deepcopy(value)
+
+    def put(self, key, value) -> None:
+        expires = None if self._ttl_seconds is None else time.monotonic() + self._ttl_seconds
+
+        with self._lock:
+            self._entries[key] = (expires, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+
+            # evict the least recently used entries
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                'Size': len(self._entries),
+                'Hits': self._hits,
+                'Misses': self._misses,
+                'Evictions': self._evictions,
+                'Expirations': self._expirations
+            }
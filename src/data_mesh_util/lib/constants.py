@@ -15,6 +15,42 @@ DATA_MESH_IAM_PATH = '/AwsDataMesh/'
 PRODUCER_POLICY_NAME = 'DataMeshProducerAccess'
 CONSUMER_POLICY_NAME = 'DataMeshConsumerAccess'
 SUBSCRIPTIONS_TRACKER_TABLE = 'AwsDataMeshSubscriptions'
+SUBSCRIPTION_RECORDS_TABLE = 'AwsDataMeshSubscriptionRecords'
+SUBSCRIPTION_CACHE_SIZE = 256
+SUBSCRIPTION_CACHE_TTL_SECONDS = 60
+SUBSCRIPTION_RETENTION_DAYS = 30
+LF_TAG_LOOKUP_WORKERS = 8
+PARTITION_BATCH_SIZE = 100
+PARTITION_DELETE_BATCH_SIZE = 25
+PARTITION_LIST_SEGMENTS = 4
+MAX_PARTITION_SEGMENTS = 10
+# date formats recognised when detecting Athena partition projection settings, as (projection format, strptime format,
+# projection interval unit)
+PARTITION_PROJECTION_DATE_FORMATS = [
+    ('yyyy-MM-dd', '%Y-%m-%d', 'DAYS'),
+    ('yyyyMMdd', '%Y%m%d', 'DAYS'),
+    ('yyyy-MM-dd-HH', '%Y-%m-%d-%H', 'HOURS'),
+    ('yyyyMMddHH', '%Y%m%d%H', 'HOURS')
+]
+PARTITION_PROJECTION_HOUR_KEYS = ['hour', 'hr', 'hh']
+LF_BATCH_SIZE = 20
+LF_BATCH_WORKERS = 4
+LF_MAX_ATTEMPTS = 5
+LF_RETRY_BASE_SECONDS = 0.5
+# Lake Formation error codes for which a request, or an entry of a batch request, is retried
+LF_RETRYABLE_ERROR_CODES = ['ConcurrentModificationException', 'ThrottlingException', 'InternalServiceException',
+                            'OperationTimeoutException']
+NUMERIC_PARTITION_KEY_TYPES = ['tinyint', 'smallint', 'int', 'integer', 'bigint', 'float', 'double', 'decimal']
+PARTITION_REPLICATION_WORKERS = 4
+PARTITION_MAX_ATTEMPTS = 5
+PARTITION_RETRY_BASE_SECONDS = 0.5
+# mesh table parameter holding the highest first partition key value synchronised from a time ordered source table
+PARTITION_HIGH_WATER_MARK_PARAMETER = 'data_mesh_partition_high_water_mark'
+# Glue error codes for which a request, or an entry of a batch request, is retried
+GLUE_RETRYABLE_ERROR_CODES = ['ThrottlingException', 'InternalServiceException', 'OperationTimeoutException',
+                              'ConcurrentModificationException']
+# sustained requests per second made by an ApiAutomator to each service, across all of its threads
+SERVICE_REQUESTS_PER_SECOND = {'glue': 50, 'lakeformation': 50}
 MESH = 'Mesh'
 PRODUCER = 'Producer'
 CONSUMER = 'Consumer'
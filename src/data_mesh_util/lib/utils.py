@@ -11,7 +11,9 @@ import pystache
 import botocore
 import boto3
 import datetime
+import decimal
 import json
+import time
 
 
 def make_iam_session_name(current_account):
@@ -31,9 +33,10 @@ def get_central_role_name(account_id: str, type: str) -> str:
         return f"{DATA_MESH_ADMIN_CONSUMER_ROLENAME}-{account_id}"
 
 
-def validate_correct_account(credentials, account_id: str, should_match: bool = True):
-    caller_account = generate_client(service='sts', region=None, credentials=credentials).get_caller_identity().get(
-        'Account')
+def validate_correct_account(credentials, account_id: str, should_match: bool = True, caller_account: str = None):
+    if caller_account is None:
+        caller_account = generate_client(service='sts', region=None, credentials=credentials).get_caller_identity().get(
+            'Account')
     if should_match is False and caller_account == account_id:
         raise Exception(
             f"Function should not run within the Data Mesh Account ({account_id}) ")
@@ -70,6 +73,32 @@ def remove_dict_keys(input_dict: dict, remove_keys: list) -> dict:
     return out
 
 
+def project(input_dict: dict, fields: list) -> dict:
+    '''
+    Returns a copy of a dict holding only the supplied fields, where nested fields are given as a dotted path such as
+    StorageDescriptor.Location. Fields which don't exist are ignored
+    :param input_dict:
+    :param fields:
+    :return:
+    '''
+    out = {}
+    for field in fields:
+        path = field.split('.')
+        value = input_dict
+        for p in path:
+            value = value.get(p) if isinstance(value, dict) else None
+            if value is None:
+                break
+
+        if value is not None:
+            target = out
+            for p in path[:-1]:
+                target = target.setdefault(p, {})
+            target[path[-1]] = value
+
+    return out
+
+
 def get_table_arn(region_name: str, catalog_id: str, database_name: str, table_name: str):
     # format is arn:aws:glue:region:account-id:table/database name/table name
     return f"arn:aws:glue:{region_name}:{catalog_id}:table/{database_name}/{table_name}"
@@ -214,6 +243,22 @@ def _validate_credentials(credentials) -> dict:
     return out
 
 
+def get_credentials_key(credentials) -> str:
+    '''
+    Returns the access key currently in use by a set of credentials, which changes whenever the credentials rotate
+    :param credentials:
+    :return:
+    '''
+    if credentials is None:
+        return None
+    elif isinstance(credentials, Mapping):
+        return credentials.get('AccessKeyId')
+    elif hasattr(credentials, 'get_frozen_credentials'):
+        return credentials.get_frozen_credentials().access_key
+    else:
+        return credentials.access_key
+
+
 def ensure_list(input_list: list) -> list:
     if input_list is None:
         return []
@@ -255,6 +300,59 @@ def load_client_info_from_file(from_path: str = None):
     return _region, _clients, _account_ids, _credentials_dict
 
 
+def _get_local_state_path() -> str:
+    return os.getenv('DataMeshStateFile', os.path.join(os.path.expanduser('~'), '.aws-data-mesh-utils', 'state.json'))
+
+
+def _read_local_state() -> dict:
+    try:
+        with open(_get_local_state_path(), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_local_state(key: str, max_age_seconds: int = None):
+    '''
+    Load a value previously stored with save_local_state, or None if there is no value or it is older than
+    max_age_seconds. The state file location can be set with environment variable DataMeshStateFile
+    :param key:
+    :param max_age_seconds:
+    :return:
+    '''
+    entry = _read_local_state().get(key)
+
+    if entry is None:
+        return None
+    elif max_age_seconds is not None and time.time() - entry.get('Updated', 0) > max_age_seconds:
+        return None
+    else:
+        return entry.get('Value')
+
+
+def save_local_state(key: str, value) -> None:
+    '''
+    Store a json serialisable value in the local state file. Failures are ignored as the state file is only a cache
+    :param key:
+    :param value:
+    :return:
+    '''
+    path = _get_local_state_path()
+    state = _read_local_state()
+    state[key] = {'Updated': time.time(), 'Value': value}
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write to a temporary file and then swap it in, so concurrent readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, default=dynamo_json_default)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
 def load_ram_shares(lf_client, data_mesh_account_id: str, database_name: str, table_name: str,
                     target_principal: str) -> dict:
     ram_shares = {}
@@ -345,6 +443,21 @@ def generate_resource(service: str, region: str, credentials):
         args['aws_session_token'] = use_creds.get('SessionToken')
     return boto3.resource(**args)
 
+
+def dynamo_json_default(value):
+    '''
+    json.dumps default handler for the Decimal and set types returned by DynamoDB
+    :param value:
+    :return:
+    '''
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value % 1 == 0 else float(value)
+    elif isinstance(value, (set, frozenset)):
+        return sorted(value)
+    else:
+        raise TypeError(f"Object of type {value.__class__.__name__} is not JSON serializable")
+
+
 def log_instance_signature(obj, logger) -> None:
     logger.debug(f"Instance Signature for {obj.__class__.__name__}")
     for attr in vars(obj):